@@ -0,0 +1,167 @@
+"""
+Batch analysis of GPX libraries
+
+Analyzes every GPX file under a directory (or matching a glob) in a process
+pool without rendering, and writes one row per file to a CSV or Parquet
+summary table. Finished rows are appended to a JSON-lines progress journal as
+they arrive, so an interrupted run resumes where it stopped instead of
+starting again.
+"""
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from gpx_analyser import analyze_gpx_file
+
+SUMMARY_COLUMNS = [
+    'file', 'size_bytes', 'mtime', 'tracks', 'segments', 'total_points', 'total_distance_km',
+    'avg_point_distance_m', 'median_point_distance_m', 'min_point_distance_m', 'max_point_distance_m',
+    'large_jump_count', 'max_jump_m', 'jitter_segment_count', 'jitter_point_count',
+    'time_gap_count', 'max_time_gap_s',
+    'filtered_5m_distance_km', 'filtered_10m_distance_km', 'jitter_filtered_distance_km',
+    'error'
+]
+
+# Filters whose distances the summary reports; the others are not run
+SUMMARY_FILTERS = ("Remove points < 5m apart", "Remove points < 10m apart", "Remove jitter clusters")
+
+# Count columns stay integers even when failed files leave them empty
+INTEGER_COLUMNS = [
+    'tracks', 'segments', 'total_points', 'large_jump_count',
+    'jitter_segment_count', 'jitter_point_count', 'time_gap_count'
+]
+
+
+def find_gpx_files(source):
+    """
+    List GPX files in a directory (recursively) or matching a glob pattern
+    """
+    if os.path.isdir(source):
+        paths = []
+        for root, _, files in os.walk(source):
+            paths.extend(os.path.join(root, name) for name in files if name.lower().endswith('.gpx'))
+    else:
+        paths = glob.glob(source, recursive=True)
+    return sorted(paths)
+
+
+def summarize_gpx_file(gpx_file_path):
+    """
+    Analyze one GPX file headlessly and flatten the statistics into a summary row
+
+    Errors are recorded in the row instead of being raised, so one bad file
+    does not stop a batch.
+    """
+    file_stat = os.stat(gpx_file_path)
+    row = dict.fromkeys(SUMMARY_COLUMNS)
+    row.update({
+        'file': gpx_file_path,
+        'size_bytes': file_stat.st_size,
+        'mtime': file_stat.st_mtime
+    })
+
+    try:
+        stats = analyze_gpx_file(gpx_file_path, stages=('filters',), filters=SUMMARY_FILTERS)['stats']
+    except Exception as e:
+        row['error'] = f"{type(e).__name__}: {e}"
+        return row
+
+    filtered = stats.get('filtered_distances', {})
+    row.update({
+        'tracks': stats['tracks'],
+        'segments': stats['segments'],
+        'total_points': stats['total_points'],
+        'total_distance_km': stats['total_distance'],
+        'avg_point_distance_m': stats['avg_point_distance'],
+        'median_point_distance_m': stats['median_point_distance'],
+        'min_point_distance_m': stats['min_point_distance'],
+        'max_point_distance_m': stats['max_point_distance'],
+        'large_jump_count': len(stats['large_jumps']),
+        'max_jump_m': max((dist for _, dist in stats['large_jumps']), default=None),
+        'jitter_segment_count': len(stats['jitter_segments']),
+        'jitter_point_count': sum(len(seg) for seg in stats['jitter_segments']),
+        'time_gap_count': len(stats['time_gaps']),
+        'max_time_gap_s': max((gap for _, gap in stats['time_gaps']), default=None),
+        'filtered_5m_distance_km': filtered.get("Remove points < 5m apart", {}).get('distance_km'),
+        'filtered_10m_distance_km': filtered.get("Remove points < 10m apart", {}).get('distance_km'),
+        'jitter_filtered_distance_km': filtered.get("Remove jitter clusters", {}).get('distance_km')
+    })
+    return row
+
+
+def load_progress(progress_path):
+    """
+    Read completed summary rows from a progress journal, keyed by file path
+    """
+    rows = {}
+    if not os.path.exists(progress_path):
+        return rows
+
+    with open(progress_path, 'r') as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a truncated last line; that file is simply redone
+                continue
+            rows[row['file']] = row
+    return rows
+
+
+def _is_current(row, gpx_file_path):
+    """
+    True if a journal row was produced from the file as it is on disk now
+    """
+    file_stat = os.stat(gpx_file_path)
+    return row['size_bytes'] == file_stat.st_size and row['mtime'] == file_stat.st_mtime
+
+
+def batch_analyze(source, output_path, processes=None, progress_path=None):
+    """
+    Analyze a directory or glob of GPX files and write a summary table
+
+    Parameters:
+    - source: Directory to walk or glob pattern (e.g. 'submissions/**/*.gpx')
+    - output_path: Summary table path; '.parquet' writes Parquet, anything else CSV
+    - processes: Worker processes (defaults to the CPU count)
+    - progress_path: Progress journal (defaults to output_path + '.progress.jsonl')
+
+    Returns:
+    - DataFrame with one summary row per file
+    """
+    import pandas as pd
+
+    if progress_path is None:
+        progress_path = output_path + '.progress.jsonl'
+
+    gpx_files = find_gpx_files(source)
+    done = load_progress(progress_path)
+    pending = [path for path in gpx_files if path not in done or not _is_current(done[path], path)]
+
+    print(f"Found {len(gpx_files)} GPX files, {len(gpx_files) - len(pending)} already analyzed")
+
+    if pending:
+        with open(progress_path, 'a') as journal, ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(summarize_gpx_file, path) for path in pending]
+            for completed, future in enumerate(as_completed(futures), 1):
+                row = future.result()
+                done[row['file']] = row
+                journal.write(json.dumps(row) + '\n')
+                journal.flush()
+
+                if completed % 100 == 0 or completed == len(pending):
+                    print(f"  Analyzed {completed}/{len(pending)} files")
+
+    summary = pd.DataFrame([done[path] for path in gpx_files], columns=SUMMARY_COLUMNS)
+    summary = summary.astype({column: 'Int64' for column in INTEGER_COLUMNS})
+
+    if output_path.endswith('.parquet'):
+        summary.to_parquet(output_path, index=False)
+    else:
+        summary.to_csv(output_path, index=False)
+
+    failed = summary['error'].notna().sum()
+    print(f"Summary table saved to: {output_path} ({len(summary)} files, {failed} failed)")
+
+    return summary
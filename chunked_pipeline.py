@@ -0,0 +1,331 @@
+"""
+Out-of-core processing of very large GPX files
+
+process_gpx_chunked streams a GPX file in fixed-size blocks of points. It
+computes distance, elevation gain and the distance and jitter filters for
+each block, carrying the state it needs (last point, running totals, last
+kept point, current jitter run) across block boundaries. Track segments
+are respected as in the DataFrame loaders: the gap between two segments is
+not measured, jitter runs end at a segment boundary and the distance filter
+restarts in each segment, keeping its first and last point. Each block is
+appended to raw column files and the result is exposed as read-only
+memory-mapped arrays, so peak memory depends on chunk_size rather than on
+the length of the track.
+"""
+import os
+import shutil
+import tempfile
+from datetime import timezone
+
+import numpy as np
+
+from gpx_stream import iter_gpx_points, parse_gpx_time
+from distance_models import get_distance_model, greedy_distance_filter
+from track_segments import segment_spans
+
+# Column name -> dtype of the spilled arrays
+COLUMNS = {
+    'segment': np.int32,
+    'latitude': np.float64,
+    'longitude': np.float64,
+    'elevation': np.float64,
+    'time': 'datetime64[s]',
+    'segment_distance': np.float64,
+    'cumulative_distance': np.float64,
+    'cumulative_elevation_gain': np.float64,
+    'keep_distance': np.bool_,
+    'keep_jitter': np.bool_
+}
+
+
+def _parse_time64(text):
+    """
+    Parse GPX time text to datetime64[s] in UTC (NaT when missing)
+    """
+    parsed = parse_gpx_time(text)
+    if parsed is None:
+        return np.datetime64('NaT', 's')
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(parsed, 's')
+
+
+def iter_point_blocks(gpx_file_path, chunk_size=100000):
+    """
+    Stream a GPX file as blocks of at most chunk_size points
+
+    Yields dictionaries of numpy arrays (segment, latitude, longitude,
+    elevation, time). Missing elevations are 0, as in the DataFrame loaders,
+    and missing times are NaT.
+    """
+    def new_block():
+        return {
+            'segment': np.empty(chunk_size, dtype=np.int32),
+            'latitude': np.empty(chunk_size),
+            'longitude': np.empty(chunk_size),
+            'elevation': np.empty(chunk_size),
+            'time': np.empty(chunk_size, dtype='datetime64[s]')
+        }
+
+    block = new_block()
+    size = 0
+    for segment, lat, lon, elevation, point_time in iter_gpx_points(gpx_file_path):
+        block['segment'][size] = segment
+        block['latitude'][size] = lat
+        block['longitude'][size] = lon
+        block['elevation'][size] = float(elevation) if elevation else 0
+        block['time'][size] = _parse_time64(point_time)
+        size += 1
+
+        if size == chunk_size:
+            yield block
+            block = new_block()
+            size = 0
+
+    if size:
+        yield {name: values[:size] for name, values in block.items()}
+
+
+class ChunkedTrack:
+    """
+    Result of process_gpx_chunked: totals plus memory-mapped per-point columns
+
+    Columns are read with track.column(name) (see COLUMNS). keep_distance and
+    keep_jitter are boolean masks of the points kept by each filter.
+    segment_offsets is the offsets index of the track segments (see
+    track_segments): segment k spans points segment_offsets[k]:segment_offsets[k + 1].
+    """
+
+    def __init__(self, work_dir, points, owns_work_dir):
+        self.work_dir = work_dir
+        self.points = points
+        self.totals = {}
+        self.segment_offsets = np.zeros(1, dtype=np.int64)
+        self._owns_work_dir = owns_work_dir
+
+    def _path(self, name):
+        return os.path.join(self.work_dir, f"{name}.bin")
+
+    def column(self, name, mode='r'):
+        """
+        Memory-mapped array of one column
+        """
+        if self.points == 0:
+            return np.empty(0, dtype=COLUMNS[name])
+        return np.memmap(self._path(name), dtype=COLUMNS[name], mode=mode, shape=(self.points,))
+
+    def to_dataframe(self, columns=None, mask=None):
+        """
+        Load selected columns (optionally only the rows of a keep mask) into a DataFrame
+        """
+        import pandas as pd
+
+        columns = columns or [name for name in COLUMNS if not name.startswith('keep_')]
+        rows = self.column(mask) if mask else slice(None)
+        return pd.DataFrame({name: np.asarray(self.column(name)[rows]) for name in columns})
+
+    def cleanup(self):
+        """
+        Delete the spilled column files if they live in a temporary directory
+        """
+        if self._owns_work_dir:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+def _distance_filter_block(lat, lon, starts, state, threshold_m, distance):
+    """
+    Greedy distance filter over one block, continuing from the last kept point in state
+
+    The filter restarts at every segment start, which is always kept.
+    """
+    keep = np.zeros(len(lat), dtype=np.bool_)
+    bounds = np.unique(np.concatenate(([0], np.flatnonzero(starts), [len(lat)])))
+    for start, stop in segment_spans(bounds):
+        anchor = None if starts[start] else state['last_kept']
+        kept = greedy_distance_filter(lat[start:stop], lon[start:stop], threshold_m, distance, anchor=anchor) + start
+        keep[kept] = True
+        if kept.size:
+            state['last_kept'] = (lat[kept[-1]], lon[kept[-1]])
+    return keep
+
+
+def _jitter_filter_block(step_m, starts, keep, offset, state, late_drops):
+    """
+    Drop runs of more than 5 consecutive moves under 1 m, carrying the open run across blocks
+
+    A segment start ends the current run.
+    """
+    keep[:] = True
+    run = state['run']
+    for i in range(len(step_m)):
+        index = offset + i
+        if not starts[i] and step_m[i] < 1:
+            state['run_length'] += 1
+            # Only the first 6 indices of a run are needed to drop it retroactively
+            if state['run_length'] <= 6:
+                run.append(index)
+            if state['run_length'] == 6:
+                for run_index in run:
+                    if run_index >= offset:
+                        keep[run_index - offset] = False
+                    else:
+                        late_drops.append(run_index)
+            elif state['run_length'] > 6:
+                keep[i] = False
+        else:
+            run.clear()
+            state['run_length'] = 0
+
+
+def _masked_distance(track, mask_name, chunk_size, distance):
+    """
+    Total distance in km between consecutive kept points of the same segment, read back block by block
+    """
+    keep = track.column(mask_name)
+    lat = track.column('latitude')
+    lon = track.column('longitude')
+    segment = track.column('segment')
+
+    total = 0.0
+    carry = None
+    for start in range(0, track.points, chunk_size):
+        block_keep = np.asarray(keep[start:start + chunk_size])
+        block_lat = np.asarray(lat[start:start + chunk_size])[block_keep]
+        block_lon = np.asarray(lon[start:start + chunk_size])[block_keep]
+        block_segment = np.asarray(segment[start:start + chunk_size])[block_keep]
+        if carry is not None:
+            block_lat = np.concatenate(([carry[0]], block_lat))
+            block_lon = np.concatenate(([carry[1]], block_lon))
+            block_segment = np.concatenate(([carry[2]], block_segment))
+        if len(block_lat):
+            steps = distance(block_lat[:-1], block_lon[:-1], block_lat[1:], block_lon[1:])
+            total += float(steps[block_segment[1:] == block_segment[:-1]].sum()) / 1000
+            carry = (block_lat[-1], block_lon[-1], block_segment[-1])
+    return total
+
+
+def process_gpx_chunked(gpx_file_path, chunk_size=100000, min_distance_m=5, work_dir=None, metrics=None,
+                        distance_model='haversine'):
+    """
+    Parse, measure and filter a GPX file in fixed-size blocks with bounded memory
+
+    Parameters:
+    - gpx_file_path: GPX file to process (.gz archives are supported)
+    - chunk_size: Points per block; peak memory is proportional to this
+    - min_distance_m: Threshold of the distance filter in meters
+    - work_dir: Directory for the spilled column files (a temporary one if omitted)
+    - metrics: Optional PipelineMetrics collecting stage timings and counters
+    - distance_model: Distance model name or callable (see distance_models); 'auto' is
+      resolved independently for each block
+
+    Returns:
+    - ChunkedTrack with totals and memory-mapped columns
+    """
+    owns_work_dir = work_dir is None
+    if owns_work_dir:
+        work_dir = tempfile.mkdtemp(prefix='gpx_chunks_')
+    else:
+        os.makedirs(work_dir, exist_ok=True)
+
+    track = ChunkedTrack(work_dir, 0, owns_work_dir)
+    files = {name: open(track._path(name), 'wb') for name in COLUMNS}
+
+    state = {
+        'last': None,
+        'distance_km': 0.0,
+        'elevation_gain_m': 0.0,
+        'last_kept': None,
+        'run': [],
+        'run_length': 0
+    }
+    late_drops = []
+    # Last points of segments that ended in an earlier block
+    late_keeps = []
+    boundaries = []
+
+    try:
+        for block in iter_point_blocks(gpx_file_path, chunk_size):
+            size = len(block['latitude'])
+            lat = block['latitude']
+            lon = block['longitude']
+            elevation = block['elevation']
+            segment = block['segment']
+
+            # Prepend the carried last point so the first step of the block is measured too
+            if state['last'] is not None:
+                prev_lat = np.concatenate(([state['last'][0]], lat[:-1]))
+                prev_lon = np.concatenate(([state['last'][1]], lon[:-1]))
+                prev_ele = np.concatenate(([state['last'][2]], elevation[:-1]))
+                prev_segment = np.concatenate(([state['last'][3]], segment[:-1]))
+            else:
+                prev_lat = np.concatenate((lat[:1], lat[:-1]))
+                prev_lon = np.concatenate((lon[:1], lon[:-1]))
+                prev_ele = np.concatenate((elevation[:1], elevation[:-1]))
+                prev_segment = np.concatenate(([-1], segment[:-1]))
+            starts = segment != prev_segment
+
+            distance = get_distance_model(distance_model, lat, lon)
+            step_km = np.where(starts, 0.0, distance(prev_lat, prev_lon, lat, lon) / 1000)
+            gain = np.maximum(elevation - prev_ele, 0)
+
+            # The point before each segment start ends a segment
+            start_indices = np.flatnonzero(starts)
+            boundaries.extend((track.points + start_indices).tolist())
+
+            block['segment_distance'] = step_km
+            block['cumulative_distance'] = state['distance_km'] + np.cumsum(step_km)
+            block['cumulative_elevation_gain'] = state['elevation_gain_m'] + np.cumsum(gain)
+
+            block['keep_distance'] = _distance_filter_block(lat, lon, starts, state, min_distance_m, distance)
+            block['keep_distance'][start_indices[start_indices > 0] - 1] = True
+            if starts[0] and track.points:
+                late_keeps.append(track.points - 1)
+
+            block['keep_jitter'] = np.empty(size, dtype=np.bool_)
+            _jitter_filter_block((step_km * 1000).tolist(), starts.tolist(), block['keep_jitter'], track.points, state,
+                                 late_drops)
+
+            for name, f in files.items():
+                np.asarray(block[name], dtype=COLUMNS[name]).tofile(f)
+
+            state['last'] = (lat[-1], lon[-1], elevation[-1], segment[-1])
+            state['distance_km'] = float(block['cumulative_distance'][-1])
+            state['elevation_gain_m'] = float(block['cumulative_elevation_gain'][-1])
+            track.points += size
+
+            if metrics:
+                metrics.count('points', size)
+    finally:
+        for f in files.values():
+            f.close()
+
+    if track.points:
+        # Always include the last point in the distance-filtered track
+        keep_distance = track.column('keep_distance', mode='r+')
+        keep_distance[-1] = True
+        if late_keeps:
+            keep_distance[np.asarray(late_keeps)] = True
+        keep_distance.flush()
+
+        # Jitter runs confirmed after their first points had already been spilled
+        if late_drops:
+            keep_jitter = track.column('keep_jitter', mode='r+')
+            keep_jitter[np.asarray(late_drops)] = False
+            keep_jitter.flush()
+
+    # 'auto' needs the whole track to resolve, so read-back totals use the named model or haversine
+    distance = distance_model if callable(distance_model) or not distance_model.startswith('auto') else 'haversine'
+    distance = get_distance_model(distance)
+    track.segment_offsets = np.asarray(boundaries + [track.points], dtype=np.int64) if track.points else track.segment_offsets
+    track.totals = {
+        'points': track.points,
+        'segments': len(track.segment_offsets) - 1,
+        'distance_km': state['distance_km'],
+        'elevation_gain_m': state['elevation_gain_m'],
+        'distance_filtered_points': int(np.count_nonzero(track.column('keep_distance'))),
+        'distance_filtered_km': _masked_distance(track, 'keep_distance', chunk_size, distance),
+        'jitter_filtered_points': int(np.count_nonzero(track.column('keep_jitter'))),
+        'jitter_filtered_km': _masked_distance(track, 'keep_jitter', chunk_size, distance)
+    }
+
+    return track
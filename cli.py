@@ -0,0 +1,279 @@
+"""
+Command line entry point for the Speed Project GPX tools
+
+Usage:
+    python cli.py analyze gpx/TSP_solo.gpx
+    python cli.py fix gpx/TSP_solo.gpx fixed.gpx --method distance --threshold 10
+    python cli.py batch submissions/ summary.csv --processes 8
+    python cli.py track gpx/HS_TSP_Solo.gpx --gpx-tail live.gpx
+    python cli.py plan gpx/HS_TSP_Solo.gpx gpx/JP_TSP_Solo.gpx --daily-distance 125
+    python cli.py compare gpx/HS_TSP_Solo.gpx gpx/LS_TSP_Solo.gpx gpx/JP_TSP_Solo.gpx
+    python cli.py profile gpx/HS_TSP_Solo.gpx gpx/LS_TSP_Solo.gpx --output-dir profiles
+    python cli.py verify gpx/HS_TSP_Solo.gpx TSP_solo.gpx --cases 20
+    python cli.py index gpx/ routes.sqlite
+    python cli.py search routes.sqlite --near 36.1,-115.2 --radius 2000
+
+Only argparse is imported up front. Each subcommand imports the modules it
+needs when it runs, so --help and non-rendering commands start quickly.
+"""
+import argparse
+import json
+import sys
+
+# Filter methods of the single-pass fixer (see gpx_analyser.stream_fix_gpx_file)
+STREAMING_FIX_METHODS = ('distance', 'jitter')
+
+
+def _api_key_from_args(args):
+    """
+    Google Maps API key from --api-key, or MAPS_API_KEY from the environment or a .env file
+    """
+    from route_compare import resolve_api_key
+    return resolve_api_key(args.api_key)
+
+
+def _metrics_from_args(args):
+    """
+    Build a PipelineMetrics object from the shared metrics options
+    """
+    from pipeline_metrics import PipelineMetrics
+    return PipelineMetrics(json_path=args.metrics_json, profile=args.profile, profile_path=args.profile_output)
+
+
+def run_analyze(args):
+    from gpx_analyser import analyze_gpx_file
+    stages = [stage for stage, skip in (('report', args.quiet), ('render', args.no_render), ('filters', args.no_filters)) if not skip]
+    analysis = analyze_gpx_file(args.gpx_file, metrics=_metrics_from_args(args), stages=stages, distance_model=args.distance_model)
+    if args.stats_json:
+        with open(args.stats_json, 'w') as f:
+            json.dump(analysis['stats'], f, indent=2)
+    return 0
+
+
+def run_fix(args):
+    from gpx_analyser import fix_gpx_file
+    fix_gpx_file(args.gpx_file, args.output, filter_method=args.method, threshold=args.threshold, streaming=args.streaming,
+                 distance_model=args.distance_model, dwell_radius=args.dwell_radius, min_dwell_s=args.min_dwell)
+    return 0
+
+
+def run_batch(args):
+    from batch_analyser import batch_analyze
+    batch_analyze(args.source, args.output, processes=args.processes)
+    return 0
+
+
+def run_chunked(args):
+    from chunked_pipeline import process_gpx_chunked
+    metrics = _metrics_from_args(args)
+    track = process_gpx_chunked(args.gpx_file, args.chunk_size, args.min_distance, args.work_dir, metrics, args.distance_model)
+    for name, value in track.totals.items():
+        print(f"  {name}: {value:.2f}" if isinstance(value, float) else f"  {name}: {value}")
+    if args.work_dir:
+        print(f"Column files saved to: {args.work_dir}")
+    else:
+        track.cleanup()
+    metrics.finish()
+    return 0
+
+
+def run_track(args):
+    import live_tracker
+    if args.gpx_tail:
+        feed = live_tracker.tail_gpx(args.gpx_tail, args.poll_interval, args.idle_timeout)
+    elif args.feed:
+        feed = live_tracker.tail_point_feed(args.feed, args.poll_interval, args.idle_timeout)
+    else:
+        feed = live_tracker.socket_point_feed(args.socket)
+
+    emit = (lambda stats: print(json.dumps(stats), flush=True)) if args.json else None
+    live_tracker.track_live(args.planned_gpx, feed, args.daily_distance, emit)
+    return 0
+
+
+def run_plan(args):
+    from route_compare import plan_routes
+    metrics = _metrics_from_args(args)
+    plan_routes(args.gpx_files, _api_key_from_args(args), args.daily_distance, metrics, compact=args.compact, report_memory=args.memory_report,
+                distance_model=args.distance_model, checkpoint_dir=args.checkpoint_dir)
+    metrics.finish()
+    return 0
+
+
+def run_compare(args):
+    from route_compare import main as compare_main
+    compare_main(args.gpx_files, _api_key_from_args(args), args.daily_distance, _metrics_from_args(args), args.distance_model,
+                 args.checkpoint_dir)
+    return 0
+
+
+def run_profile(args):
+    from route_profiles import render_profiles
+    render_profiles(args.gpx_files, args.output_dir, args.daily_distance, args.width, args.downsample, args.processes,
+                    args.distance_model)
+    return 0
+
+
+def run_verify(args):
+    from reference_check import print_check_report, run_checks
+    report = run_checks(args.gpx_files, args.cases, args.points, args.seed, args.distance_model, args.rtol, args.atol)
+    print_check_report(report)
+    if args.report:
+        report.to_csv(args.report, index=False)
+        print(f"Check report saved to: {args.report}")
+    return 0 if report['passed'].all() else 1
+
+
+def run_index(args):
+    from route_index import RouteIndex
+    with RouteIndex(args.index, piece_points=args.piece_points) as index:
+        counts = index.index_library(args.source, prune=not args.no_prune)
+        print(f"Indexed {counts['added']} routes ({counts['unchanged']} unchanged, {counts['removed']} removed), "
+              f"{len(index.routes())} routes in {args.index}")
+    return 0
+
+
+def run_search(args):
+    from route_index import RouteIndex, print_matches
+    with RouteIndex(args.index) as index:
+        if args.near:
+            lat, lon = (float(value) for value in args.near.split(','))
+            matches = index.near_point(lat, lon, args.radius)
+        elif args.bbox:
+            min_lat, min_lon, max_lat, max_lon = (float(value) for value in args.bbox.split(','))
+            matches = index.in_bbox(min_lat, min_lon, max_lat, max_lon)
+        else:
+            matches = index.near_gpx(args.corridor, args.radius)
+
+    if args.json:
+        print(json.dumps(matches, indent=2))
+    else:
+        print_matches(matches)
+    return 0
+
+
+def build_parser():
+    """
+    Build the argument parser with one subcommand per pipeline
+    """
+    metrics_options = argparse.ArgumentParser(add_help=False)
+    metrics_options.add_argument('--metrics-json', help='Write pipeline metrics to this JSON file')
+    metrics_options.add_argument('--profile', action='store_true', help='Dump cProfile output for the slowest stage')
+    metrics_options.add_argument('--profile-output', help='Save the cProfile dump to this file instead of printing it')
+
+    distance_options = argparse.ArgumentParser(add_help=False)
+    distance_options.add_argument('--distance-model', default='haversine',
+                                  help="equirectangular, haversine, vincenty, karney, or auto[:tolerance_m] "
+                                       "for the cheapest model within tolerance (default: haversine)")
+
+    route_options = argparse.ArgumentParser(add_help=False)
+    route_options.add_argument('gpx_files', nargs='+', help='GPX files to process')
+    route_options.add_argument('--api-key', help='Google Maps API key (defaults to MAPS_API_KEY from the environment or .env)')
+    route_options.add_argument('--daily-distance', type=float, default=125, help='Target daily distance in km (default: 125)')
+    route_options.add_argument('--checkpoint-dir', help='Save stage results here and reuse them on the next run if their inputs are unchanged')
+
+    parser = argparse.ArgumentParser(description='GPX analysis and ultra run route planning tools.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    analyze = subparsers.add_parser('analyze', parents=[metrics_options, distance_options], help='Analyze a GPX file for jumps, jitter and gaps')
+    analyze.add_argument('gpx_file', help='GPX file to analyze')
+    analyze.add_argument('--quiet', action='store_true', help='Do not print the analysis report')
+    analyze.add_argument('--no-render', action='store_true', help='Skip the histogram and analysis map')
+    analyze.add_argument('--no-filters', action='store_true', help='Skip the filtered distance comparison')
+    analyze.add_argument('--stats-json', help='Write the computed statistics to this JSON file')
+    analyze.set_defaults(func=run_analyze)
+
+    fix = subparsers.add_parser('fix', parents=[distance_options], help='Write a filtered copy of a GPX file')
+    fix.add_argument('gpx_file', help='GPX file to fix')
+    fix.add_argument('output', help='Path for the fixed GPX file')
+    fix.add_argument('--method', choices=['distance', 'jitter', 'stationary'], default='distance', help='Filter method (default: distance)')
+    fix.add_argument('--threshold', type=float, default=5, help='Minimum distance between points in meters (default: 5)')
+    fix.add_argument('--dwell-radius', type=float, default=25, help='Radius of a stationary period in meters (default: 25)')
+    fix.add_argument('--min-dwell', type=float, default=120, help='Minimum stationary period in seconds (default: 120)')
+    fix.add_argument('--streaming', action='store_true',
+                     help='Single-pass, constant-memory fix without analysis or rendering (distance and jitter methods only)')
+    fix.set_defaults(func=run_fix)
+
+    batch = subparsers.add_parser('batch', help='Analyze a directory or glob of GPX files into a summary table')
+    batch.add_argument('source', help='Directory to walk or glob pattern of GPX files')
+    batch.add_argument('output', help='Summary table path (.parquet for Parquet, otherwise CSV)')
+    batch.add_argument('--processes', type=int, help='Worker processes (default: CPU count)')
+    batch.set_defaults(func=run_batch)
+
+    chunked = subparsers.add_parser('chunked', parents=[metrics_options, distance_options], help='Measure and filter a very large GPX file in fixed-size blocks')
+    chunked.add_argument('gpx_file', help='GPX file (or .gpx.gz archive) to process')
+    chunked.add_argument('--chunk-size', type=int, default=100000, help='Points per block (default: 100000)')
+    chunked.add_argument('--min-distance', type=float, default=5, help='Distance filter threshold in meters (default: 5)')
+    chunked.add_argument('--work-dir', help='Keep the memory-mapped column files in this directory')
+    chunked.set_defaults(func=run_chunked)
+
+    track = subparsers.add_parser('track', help='Follow a run in progress against the planned route')
+    track.add_argument('planned_gpx', help='GPX file of the planned route')
+    source = track.add_mutually_exclusive_group(required=True)
+    source.add_argument('--gpx-tail', help='Growing GPX file written by a recorder')
+    source.add_argument('--feed', help='Growing text file with one point per line (JSON or CSV)')
+    source.add_argument('--socket', help="Local socket sending one point per line ('host:port' or a Unix socket path)")
+    track.add_argument('--daily-distance', type=float, default=125, help='Target daily distance in km (default: 125)')
+    track.add_argument('--poll-interval', type=float, default=5.0, help='Seconds between checks of a tailed file (default: 5)')
+    track.add_argument('--idle-timeout', type=float, help='Stop after this many seconds without new points')
+    track.add_argument('--json', action='store_true', help='Emit each update as a JSON line')
+    track.set_defaults(func=run_track)
+
+    plan = subparsers.add_parser('plan', parents=[route_options, metrics_options, distance_options], help='Plan RV stops and daily segments without rendering')
+    plan.add_argument('--compact', action='store_true', help='Load routes with float32 coordinates and datetime64 times')
+    plan.add_argument('--memory-report', action='store_true', help='Print the memory used by each route DataFrame')
+    plan.set_defaults(func=run_plan)
+
+    compare = subparsers.add_parser('compare', parents=[route_options, metrics_options, distance_options], help='Plan routes and render the integrated comparison map')
+    compare.set_defaults(func=run_compare)
+
+    profile = subparsers.add_parser('profile', parents=[distance_options], help='Render elevation and pace profile charts')
+    profile.add_argument('gpx_files', nargs='+', help='GPX files to render')
+    profile.add_argument('--output-dir', default='.', help='Directory for the chart images (default: current directory)')
+    profile.add_argument('--daily-distance', type=float, default=125, help='Target daily distance in km for the RV stops (default: 125)')
+    profile.add_argument('--width', type=int, default=1600, help='Chart width in pixels (default: 1600)')
+    profile.add_argument('--downsample', choices=['lttb', 'minmax'], default='lttb', help='Downsampling method (default: lttb)')
+    profile.add_argument('--processes', type=int, help='Worker processes (default: CPU count)')
+    profile.set_defaults(func=run_profile)
+
+    verify = subparsers.add_parser('verify', parents=[distance_options], help='Check the fast paths against the reference implementations')
+    verify.add_argument('gpx_files', nargs='*', help='GPX files to check (generated tracks are always checked)')
+    verify.add_argument('--cases', type=int, default=20,
+                        help='Generated tracks to check (default: 20, one of each kind with one and with several segments)')
+    verify.add_argument('--points', type=int, default=2000, help='Points per generated track (default: 2000)')
+    verify.add_argument('--seed', type=int, default=0, help='Seed of the first generated track (default: 0)')
+    verify.add_argument('--rtol', type=float, default=1e-9, help='Relative tolerance (default: 1e-9)')
+    verify.add_argument('--atol', type=float, default=1e-9, help='Absolute tolerance (default: 1e-9)')
+    verify.add_argument('--report', help='Write one row per track and check to this CSV file')
+    verify.set_defaults(func=run_verify)
+
+    index = subparsers.add_parser('index', help='Build or update the spatial index of a route library')
+    index.add_argument('source', help='Directory to walk or glob pattern of GPX files')
+    index.add_argument('index', help='SQLite index file to create or update')
+    index.add_argument('--piece-points', type=int, default=64, help='Points per indexed piece (default: 64)')
+    index.add_argument('--no-prune', action='store_true', help='Keep routes whose files have been removed')
+    index.set_defaults(func=run_index)
+
+    search = subparsers.add_parser('search', help='Find indexed routes near a point, in a box or along a route')
+    search.add_argument('index', help='SQLite index file built by the index command')
+    query = search.add_mutually_exclusive_group(required=True)
+    query.add_argument('--near', metavar='LAT,LON', help='Routes passing within --radius of this point')
+    query.add_argument('--bbox', metavar='MIN_LAT,MIN_LON,MAX_LAT,MAX_LON', help='Routes crossing this box')
+    query.add_argument('--corridor', metavar='GPX', help='Routes passing within --radius of the track in this GPX file')
+    search.add_argument('--radius', type=float, default=2000, help='Search radius or corridor half-width in meters (default: 2000)')
+    search.add_argument('--json', action='store_true', help='Print the matches as JSON')
+    search.set_defaults(func=run_search)
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, 'streaming', False) and args.method not in STREAMING_FIX_METHODS:
+        parser.error(f"--streaming supports --method {' or '.join(STREAMING_FIX_METHODS)}, not {args.method}")
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
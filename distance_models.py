@@ -0,0 +1,300 @@
+"""
+Vectorized distance models for GPX points
+
+All models take latitudes/longitudes in degrees (scalars or numpy arrays,
+broadcast together) and return distances in meters. Worst-case errors
+against the WGS84 ellipsoid, measured with geographiclib:
+
+- 'equirectangular': local projection using the ellipsoid's meridional and
+  prime-vertical radii at the mid-latitude. Error grows with the cube of the
+  step: at most 4e-14 * d**3 m for |latitude| <= 80 degrees (under 0.04 mm at
+  1 km, 3.5 cm at 10 km, 35 m at 100 km). Not suitable near the poles.
+  The cheapest model; made for consecutive track points.
+- 'haversine': great circle on a sphere of mean radius 6371.0088 km, the same
+  formula as the haversine package used elsewhere in this repo. Relative
+  error up to 0.57% (5.7 m per km) whatever the step length.
+- 'vincenty': Vincenty's inverse formula on WGS84, about 0.5 mm. It can fail
+  to converge for nearly antipodal points, which then fall back to 'karney'
+  (or 'haversine' if geographiclib is not installed).
+- 'karney': geographiclib's geodesic solver, accurate to about 15 nm.
+  Requires the optional geographiclib package and is not vectorized.
+
+Pipelines select a model by name, or pass 'auto' (optionally 'auto:<meters>')
+to use the cheapest model whose error bound for the longest step in the data
+meets the tolerance (DEFAULT_TOLERANCE_M if not given).
+"""
+import numpy as np
+
+# Radius used by the haversine package (6371.0088 km expressed in its meter unit)
+MEAN_EARTH_RADIUS_M = 6371.0088 * 1000.0
+
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+WGS84_E2 = WGS84_F * (2 - WGS84_F)
+
+DEFAULT_TOLERANCE_M = 0.01
+
+EQUIRECTANGULAR_MAX_LATITUDE = 80
+EQUIRECTANGULAR_ERROR_COEFFICIENT = 4e-14
+HAVERSINE_RELATIVE_ERROR = 0.0057
+VINCENTY_ERROR_M = 0.0005
+
+
+def _as_arrays(lat1, lon1, lat2, lon2):
+    return np.broadcast_arrays(*(np.asarray(value, dtype=float) for value in (lat1, lon1, lat2, lon2)))
+
+
+def _wrapped_longitude_difference(lon1, lon2):
+    """
+    Longitude difference in radians wrapped to [-pi, pi), so antimeridian crossings stay short
+    """
+    return np.radians((lon2 - lon1 + 180.0) % 360.0 - 180.0)
+
+
+def equirectangular(lat1, lon1, lat2, lon2):
+    """
+    Local ellipsoidal equirectangular approximation (see module docstring for error bounds)
+    """
+    lat1, lon1, lat2, lon2 = _as_arrays(lat1, lon1, lat2, lon2)
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    phi_mid = (phi1 + phi2) * 0.5
+
+    sin_mid = np.sin(phi_mid)
+    w = 1 - WGS84_E2 * sin_mid * sin_mid
+    prime_vertical = WGS84_A / np.sqrt(w)
+    meridional = WGS84_A * (1 - WGS84_E2) / (w * np.sqrt(w))
+
+    dx = prime_vertical * np.cos(phi_mid) * _wrapped_longitude_difference(lon1, lon2)
+    dy = meridional * (phi2 - phi1)
+    return np.hypot(dx, dy)
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance on the mean-radius sphere, matching haversine(..., unit='m')
+    """
+    lat1, lon1, lat2, lon2 = _as_arrays(lat1, lon1, lat2, lon2)
+    lat1 = np.radians(lat1)
+    lon1 = np.radians(lon1)
+    lat2 = np.radians(lat2)
+    lon2 = np.radians(lon2)
+    d = (np.sin((lat2 - lat1) * 0.5) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) * 0.5) ** 2)
+    return MEAN_EARTH_RADIUS_M * (2 * np.arcsin(np.sqrt(d)))
+
+
+def vincenty(lat1, lon1, lat2, lon2, max_iterations=200, tolerance=1e-12):
+    """
+    Vincenty's inverse formula on the WGS84 ellipsoid, vectorized
+    """
+    lat1, lon1, lat2, lon2 = _as_arrays(lat1, lon1, lat2, lon2)
+    shape = lat1.shape
+    lat1, lon1, lat2, lon2 = (np.atleast_1d(value).ravel() for value in (lat1, lon1, lat2, lon2))
+
+    L = _wrapped_longitude_difference(lon1, lon2)
+    U1 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat1)))
+    U2 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat2)))
+    sin_u1, cos_u1 = np.sin(U1), np.cos(U1)
+    sin_u2, cos_u2 = np.sin(U2), np.cos(U2)
+
+    lam = L.copy()
+    converged = np.zeros(lam.shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(max_iterations):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha * sin_alpha
+            # Equatorial lines have cos2_alpha == 0
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha)
+            C = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+
+            previous = lam
+            lam = L + (1 - C) * WGS84_F * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+            converged = np.abs(lam - previous) < tolerance
+            if converged.all():
+                break
+
+        u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+        B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+        delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+            - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+        distance = WGS84_B * A * (sigma - delta_sigma)
+
+    failed = ~converged | ~np.isfinite(distance)
+    if failed.any():
+        try:
+            distance[failed] = karney(lat1[failed], lon1[failed], lat2[failed], lon2[failed])
+        except ImportError:
+            distance[failed] = haversine(lat1[failed], lon1[failed], lat2[failed], lon2[failed])
+
+    return distance.reshape(shape)
+
+
+def karney(lat1, lon1, lat2, lon2):
+    """
+    Geodesic distance from geographiclib (requires the geographiclib package)
+    """
+    from geographiclib.geodesic import Geodesic
+
+    lat1, lon1, lat2, lon2 = _as_arrays(lat1, lon1, lat2, lon2)
+    geodesic = Geodesic.WGS84
+    distances = np.empty(lat1.shape)
+    for index in np.ndindex(lat1.shape):
+        distances[index] = geodesic.Inverse(
+            lat1[index], lon1[index], lat2[index], lon2[index], Geodesic.DISTANCE)['s12']
+    return distances
+
+
+# Cheapest first
+DISTANCE_MODELS = {
+    'equirectangular': equirectangular,
+    'haversine': haversine,
+    'vincenty': vincenty,
+    'karney': karney
+}
+
+
+def error_bound(model_name, step_m, max_abs_latitude=0.0):
+    """
+    Worst-case error in meters of a model for one step of step_m meters
+    """
+    if model_name == 'equirectangular':
+        if max_abs_latitude > EQUIRECTANGULAR_MAX_LATITUDE:
+            return float('inf')
+        return EQUIRECTANGULAR_ERROR_COEFFICIENT * step_m ** 3
+    if model_name == 'haversine':
+        return HAVERSINE_RELATIVE_ERROR * step_m
+    if model_name == 'vincenty':
+        return VINCENTY_ERROR_M
+    if model_name == 'karney':
+        return 0.0
+    raise ValueError(f"Unknown distance model: {model_name}")
+
+
+def select_distance_model(tolerance_m, max_step_m, max_abs_latitude=0.0):
+    """
+    Name of the cheapest model whose error bound for max_step_m meets tolerance_m
+    """
+    for name in DISTANCE_MODELS:
+        if error_bound(name, max_step_m, max_abs_latitude) <= tolerance_m:
+            return name
+    return 'karney'
+
+
+def get_distance_model(model='haversine', lat=None, lon=None):
+    """
+    Resolve a model name, 'auto[:tolerance_m]' or a callable to a distance function
+
+    'auto' needs the track's lat/lon arrays to find the longest step and the
+    highest latitude.
+    """
+    if callable(model):
+        return model
+    if model in DISTANCE_MODELS:
+        return DISTANCE_MODELS[model]
+    if model.startswith('auto'):
+        tolerance_m = float(model.split(':', 1)[1]) if ':' in model else DEFAULT_TOLERANCE_M
+        if lat is None or len(lat) < 2:
+            return haversine
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        max_step_m = float(equirectangular(lat[:-1], lon[:-1], lat[1:], lon[1:]).max())
+        # The approximation may understate long steps slightly; the cubic bound has ample margin
+        return DISTANCE_MODELS[select_distance_model(tolerance_m, max_step_m, float(np.abs(lat).max()))]
+    raise ValueError(f"Unknown distance model: {model}")
+
+
+def consecutive_distances(lat, lon, model='haversine'):
+    """
+    Distances in meters between consecutive points (length n - 1)
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    if len(lat) < 2:
+        return np.zeros(0)
+    distance = get_distance_model(model, lat, lon)
+    return distance(lat[:-1], lon[:-1], lat[1:], lon[1:])
+
+
+def greedy_distance_filter(lat, lon, min_distance_m, model='haversine', anchor=None, window=32):
+    """
+    Indices kept by the greedy "at least min_distance_m from the last kept point" filter
+
+    Runs of points that are each far enough from their predecessor are kept
+    in bulk from the vectorized step distances. Only after a short step does
+    the filter scan forward from the last kept point, in vectorized windows.
+
+    Parameters:
+    - lat, lon: Point coordinates in degrees
+    - min_distance_m: Minimum distance from the last kept point
+    - model: Distance model name, 'auto[:tolerance_m]' or callable
+    - anchor: Optional (lat, lon) of the last kept point before these points
+      (for block-wise processing); if omitted the first point is kept
+    - window: Initial number of points compared per vectorized scan
+
+    Returns:
+    - Sorted numpy array of kept indices
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    n = len(lat)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    distance = get_distance_model(model, lat, lon)
+    kept = []
+
+    if anchor is None:
+        kept.append(0)
+        anchor_index = 0
+        i = 1
+    else:
+        d = distance(anchor[0], anchor[1], lat[:1], lon[:1])
+        anchor_index = None
+        i = 0
+        if d[0] >= min_distance_m:
+            kept.append(0)
+            anchor_index = 0
+            i = 1
+
+    # short_steps[k] is True when point k + 1 is too close to point k
+    steps = distance(lat[:-1], lon[:-1], lat[1:], lon[1:]) if n > 1 else np.zeros(0)
+    short_steps = np.flatnonzero(steps < min_distance_m)
+    anchor_lat, anchor_lon = (lat[anchor_index], lon[anchor_index]) if anchor_index is not None else anchor
+
+    while i < n:
+        if anchor_index is not None and anchor_index == i - 1:
+            # Keep every point up to the next short step in one go
+            position = np.searchsorted(short_steps, i - 1)
+            stop = int(short_steps[position]) if position < len(short_steps) else n - 1
+            if stop >= i:
+                kept.extend(range(i, stop + 1))
+                anchor_index = stop
+                anchor_lat, anchor_lon = lat[stop], lon[stop]
+                i = stop + 1
+                continue
+
+        # Scan forward from the last kept point for the first point far enough away
+        scan = window
+        while i < n:
+            end = min(n, i + scan)
+            far = np.flatnonzero(distance(anchor_lat, anchor_lon, lat[i:end], lon[i:end]) >= min_distance_m)
+            if far.size:
+                j = i + int(far[0])
+                kept.append(j)
+                anchor_index = j
+                anchor_lat, anchor_lon = lat[j], lon[j]
+                i = j + 1
+                break
+            i = end
+            scan = min(scan * 2, 65536)
+
+    return np.asarray(kept, dtype=np.int64)
@@ -1,171 +1,315 @@
 import gpxpy
-import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
 from haversine import haversine
-import folium
-import statistics
+from pipeline_metrics import PipelineMetrics
+from gpx_stream import iter_gpx_events, GPXStreamWriter
+from distance_models import MEAN_EARTH_RADIUS_M, greedy_distance_filter
+from distance_models import haversine as haversine_m
+from track_segments import dataframe_offsets, segment_spans, segment_starts, step_distances
 
-def analyze_gpx_file(gpx_file_path):
+# Optional stages of analyze_gpx_file; the distance and anomaly computation always runs
+ANALYSIS_STAGES = ('report', 'render', 'filters')
+
+# A dwell's path must be this many times the largest distance of its points from
+# its centroid; a track passing through covers its extent about twice at most
+DWELL_PATH_EXTENT_RATIO = 4
+
+# Filters compared by the 'filters' stage of analyze_gpx_file, next to the original track
+ANALYSIS_FILTERS = ("Remove points < 5m apart", "Remove points < 10m apart", "Remove jitter clusters",
+                    "Collapse stationary periods")
+
+def analyze_gpx_file(gpx_file_path, metrics=None, stages=ANALYSIS_STAGES, distance_model='haversine',
+                     filters=ANALYSIS_FILTERS):
     """
     Comprehensive analysis of a GPX file to identify potential issues
+
+    Parameters:
+    - gpx_file_path: Path to the GPX file
+    - metrics: Optional PipelineMetrics collecting stage timings and counters
+    - stages: Optional stages to run on top of the computation:
+        'report' prints the findings, 'render' writes the histogram and map,
+        'filters' compares distances after filtering. Pass () for a headless,
+        compute-only analysis.
+    - distance_model: Distance model for spacing, jumps and filters
+        (see distance_models; 'auto' picks the cheapest within tolerance)
+    - filters: Filters the 'filters' stage runs (see ANALYSIS_FILTERS)
+    """
+    unknown = set(stages) - set(ANALYSIS_STAGES)
+    if unknown:
+        raise ValueError(f"Unknown analysis stages: {sorted(unknown)}")
+    unknown = set(filters) - set(ANALYSIS_FILTERS)
+    if unknown:
+        raise ValueError(f"Unknown analysis filters: {sorted(unknown)}")
+    
+    if metrics is None:
+        metrics = PipelineMetrics()
+    verbose = 'report' in stages
+
+    if verbose:
+        print(f"Analyzing GPX file: {gpx_file_path}")
+    
+    with metrics.stage('parse'):
+        df, info = load_gpx_points(gpx_file_path)
+        metrics.record_file_read(gpx_file_path)
+    metrics.count('points', info['total_points'])
+    
+    with metrics.stage('distances'):
+        add_point_distances(df, distance_model)
+    
+    with metrics.stage('anomalies'):
+        stats = compute_gpx_stats(df)
+    stats.update(info)
+    
+    if verbose:
+        print_gpx_report(df, stats)
+    
+    # Generate visualization
+    if 'render' in stages:
+        with metrics.stage('render'):
+            map_filename = create_visualization(df, gpx_file_path, metrics)
+        if verbose:
+            print(f"\nAnalysis map saved to: {map_filename}")
+    
+    # Try different filtering methods and report results
+    filtered_dfs = {}
+    if 'filters' in stages:
+        with metrics.stage('filters'):
+            filter_functions = {
+                "Remove points < 5m apart": lambda: filter_by_distance(df.copy(), 5, distance_model),
+                "Remove points < 10m apart": lambda: filter_by_distance(df.copy(), 10, distance_model),
+                "Remove jitter clusters": lambda: filter_jitter_clusters(df.copy(), stats['jitter_segments']),
+                "Collapse stationary periods": lambda: collapse_stationary_periods(df)
+            }
+            filtered_dfs = {"Original": df}
+            filtered_dfs.update((name, filter_functions[name]()) for name in ANALYSIS_FILTERS if name in filters)
+            
+            stats['filtered_distances'] = {}
+            for name, filtered_df in filtered_dfs.items():
+                if len(filtered_df) > 1:
+                    stats['filtered_distances'][name] = {
+                        'distance_km': float(calculate_total_distance(filtered_df, distance_model)),
+                        'points': len(filtered_df)
+                    }
+        
+        if verbose:
+            # Generate statistics with potential fixes
+            print("\nPossible Solutions:")
+            print("\nDistance Comparison with Filtering:")
+            for name, result in stats['filtered_distances'].items():
+                point_reduction = (1 - result['points'] / len(df)) * 100
+                print(f"  - {name}: {result['distance_km']:.2f} km ({result['points']} points, {point_reduction:.1f}% reduction)")
+    
+    metrics.finish()
+    
+    # Return the full analysis
+    return {
+        "data": df,
+        "stats": stats,
+        "filtered_data": filtered_dfs,
+        "metrics": metrics
+    }
+
+def load_gpx_points(gpx_file_path):
+    """
+    Read a GPX file into a DataFrame of points
+
+    Returns:
+    - DataFrame with latitude, longitude, elevation, time, segment and track
+      columns (the index of each point's track segment across the file, and
+      of its track)
+    - Dictionary with track, segment and point counts, and the track names
     """
-    print(f"Analyzing GPX file: {gpx_file_path}")
+    import pandas as pd
     
-    # Read the GPX file
     with open(gpx_file_path, 'r') as f:
         gpx = gpxpy.parse(f)
     
-    # Basic information
-    track_count = len(gpx.tracks)
-    total_points = sum(len(segment.points) for track in gpx.tracks for segment in track.segments)
-    segments_count = sum(len(track.segments) for track in gpx.tracks)
-    
-    print(f"Basic Information:")
-    print(f"  - Tracks: {track_count}")
-    print(f"  - Segments: {segments_count}")
-    print(f"  - Total points: {total_points}")
+    info = {
+        'tracks': len(gpx.tracks),
+        'segments': sum(len(track.segments) for track in gpx.tracks),
+        'total_points': sum(len(segment.points) for track in gpx.tracks for segment in track.segments),
+        'track_names': [track.name for track in gpx.tracks]
+    }
     
     # Extract points
     all_points = []
-    for track in gpx.tracks:
-        for segment in track.segments:
-            for point in segment.points:
-                all_points.append({
-                    'latitude': point.latitude,
-                    'longitude': point.longitude,
-                    'elevation': point.elevation if point.elevation else 0,
-                    'time': point.time
-                })
-    
-    # Convert to DataFrame for easier analysis
-    df = pd.DataFrame(all_points)
-    
-    # Calculate distances between consecutive points
-    distances = []
-    for i in range(1, len(df)):
-        point1 = (df.iloc[i-1]['latitude'], df.iloc[i-1]['longitude'])
-        point2 = (df.iloc[i]['latitude'], df.iloc[i]['longitude'])
-        dist = haversine(point1, point2, unit='m')
-        distances.append(dist)
-    
-    # Add distances to DataFrame
-    df['distance_to_prev_m'] = [0] + distances
+    segments = ((track_index, segment) for track_index, track in enumerate(gpx.tracks) for segment in track.segments)
+    for segment_index, (track_index, segment) in enumerate(segments):
+        for point in segment.points:
+            all_points.append({
+                'latitude': point.latitude,
+                'longitude': point.longitude,
+                'elevation': point.elevation if point.elevation else 0,
+                'time': point.time,
+                'segment': segment_index,
+                'track': track_index
+            })
+    
+    return pd.DataFrame(all_points, columns=['latitude', 'longitude', 'elevation', 'time', 'segment', 'track']), info
+
+def add_point_distances(df, distance_model='haversine'):
+    """
+    Add distance_to_prev_m and cumulative_distance_km columns to a point DataFrame
+
+    distance_to_prev_m is 0 at the first point of every track segment.
+    """
+    if len(df) == 0:
+        df['distance_to_prev_m'] = []
+        df['cumulative_distance_km'] = []
+        return df
+    
+    df['distance_to_prev_m'] = step_distances(df['latitude'], df['longitude'], dataframe_offsets(df), distance_model)
     df['cumulative_distance_km'] = np.cumsum(df['distance_to_prev_m']) / 1000
+    return df
+
+def compute_gpx_stats(df):
+    """
+    Compute point spacing statistics, large jumps, jitter runs and time gaps
+
+    Pure computation with no printing or rendering; df must already have
+    the columns added by add_point_distances. The anomalies are read from
+    anomaly_masks, so the gap between two track segments is not reported as
+    a jump, jitter run or time gap; indices are positions in df.
+
+    Returns:
+    - Dictionary of statistics
+    """
+    import pandas as pd
+    
+    distance = df['distance_to_prev_m'].to_numpy(dtype=float)
+    distances = distance[~segment_starts(dataframe_offsets(df), len(df))]
+    
+    stats = {
+        "total_distance": float(df['cumulative_distance_km'].iloc[-1]) if len(df) else 0.0,
+        "total_points": len(df),
+        "avg_point_distance": float(distances.mean()) if distances.size else 0.0,
+        "median_point_distance": float(np.median(distances)) if distances.size else 0.0,
+        "max_point_distance": float(distances.max()) if distances.size else 0.0,
+        "min_point_distance": float(distances.min()) if distances.size else 0.0
+    }
+    
+    masks = anomaly_masks(df)
+    
+    jumps = np.flatnonzero(masks['large_jumps'])
+    stats['large_jumps'] = list(zip(jumps.tolist(), distance[jumps].tolist()))
+    
+    # Jitter runs never touch, since a segment start or a longer move separates them
+    jitter = np.flatnonzero(masks['jitter'])
+    runs = np.split(jitter, np.flatnonzero(np.diff(jitter) > 1) + 1) if jitter.size else []
+    stats['jitter_segments'] = [run.tolist() for run in runs]
+    
+    gaps = np.flatnonzero(masks['time_gaps'])
+    gap_s = np.zeros(0)
+    if gaps.size:
+        times = pd.to_datetime(df['time'], utc=True, errors='coerce').to_numpy()
+        gap_s = (times[gaps] - times[gaps - 1]) / np.timedelta64(1, 's')
+    stats['time_gaps'] = list(zip(gaps.tolist(), gap_s.tolist()))
+    
+    return stats
+
+def anomaly_masks(df, jump_m=500, gap_s=300, max_speed_kmh=30, jitter_m=1, min_jitter_points=6):
+    """
+    Boolean masks over the points of a track, one per kind of anomaly
+
+    Uses the same thresholds as compute_gpx_stats; df must already have the
+    columns added by add_point_distances. The first point of a track segment
+    is never an anomaly, and jitter runs do not continue across segments.
+
+    Parameters:
+    - jump_m: A point further than this from the previous one is a large jump
+    - gap_s: A point recorded more than this after the previous one follows a time gap
+    - max_speed_kmh: A point reached faster than this (and not already a large
+      jump) is a speed spike
+    - jitter_m, min_jitter_points: Runs of at least min_jitter_points points,
+      each less than jitter_m from the previous one, are jitter
+
+    Returns:
+    - Dictionary of mask name ('large_jumps', 'time_gaps', 'speed_spikes',
+      'jitter') -> boolean array with one entry per point
+    """
+    import pandas as pd
+    
+    distance = df['distance_to_prev_m'].to_numpy(dtype=float)
+    starts = segment_starts(dataframe_offsets(df), len(df))
+    masks = {'large_jumps': (distance > jump_m) & ~starts}
+    
+    # Time differences to the previous point, NaN where either time is missing
+    interval = np.full(len(df), np.nan)
+    if 'time' in df.columns and len(df) > 1:
+        times = pd.to_datetime(df['time'], utc=True, errors='coerce')
+        interval[1:] = times.diff().dt.total_seconds().to_numpy()[1:]
+        interval[starts] = np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed_kmh = distance / interval * 3.6
+    masks['time_gaps'] = interval > gap_s
+    masks['speed_spikes'] = (interval > 0) & (speed_kmh > max_speed_kmh) & ~masks['large_jumps']
+    
+    # Label runs of small movements and keep those that are long enough
+    small = (distance < jitter_m) & ~starts
+    run_ids = np.cumsum(~small)
+    run_lengths = np.bincount(run_ids[small], minlength=run_ids[-1] + 1) if len(df) else np.zeros(1, dtype=int)
+    masks['jitter'] = small & (run_lengths[run_ids] >= min_jitter_points)
+    
+    return masks
+
+def print_gpx_report(df, stats):
+    """
+    Print a human-readable report of the statistics from compute_gpx_stats
+    """
+    print(f"Basic Information:")
+    print(f"  - Tracks: {stats.get('tracks', 1)}")
+    print(f"  - Segments: {stats.get('segments', 1)}")
+    print(f"  - Total points: {stats['total_points']}")
     
     # Analyze point distribution and potential issues
     print("\nPoint Distribution Analysis:")
-    print(f"  - Total distance: {df['cumulative_distance_km'].iloc[-1]:.2f} km")
-    print(f"  - Average distance between points: {statistics.mean(distances):.2f} m")
-    print(f"  - Median distance between points: {statistics.median(distances):.2f} m")
-    print(f"  - Max distance between points: {max(distances):.2f} m")
-    print(f"  - Min distance between points: {min(distances):.2f} m")
-    
-    # Check for unusually large jumps
-    large_jumps = [(i+1, dist) for i, dist in enumerate(distances) if dist > 500]
-    if large_jumps:
+    print(f"  - Total distance: {stats['total_distance']:.2f} km")
+    print(f"  - Average distance between points: {stats['avg_point_distance']:.2f} m")
+    print(f"  - Median distance between points: {stats['median_point_distance']:.2f} m")
+    print(f"  - Max distance between points: {stats['max_point_distance']:.2f} m")
+    print(f"  - Min distance between points: {stats['min_point_distance']:.2f} m")
+    
+    if stats['large_jumps']:
         print("\nPotential Issues - Large Jumps Detected:")
-        for idx, dist in large_jumps:
+        for idx, dist in stats['large_jumps']:
             print(f"  - Point {idx}: {dist:.2f} m jump from previous point")
             print(f"    Location: {df.iloc[idx]['latitude']}, {df.iloc[idx]['longitude']}")
-            
-    # Check for GPS jitter (many very small movements)
-    jitter_segments = []
-    current_segment = []
-    
-    for i, dist in enumerate(distances):
-        if dist < 1:  # Less than 1 meter movement is suspect
-            current_segment.append(i+1)
-        else:
-            if len(current_segment) > 5:  # If we had more than 5 very small movements in a row
-                jitter_segments.append(current_segment)
-            current_segment = []
-    
-    if current_segment and len(current_segment) > 5:
-        jitter_segments.append(current_segment)
     
+    jitter_segments = stats['jitter_segments']
     if jitter_segments:
         total_jitter_points = sum(len(seg) for seg in jitter_segments)
         print(f"\nPotential GPS Jitter Detected:")
         print(f"  - {len(jitter_segments)} segments with jitter")
-        print(f"  - {total_jitter_points} total points affected ({(total_jitter_points/total_points)*100:.1f}% of track)")
+        print(f"  - {total_jitter_points} total points affected ({(total_jitter_points/stats['total_points'])*100:.1f}% of track)")
         print(f"  - Removing jitter could reduce track length")
     
-    # Time gap analysis (if time data is available)
-    if 'time' in df.columns and df['time'].iloc[0] is not None:
-        time_diffs = []
-        for i in range(1, len(df)):
-            if df.iloc[i]['time'] and df.iloc[i-1]['time']:
-                diff = (df.iloc[i]['time'] - df.iloc[i-1]['time']).total_seconds()
-                time_diffs.append(diff)
-        
-        if time_diffs:
-            large_time_gaps = [(i+1, gap) for i, gap in enumerate(time_diffs) if gap > 300]  # 5+ minute gaps
-            if large_time_gaps:
-                print("\nPotential Issues - Time Gaps Detected:")
-                for idx, gap in large_time_gaps:
-                    minutes = gap / 60
-                    print(f"  - Point {idx}: {minutes:.1f} minute gap")
-                    print(f"    Location: {df.iloc[idx]['latitude']}, {df.iloc[idx]['longitude']}")
-    
-    # Generate visualization
-    create_visualization(df, gpx_file_path)
-    
-    # Generate statistics with potential fixes
-    print("\nPossible Solutions:")
-    
-    # Try different filtering methods and report results
-    filtered_dfs = {
-        "Original": df,
-        "Remove points < 5m apart": filter_by_distance(df.copy(), 5),
-        "Remove points < 10m apart": filter_by_distance(df.copy(), 10),
-        "Remove jitter clusters": filter_jitter_clusters(df.copy(), jitter_segments)
-    }
-    
-    print("\nDistance Comparison with Filtering:")
-    for name, filtered_df in filtered_dfs.items():
-        if len(filtered_df) > 1:
-            total_dist = calculate_total_distance(filtered_df)
-            point_reduction = (1 - len(filtered_df) / len(df)) * 100
-            print(f"  - {name}: {total_dist:.2f} km ({len(filtered_df)} points, {point_reduction:.1f}% reduction)")
-    
-    # Return the full analysis
-    return {
-        "data": df,
-        "stats": {
-            "total_distance": df['cumulative_distance_km'].iloc[-1],
-            "total_points": total_points,
-            "avg_point_distance": statistics.mean(distances),
-            "large_jumps": large_jumps,
-            "jitter_segments": jitter_segments
-        },
-        "filtered_data": filtered_dfs
-    }
+    if stats['time_gaps']:
+        print("\nPotential Issues - Time Gaps Detected:")
+        for idx, gap in stats['time_gaps']:
+            minutes = gap / 60
+            print(f"  - Point {idx}: {minutes:.1f} minute gap")
+            print(f"    Location: {df.iloc[idx]['latitude']}, {df.iloc[idx]['longitude']}")
 
-def filter_by_distance(df, min_distance_meters=5):
+def filter_by_distance(df, min_distance_meters=5, distance_model='haversine'):
     """
     Filter out points that are too close together (likely GPS noise)
+
+    Each track segment is filtered on its own and keeps its first and last point.
     """
     if len(df) <= 1:
         return df
-        
-    cleaned_points = [0]  # Always keep the first point
-    last_included = 0
     
-    for i in range(1, len(df)):
-        point1 = (df.iloc[last_included]['latitude'], df.iloc[last_included]['longitude'])
-        point2 = (df.iloc[i]['latitude'], df.iloc[i]['longitude'])
+    lat = df['latitude'].to_numpy(dtype=float)
+    lon = df['longitude'].to_numpy(dtype=float)
+    cleaned_points = []
+    for start, stop in segment_spans(dataframe_offsets(df)):
+        # Keeps the first point, then every point at least min_distance_meters from the last kept one
+        kept = (greedy_distance_filter(lat[start:stop], lon[start:stop], min_distance_meters, distance_model) + start).tolist()
         
-        # Convert distance to meters
-        dist_m = haversine(point1, point2, unit='m')
-        
-        if dist_m >= min_distance_meters:
-            cleaned_points.append(i)
-            last_included = i
-    
-    # Always include the last point
-    if cleaned_points[-1] != len(df) - 1:
-        cleaned_points.append(len(df) - 1)
+        # Always include the last point
+        if kept[-1] != stop - 1:
+            kept.append(stop - 1)
+        cleaned_points.extend(kept)
         
     return df.iloc[cleaned_points].reset_index(drop=True)
 
@@ -186,33 +330,235 @@ def filter_jitter_clusters(df, jitter_segments):
     
     return df.iloc[keep_indices].reset_index(drop=True)
 
-def calculate_total_distance(df):
+def detect_stationary_periods(df, radius_m=25, min_duration_s=120, min_points=10):
+    """
+    Find stationary periods (dwells) where the track drifts around one spot
+
+    A point ends a stationary window if every point recorded in the
+    min_duration_s before it fits in a box whose diagonal is 2 * radius_m,
+    i.e. lies within radius_m of the box centre. Overlapping stationary
+    windows are joined into one dwell, and dwells around the same spot that
+    are separated by a short excursion are merged, so drift that keeps
+    breaking filter_jitter_clusters' runs of sub-meter moves does not split
+    a stop. Overlapping windows also chain along a slow or densely sampled
+    walk, so every dwell is cut into pieces that stay within radius_m of
+    their first point, pieces are only rejoined around the first piece's
+    centroid, and a dwell must wander: its path is at least
+    DWELL_PATH_EXTENT_RATIO times the largest distance of its points from
+    its centroid. Dwells whose recorded points span less than min_duration_s
+    (or, without timestamps, that have fewer than min_points points) are
+    dropped: after a recording gap a time window can hold only a few points.
+    The windows come from rolling minima and maxima, so detection is linear
+    in the number of points. Without usable timestamps (missing or out of
+    order), windows of min_points points are used instead. Windows and dwells
+    do not span track segment boundaries.
+
+    Returns:
+    - DataFrame with one row per dwell: start and end (inclusive row
+      positions), centroid latitude, longitude and elevation, points and
+      duration_s (NaN without timestamps)
+    """
+    import pandas as pd
+
+    columns = ['start', 'end', 'latitude', 'longitude', 'elevation', 'points', 'duration_s']
+    n = len(df)
+    if n <= 1:
+        return pd.DataFrame(columns=columns)
+
+    lat = df['latitude'].to_numpy(dtype=float)
+    lon = df['longitude'].to_numpy(dtype=float)
+    elevation = df['elevation'].to_numpy(dtype=float) if 'elevation' in df.columns else np.zeros(n)
+
+    times = pd.to_datetime(df['time'], utc=True, errors='coerce') if 'time' in df.columns else None
+    timed = times is not None and times.notna().all() and times.is_monotonic_increasing
+    coordinates = pd.DataFrame({'latitude': lat, 'longitude': lon})
+    segment = df['segment'].to_numpy() if 'segment' in df.columns else np.zeros(n, dtype=int)
+    new_segment = np.concatenate(([True], segment[1:] != segment[:-1]))
+    if timed:
+        seconds = (times - times.iloc[0]).dt.total_seconds().to_numpy()
+        coordinates.index = pd.DatetimeIndex(times)
+        rolling = coordinates.rolling(f"{min_duration_s}s", closed='both')
+        # Windows at the very start of a segment do not yet span min_duration_s
+        segment_start_s = seconds[np.maximum.accumulate(np.where(new_segment, np.arange(n), 0))]
+        full = seconds - segment_start_s >= min_duration_s
+    else:
+        seconds = np.full(n, np.nan)
+        rolling = coordinates.rolling(min_points)
+        full = np.arange(n) >= min_points - 1
+
+    high = rolling.max().to_numpy()
+    low = rolling.min().to_numpy()
+    count = rolling.count()['latitude'].fillna(0).to_numpy(dtype=int)
+
+    window_start = np.clip(np.arange(n) - count + 1, 0, n - 1)
+
+    max_side_m = radius_m * np.sqrt(2)
+    meters_per_degree = MEAN_EARTH_RADIUS_M * np.pi / 180
+    compact = (full & (count >= 2) & (segment[window_start] == segment)
+               & ((high[:, 0] - low[:, 0]) * meters_per_degree <= max_side_m)
+               & ((high[:, 1] - low[:, 1]) * meters_per_degree * np.cos(np.radians(lat)) <= max_side_m))
+
+    # Mark every point of every stationary window, then take runs of marked points
+    ends = np.flatnonzero(compact)
+    if not ends.size:
+        return pd.DataFrame(columns=columns)
+    covered = np.zeros(n + 1, dtype=int)
+    np.add.at(covered, ends - count[ends] + 1, 1)
+    np.add.at(covered, ends + 1, -1)
+    marked = np.cumsum(covered)[:n] > 0
+    # Runs of marked points, split at every segment start so no dwell joins two segments
+    starts = np.flatnonzero(marked & (new_segment | ~np.concatenate(([False], marked[:-1]))))
+    ends = np.flatnonzero(marked & (np.append(new_segment[1:], True) | ~np.append(marked[1:], False)))
+
+    # Overlapping windows chain along a slow or densely sampled walk; cut runs at each point
+    # leaving radius_m of the piece's first point
+    starts, ends = _anchored_pieces(lat, lon, starts, ends, radius_m)
+
+    # Prefix sums give the centroid of any run in O(1)
+    prefix = {name: np.concatenate(([0.0], np.cumsum(values)))
+              for name, values in (('latitude', lat), ('longitude', lon), ('elevation', elevation))}
+    def run_mean(name, starts, ends):
+        return (prefix[name][ends + 1] - prefix[name][starts]) / (ends - starts + 1)
+
+    # A brief excursion splits a noisy stop; rejoin neighbouring pieces whose centroid is
+    # within radius_m of the first piece of the dwell
+    centroid_lat = run_mean('latitude', starts, ends)
+    centroid_lon = run_mean('longitude', starts, ends)
+    gap = starts[1:] - ends[:-1] - 1
+    short_gap = (seconds[starts[1:]] - seconds[ends[:-1]] <= min_duration_s) if timed else (gap < min_points)
+    joinable = short_gap & (segment[starts[1:]] == segment[ends[:-1]])
+    first = np.ones(len(starts), dtype=np.bool_)
+    anchor = 0
+    for i in range(1, len(starts)):
+        if joinable[i - 1] and haversine_m(centroid_lat[anchor], centroid_lon[anchor],
+                                           centroid_lat[i], centroid_lon[i]) <= radius_m:
+            first[i] = False
+        else:
+            anchor = i
+    last = np.concatenate((first[1:], [True]))
+    starts = starts[first]
+    ends = ends[last]
+    if timed:
+        long_enough = seconds[ends] - seconds[starts] >= min_duration_s
+    else:
+        long_enough = ends - starts + 1 >= min_points
+    starts = starts[long_enough]
+    ends = ends[long_enough]
+
+    # Drift wanders back and forth; a track passing through at walking pace covers about
+    # its extent once. Keep dwells whose path is several times their extent.
+    if starts.size:
+        steps = np.zeros(n)
+        steps[1:] = haversine_m(lat[:-1], lon[:-1], lat[1:], lon[1:])
+        path_prefix = np.cumsum(steps)
+        path_m = path_prefix[ends] - path_prefix[starts]
+        lengths = ends - starts + 1
+        points = np.repeat(starts, lengths) + np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        spread = haversine_m(np.repeat(run_mean('latitude', starts, ends), lengths),
+                             np.repeat(run_mean('longitude', starts, ends), lengths), lat[points], lon[points])
+        extent_m = np.maximum.reduceat(spread, np.cumsum(lengths) - lengths)
+        wandering = path_m >= DWELL_PATH_EXTENT_RATIO * extent_m
+        starts = starts[wandering]
+        ends = ends[wandering]
+
+    return pd.DataFrame({
+        'start': starts,
+        'end': ends,
+        'latitude': run_mean('latitude', starts, ends),
+        'longitude': run_mean('longitude', starts, ends),
+        'elevation': run_mean('elevation', starts, ends),
+        'points': ends - starts + 1,
+        'duration_s': seconds[ends] - seconds[starts]
+    }, columns=columns)
+
+def _anchored_pieces(lat, lon, starts, ends, radius_m, lookahead=64):
+    """
+    Split runs of points into pieces whose points all lie within radius_m of the piece's first point
+
+    Returns:
+    - Arrays of the first and last (inclusive) position of every piece
+    """
+    piece_starts, piece_ends = [], []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        anchor = start
+        while anchor <= end:
+            # Look ahead in growing steps, so each piece costs time linear in its length
+            stop = end
+            look = lookahead
+            while True:
+                last = min(anchor + look, end)
+                away = np.flatnonzero(haversine_m(lat[anchor], lon[anchor], lat[anchor:last + 1], lon[anchor:last + 1]) > radius_m)
+                if away.size:
+                    stop = anchor + int(away[0]) - 1
+                    break
+                if last == end:
+                    break
+                look *= 2
+            piece_starts.append(anchor)
+            piece_ends.append(stop)
+            anchor = stop + 1
+    return np.array(piece_starts, dtype=np.int64), np.array(piece_ends, dtype=np.int64)
+
+def collapse_stationary_periods(df, radius_m=25, min_duration_s=120, min_points=10):
+    """
+    Replace each stationary period with a single centroid point
+
+    The centroid keeps the arrival time of the dwell, and its duration is
+    stored in a dwell_s column (0 for moving points). See
+    detect_stationary_periods for the parameters.
+    """
+    periods = detect_stationary_periods(df, radius_m, min_duration_s, min_points)
+    df = df.assign(dwell_s=0.0)
+    if periods.empty:
+        return df
+
+    starts = periods['start'].to_numpy(dtype=int)
+    ends = periods['end'].to_numpy(dtype=int)
+
+    # Drop every point of a dwell except its first, which becomes the centroid
+    covered = np.zeros(len(df) + 1, dtype=int)
+    np.add.at(covered, starts + 1, 1)
+    np.add.at(covered, ends + 1, -1)
+    keep = np.cumsum(covered)[:len(df)] == 0
+
+    for column in ('latitude', 'longitude', 'elevation', 'dwell_s'):
+        if column in df.columns:
+            values = df[column].to_numpy(dtype=float, copy=True)
+            values[starts] = periods['duration_s' if column == 'dwell_s' else column].to_numpy(dtype=float)
+            df[column] = values
+
+    return df.iloc[np.flatnonzero(keep)].reset_index(drop=True)
+
+def calculate_total_distance(df, distance_model='haversine'):
     """
-    Calculate total distance for a DataFrame
+    Calculate total distance in km for a DataFrame, excluding the gaps between track segments
     """
     if len(df) <= 1:
         return 0
-        
-    total_dist = 0
-    for i in range(1, len(df)):
-        point1 = (df.iloc[i-1]['latitude'], df.iloc[i-1]['longitude'])
-        point2 = (df.iloc[i]['latitude'], df.iloc[i]['longitude'])
-        total_dist += haversine(point1, point2)
     
-    return total_dist
+    return float(step_distances(df['latitude'], df['longitude'], dataframe_offsets(df), distance_model).sum()) / 1000
 
-def create_visualization(df, gpx_file_path):
+def create_visualization(df, gpx_file_path, metrics=None):
     """
     Create a visualization to help understand the GPX file
+
+    Returns:
+    - Path to the saved analysis map
     """
-    # Plot the distance distribution
-    plt.figure(figsize=(12, 6))
-    plt.hist(df['distance_to_prev_m'], bins=50, alpha=0.7)
-    plt.xlabel('Distance Between Points (meters)')
-    plt.ylabel('Frequency')
-    plt.title('Distribution of Distances Between Consecutive Points')
-    plt.grid(True, alpha=0.3)
-    plt.savefig('distance_distribution.png')
+    import matplotlib.pyplot as plt
+    import folium
+    
+    # Plot the distance distribution, closing the figure even if saving fails
+    fig, ax = plt.subplots(figsize=(12, 6))
+    try:
+        ax.hist(df['distance_to_prev_m'], bins=50, alpha=0.7)
+        ax.set_xlabel('Distance Between Points (meters)')
+        ax.set_ylabel('Frequency')
+        ax.set_title('Distribution of Distances Between Consecutive Points')
+        ax.grid(True, alpha=0.3)
+        fig.savefig('distance_distribution.png')
+    finally:
+        plt.close(fig)
     
     # Create an interactive map
     center_lat = df['latitude'].mean()
@@ -220,7 +566,7 @@ def create_visualization(df, gpx_file_path):
     m = folium.Map(location=[center_lat, center_lon], zoom_start=10)
     
     # Add the route
-    points = [(row['latitude'], row['longitude']) for _, row in df.iterrows()]
+    points = df[['latitude', 'longitude']].to_numpy().tolist()
     folium.PolyLine(points, color='blue', weight=3, opacity=0.7).add_to(m)
     
     # Mark start and end
@@ -236,68 +582,144 @@ def create_visualization(df, gpx_file_path):
         icon=folium.Icon(color='red')
     ).add_to(m)
     
-    # Mark any large jumps
-    for i in range(1, len(df)):
-        if df.iloc[i]['distance_to_prev_m'] > 500:  # Large jump
-            folium.CircleMarker(
-                [df.iloc[i]['latitude'], df.iloc[i]['longitude']],
-                radius=5,
-                color='red',
-                fill=True,
-                fill_color='red',
-                popup=f"Large jump: {df.iloc[i]['distance_to_prev_m']:.1f}m"
-            ).add_to(m)
+    # Mark the anomalies in one clustered, toggleable layer per kind
+    for layer in anomaly_layers(df):
+        layer.add_to(m)
+    folium.LayerControl(collapsed=False).add_to(m)
     
     # Save the map
     map_filename = gpx_file_path.replace('.gpx', '_analysis_map.html')
     m.save(map_filename)
-    print(f"\nAnalysis map saved to: {map_filename}")
+    if metrics:
+        metrics.record_map_output(map_filename)
+    return map_filename
+
+# Label and marker colour of each kind of anomaly on the analysis map
+ANOMALY_STYLES = {
+    'large_jumps': ('Large jumps', 'red'),
+    'time_gaps': ('Time gaps', 'purple'),
+    'speed_spikes': ('Speed spikes', 'orange'),
+    'jitter': ('Jitter runs', 'gray')
+}
+
+# Draws each clustered point as a circle marker with its label as popup
+_ANOMALY_MARKER_CALLBACK = """
+function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]),
+        {radius: 5, color: row[3], fillColor: row[3], fillOpacity: 0.8});
+    marker.bindPopup(row[2]);
+    return marker;
+}
+"""
+
+def anomaly_layers(df, **thresholds):
+    """
+    Clustered marker layers for the anomalies of a track (see anomaly_masks)
+
+    The markers are passed to the page as one data array per kind and
+    clustered in the browser, so the map stays responsive however many
+    anomalies there are. A jitter run is marked once, at its first point.
+
+    Returns:
+    - List of FastMarkerCluster layers, one per kind of anomaly found
+    """
+    import pandas as pd
+    from folium.plugins import FastMarkerCluster
+    
+    masks = anomaly_masks(df, **thresholds)
+    distance = df['distance_to_prev_m'].to_numpy(dtype=float)
+    latitude = df['latitude'].to_numpy(dtype=float)
+    longitude = df['longitude'].to_numpy(dtype=float)
+    
+    labels = {}
+    index = np.flatnonzero(masks['large_jumps'])
+    labels['large_jumps'] = (index, [f"Large jump: {d:.1f}m" for d in distance[index]])
+    
+    if masks['time_gaps'].any() or masks['speed_spikes'].any():
+        interval = pd.to_datetime(df['time'], utc=True, errors='coerce').diff().dt.total_seconds().to_numpy()
+        index = np.flatnonzero(masks['time_gaps'])
+        labels['time_gaps'] = (index, [f"Time gap: {gap / 60:.1f} min" for gap in interval[index]])
+        index = np.flatnonzero(masks['speed_spikes'])
+        labels['speed_spikes'] = (index, [f"Speed spike: {d / t * 3.6:.1f} km/h over {d:.1f}m"
+                                          for d, t in zip(distance[index], interval[index])])
+    
+    jitter = masks['jitter']
+    starts = np.flatnonzero(jitter & ~np.concatenate(([False], jitter[:-1])))
+    ends = np.flatnonzero(jitter & ~np.concatenate((jitter[1:], [False])))
+    labels['jitter'] = (starts, [f"Jitter run: {count} points" for count in ends - starts + 1])
+    
+    layers = []
+    for kind, (index, popups) in labels.items():
+        if not len(index):
+            continue
+        name, color = ANOMALY_STYLES[kind]
+        data = [[lat, lon, popup, color] for lat, lon, popup in zip(latitude[index].round(6), longitude[index].round(6), popups)]
+        layers.append(FastMarkerCluster(data, callback=_ANOMALY_MARKER_CALLBACK, name=f"{name} ({len(index)})"))
+    return layers
 
-def fix_gpx_file(gpx_file_path, output_path, filter_method='distance', threshold=5):
+def fix_gpx_file(gpx_file_path, output_path, filter_method='distance', threshold=5, streaming=False, distance_model='haversine',
+                 dwell_radius=25, min_dwell_s=120):
     """
     Create a fixed version of the GPX file with common issues addressed
     
     Parameters:
     - gpx_file_path: Path to the original GPX file
     - output_path: Path to save the fixed GPX file
-    - filter_method: 'distance' or 'jitter'
+    - filter_method: 'distance', 'jitter' or 'stationary'
     - threshold: For distance filtering, minimum distance between points in meters
+    - streaming: If True, use the single-pass, constant-memory writer (see stream_fix_gpx_file;
+      'distance' and 'jitter' only)
+    - distance_model: Distance model for the analysis and distance filter (not used when streaming)
+    - dwell_radius, min_dwell_s: For stationary filtering, the radius in meters and minimum
+      duration of a stop; each stop becomes one centroid point commented with its duration
     
     Returns:
     - Path to the fixed GPX file
     """
-    # Read and analyze the original GPX
-    with open(gpx_file_path, 'r') as f:
-        gpx = gpxpy.parse(f)
+    if streaming:
+        return stream_fix_gpx_file(gpx_file_path, output_path, filter_method, threshold)
     
-    analysis = analyze_gpx_file(gpx_file_path)
+    # Analyze the original GPX headlessly; only the requested filter runs below
+    analysis = analyze_gpx_file(gpx_file_path, stages=(), distance_model=distance_model)
     
     # Apply the requested filtering
     if filter_method == 'distance':
-        filtered_df = filter_by_distance(analysis['data'], threshold)
+        filtered_df = filter_by_distance(analysis['data'], threshold, distance_model)
     elif filter_method == 'jitter':
         filtered_df = filter_jitter_clusters(analysis['data'], analysis['stats']['jitter_segments'])
+    elif filter_method == 'stationary':
+        filtered_df = collapse_stationary_periods(analysis['data'], dwell_radius, min_dwell_s)
     else:
         raise ValueError(f"Unknown filter method: {filter_method}")
     
+    import pandas as pd
+    
     # Create a new GPX file
     new_gpx = gpxpy.gpx.GPX()
+    track_names = analysis['stats'].get('track_names', [])
     
-    # Create first track
-    track = gpxpy.gpx.GPXTrack()
-    new_gpx.tracks.append(track)
-    
-    # Create first segment in track
-    segment = gpxpy.gpx.GPXTrackSegment()
-    track.segments.append(segment)
-    
-    # Add filtered points
+    # Add filtered points, keeping the tracks (with their names) and segments of the original
+    track = None
+    track_index = None
+    segment = None
+    segment_index = None
     for _, row in filtered_df.iterrows():
+        if track is None or row.get('track') != track_index:
+            track_index = row.get('track')
+            name = track_names[track_index] if track_index is not None and track_index < len(track_names) else None
+            track = gpxpy.gpx.GPXTrack(name=name)
+            new_gpx.tracks.append(track)
+            segment = None
+        if segment is None or row.get('segment') != segment_index:
+            segment = gpxpy.gpx.GPXTrackSegment()
+            track.segments.append(segment)
+            segment_index = row.get('segment')
         point = gpxpy.gpx.GPXTrackPoint(
             latitude=row['latitude'],
             longitude=row['longitude'],
             elevation=row['elevation'],
-            time=row['time'] if 'time' in row and row['time'] is not None else None
+            time=row['time'] if 'time' in row and pd.notna(row['time']) else None,
+            comment=f"Stationary for {row['dwell_s']:.0f} s" if row.get('dwell_s', 0) > 0 else None
         )
         segment.points.append(point)
     
@@ -308,7 +730,111 @@ def fix_gpx_file(gpx_file_path, output_path, filter_method='distance', threshold
     print(f"Fixed GPX file saved to: {output_path}")
     print(f"Original points: {len(analysis['data'])}")
     print(f"Filtered points: {len(filtered_df)}")
-    print(f"Distance reduction: {analysis['data']['cumulative_distance_km'].iloc[-1] - calculate_total_distance(filtered_df):.2f} km")
+    print(f"Distance reduction: {analysis['stats']['total_distance'] - calculate_total_distance(filtered_df, distance_model):.2f} km")
+    
+    return output_path
+
+def stream_fix_gpx_file(gpx_file_path, output_path, filter_method='distance', threshold=5, chunk_size=1000):
+    """
+    Single-pass, constant-memory version of fix_gpx_file
+    
+    Reads the input once, filters points as they arrive and writes <trkpt>
+    elements to the output in chunks, keeping the original track and segment
+    structure. Filters work within each segment: the distance filter always
+    keeps a segment's first and last point, and the jitter filter drops runs
+    of more than 5 consecutive moves under 1 m. Gzip-compressed (.gz) input
+    and output are supported.
+    
+    Parameters:
+    - gpx_file_path: Path to the original GPX file
+    - output_path: Path to save the fixed GPX file
+    - filter_method: 'distance' or 'jitter'
+    - threshold: For distance filtering, minimum distance between points in meters
+    - chunk_size: Number of track points buffered between writes
+    
+    Returns:
+    - Path to the fixed GPX file
+    """
+    if filter_method not in ('distance', 'jitter'):
+        raise ValueError(f"Unknown streaming filter method: {filter_method} (use 'distance' or 'jitter'; "
+                         f"'stationary' needs the non-streaming fix_gpx_file)")
+    
+    original_points = 0
+    original_distance = 0.0
+    filtered_distance = 0.0
+    
+    with GPXStreamWriter(output_path, chunk_size) as writer:
+        last_written = None
+        
+        def emit(point):
+            nonlocal last_written, filtered_distance
+            if last_written is not None:
+                filtered_distance += haversine(last_written[:2], point[:2])
+            writer.write_point(*point)
+            last_written = point
+        
+        for event in iter_gpx_events(gpx_file_path):
+            kind = event[0]
+            
+            if kind == 'point':
+                point = event[1:]
+                original_points += 1
+                
+                if previous is None:
+                    emit(point)
+                    previous = point
+                    kept = point
+                    continue
+                
+                step = haversine(previous[:2], point[:2], unit='m')
+                original_distance += step / 1000
+                previous = point
+                
+                if filter_method == 'distance':
+                    if haversine(kept[:2], point[:2], unit='m') >= threshold:
+                        emit(point)
+                        kept = point
+                        pending = None
+                    else:
+                        pending = point
+                else:
+                    if step < 1:  # Less than 1 meter movement is suspect
+                        run_length += 1
+                        if run_length > 5:  # More than 5 very small movements in a row
+                            pending_run = []
+                        else:
+                            pending_run.append(point)
+                    else:
+                        for run_point in pending_run:
+                            emit(run_point)
+                        pending_run = []
+                        run_length = 0
+                        emit(point)
+            elif kind == 'segment':
+                writer.start_segment()
+                previous = None
+                kept = None
+                pending = None
+                pending_run = []
+                run_length = 0
+                # Distance is not carried across segment boundaries
+                last_written = None
+            elif kind == 'segment_end':
+                # Always keep the last point of the segment
+                if pending is not None:
+                    emit(pending)
+                for run_point in pending_run:
+                    emit(run_point)
+                writer.end_segment()
+            elif kind == 'track':
+                writer.start_track(event[1], event[2])
+            elif kind == 'track_end':
+                writer.end_track()
+    
+    print(f"Fixed GPX file saved to: {output_path}")
+    print(f"Original points: {original_points}")
+    print(f"Filtered points: {writer.points_written}")
+    print(f"Distance reduction: {original_distance - filtered_distance:.2f} km")
     
     return output_path
 
@@ -0,0 +1,178 @@
+"""
+Streaming GPX reading and writing
+
+The reader walks a GPX file with ElementTree.iterparse and discards each
+element once it has been handled, so memory stays constant however long the
+track is. Files ending in .gz are read and written through gzip.
+"""
+import gzip
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from xml.sax.saxutils import escape, quoteattr
+
+
+def open_gpx(path, mode='rb'):
+    """
+    Open a GPX file, transparently handling gzip-compressed archives
+    """
+    if str(path).endswith('.gz'):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def parse_gpx_time(text):
+    """
+    Parse GPX time text (ISO 8601, accepting a trailing 'Z') to a datetime, or None when missing
+    """
+    if not text:
+        return None
+    return datetime.fromisoformat(text.strip().replace('Z', '+00:00'))
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def iter_gpx_events(gpx_file_path):
+    """
+    Stream the track structure of a GPX file as a sequence of events
+
+    Yields tuples:
+    - ('track', name, type) when a track's first segment starts
+    - ('segment',) at the start of each track segment
+    - ('point', latitude, longitude, elevation_text, time_text) for each track point
+    - ('segment_end',) and ('track_end',) when a segment or track closes
+
+    Elevation and time are passed through as the original text (or None).
+    """
+    with open_gpx(gpx_file_path) as f:
+        stack = []
+        track_name = None
+        track_type = None
+        track_started = False
+
+        for event, elem in ET.iterparse(f, events=('start', 'end')):
+            tag = _local_name(elem.tag)
+
+            if event == 'start':
+                stack.append(elem)
+                if tag == 'trk':
+                    track_name = None
+                    track_type = None
+                    track_started = False
+                elif tag == 'trkseg':
+                    if not track_started:
+                        track_started = True
+                        yield ('track', track_name, track_type)
+                    yield ('segment',)
+                continue
+
+            stack.pop()
+            parent = stack[-1] if stack else None
+            parent_tag = _local_name(parent.tag) if parent is not None else None
+
+            if tag == 'trkpt':
+                elevation = None
+                point_time = None
+                for child in elem:
+                    child_tag = _local_name(child.tag)
+                    if child_tag == 'ele':
+                        elevation = child.text
+                    elif child_tag == 'time':
+                        point_time = child.text
+                yield ('point', float(elem.get('lat')), float(elem.get('lon')), elevation, point_time)
+            elif tag == 'name' and parent_tag == 'trk':
+                track_name = elem.text
+            elif tag == 'type' and parent_tag == 'trk':
+                track_type = elem.text
+            elif tag == 'trkseg':
+                yield ('segment_end',)
+            elif tag == 'trk':
+                if not track_started:
+                    yield ('track', track_name, track_type)
+                yield ('track_end',)
+
+            # Drop handled elements so the tree never grows; a point's children
+            # are kept until the point itself has been read
+            if parent is not None and parent_tag != 'trkpt':
+                parent.remove(elem)
+
+
+def iter_gpx_points(gpx_file_path):
+    """
+    Stream (segment_index, latitude, longitude, elevation_text, time_text) for every track point
+    """
+    segment_index = -1
+    for event in iter_gpx_events(gpx_file_path):
+        if event[0] == 'segment':
+            segment_index += 1
+        elif event[0] == 'point':
+            yield (segment_index,) + event[1:]
+
+
+class GPXStreamWriter:
+    """
+    Write GPX tracks incrementally, flushing track points in chunks
+
+    Parameters:
+    - output_path: Path of the GPX file to write (.gz is compressed)
+    - chunk_size: Number of track points buffered between writes
+    - creator: Value of the creator attribute of the gpx element
+    """
+
+    def __init__(self, output_path, chunk_size=1000, creator='SpeedProject gpx_analyser'):
+        self.chunk_size = chunk_size
+        self.points_written = 0
+        self._buffer = []
+        self._buffered_points = 0
+        self._file = open_gpx(output_path, 'wt')
+        self._file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        self._file.write(f'<gpx version="1.1" creator={quoteattr(creator)} xmlns="http://www.topografix.com/GPX/1/1">\n')
+
+    def start_track(self, name=None, track_type=None):
+        self._buffer.append('  <trk>\n')
+        if name:
+            self._buffer.append(f'    <name>{escape(name)}</name>\n')
+        if track_type:
+            self._buffer.append(f'    <type>{escape(track_type)}</type>\n')
+
+    def start_segment(self):
+        self._buffer.append('    <trkseg>\n')
+
+    def write_point(self, latitude, longitude, elevation=None, point_time=None, comment=None):
+        parts = [f'      <trkpt lat="{latitude!r}" lon="{longitude!r}">']
+        if elevation is not None:
+            parts.append(f'<ele>{escape(str(elevation))}</ele>')
+        if point_time is not None:
+            parts.append(f'<time>{escape(str(point_time))}</time>')
+        if comment is not None:
+            parts.append(f'<cmt>{escape(comment)}</cmt>')
+        parts.append('</trkpt>\n')
+        self._buffer.append(''.join(parts))
+
+        self.points_written += 1
+        self._buffered_points += 1
+        if self._buffered_points >= self.chunk_size:
+            self.flush()
+
+    def end_segment(self):
+        self._buffer.append('    </trkseg>\n')
+
+    def end_track(self):
+        self._buffer.append('  </trk>\n')
+
+    def flush(self):
+        self._file.write(''.join(self._buffer))
+        self._buffer = []
+        self._buffered_points = 0
+
+    def close(self):
+        self.flush()
+        self._file.write('</gpx>\n')
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,408 @@
+"""
+Live tracking of a run against the planned route
+
+LiveTracker keeps online accumulators (distance, elevation gain, jitter runs,
+time gaps, moving time and position along the planned route) that are
+updated in O(1) per point, so following a multi-day run never re-analyzes the
+points already seen. Points arrive in batches from one of the feeds below:
+
+- tail_gpx: a GPX file that a recorder keeps appending to
+- tail_point_feed: a text file of one point per line
+- socket_point_feed: a local TCP or Unix socket sending one point per line
+
+Feed lines are JSON objects ({"lat": .., "lon": .., "ele": .., "time": ..})
+or CSV (lat,lon[,ele[,time]]), with ISO 8601 times. A new <trkseg> in a
+tailed GPX file starts a new segment: like load_gpx_to_dataframe, the step
+from the previous segment's last point is not counted as distance, jitter or
+a time gap.
+"""
+import json
+import os
+import re
+import socket
+import time
+from datetime import timedelta
+
+import numpy as np
+from haversine import haversine
+
+from distance_models import haversine as haversine_m
+from gpx_stream import parse_gpx_time
+
+TRKPT_PATTERN = re.compile(r'<trkpt\b([^>]*?)(?:/>|>(.*?)</trkpt>)', re.S)
+LAT_PATTERN = re.compile(r'\blat\s*=\s*["\']([^"\']+)["\']')
+LON_PATTERN = re.compile(r'\blon\s*=\s*["\']([^"\']+)["\']')
+ELE_PATTERN = re.compile(r'<ele>([^<]*)</ele>')
+TIME_PATTERN = re.compile(r'<time>([^<]*)</time>')
+SEGMENT_PATTERN = re.compile(r'<trkseg\b')
+
+
+class LiveTracker:
+    """
+    Online statistics for a run in progress
+
+    Parameters:
+    - route_df: Optional planned route DataFrame from load_gpx_to_dataframe
+    - rv_stops: Optional planned RV stops from calculate_optimal_rv_stops
+    - search_window: Planned-route vertices searched ahead of the last match per point
+    - reacquire_distance_m: If the best match in the window is further than this,
+      the runner is lost: each following point searches a window twice as
+      wide around the last match, up to the whole route
+    - reacquire_interval: Points to wait after a failed whole-route search
+      before widening the search again, so a long detour does not search the
+      whole route for every point
+    - jitter_distance_m: Moves shorter than this count towards a jitter run
+    - jitter_min_run: A run of more than this many short moves is jitter
+    - gap_threshold_s: Time steps longer than this are gaps, not moving time
+    """
+
+    def __init__(self, route_df=None, rv_stops=None, search_window=50, reacquire_distance_m=2000,
+                 reacquire_interval=50, jitter_distance_m=1, jitter_min_run=5, gap_threshold_s=300):
+        self.search_window = search_window
+        self.reacquire_distance_m = reacquire_distance_m
+        self.reacquire_interval = reacquire_interval
+        self.jitter_distance_m = jitter_distance_m
+        self.jitter_min_run = jitter_min_run
+        self.gap_threshold_s = gap_threshold_s
+
+        self.route_lat = None
+        self.route_lon = None
+        self.route_distance = None
+        if route_df is not None:
+            self.route_lat = route_df['latitude'].to_numpy(dtype=float)
+            self.route_lon = route_df['longitude'].to_numpy(dtype=float)
+            self.route_distance = route_df['cumulative_distance'].to_numpy(dtype=float)
+        self.stop_distances = sorted(stop['distance_km'] for stop in (rv_stops or []))
+
+        self.points = 0
+        self.distance_km = 0.0
+        self.elevation_gain_m = 0.0
+        self.moving_distance_km = 0.0
+        self.moving_time_s = 0.0
+        self.jitter_runs = 0
+        self.jitter_points = 0
+        self.time_gaps = 0
+        self.max_time_gap_s = 0.0
+        self.route_index = None
+        self.off_route_m = None
+
+        self._last = None
+        self._jitter_run = 0
+        self._reacquire_step = 0
+        self._reacquire_wait = 0
+
+    def add_point(self, latitude, longitude, elevation=None, point_time=None, new_segment=False):
+        """
+        Fold one point into the accumulators
+
+        A point with new_segment set starts a new track segment: the step from
+        the previous point is not measured.
+        """
+        self.points += 1
+
+        if self._last is not None:
+            last_lat, last_lon, last_ele, last_time = self._last
+            if elevation is not None and last_ele is not None and elevation > last_ele:
+                self.elevation_gain_m += elevation - last_ele
+
+        if new_segment:
+            self._jitter_run = 0
+        elif self._last is not None:
+            step_km = haversine((last_lat, last_lon), (latitude, longitude))
+            self.distance_km += step_km
+
+            if step_km * 1000 < self.jitter_distance_m:
+                self._jitter_run += 1
+                if self._jitter_run == self.jitter_min_run + 1:
+                    self.jitter_runs += 1
+                    self.jitter_points += self._jitter_run
+                elif self._jitter_run > self.jitter_min_run + 1:
+                    self.jitter_points += 1
+            else:
+                self._jitter_run = 0
+
+            if point_time is not None and last_time is not None:
+                step_s = (point_time - last_time).total_seconds()
+                if step_s > self.gap_threshold_s:
+                    self.time_gaps += 1
+                    self.max_time_gap_s = max(self.max_time_gap_s, step_s)
+                elif step_s > 0:
+                    # Speed uses only the steps that count as moving time
+                    self.moving_time_s += step_s
+                    self.moving_distance_km += step_km
+
+        if self.route_distance is not None:
+            self._match_route(latitude, longitude)
+
+        # Keep the last known elevation and time so a point missing either does not reset them
+        if self._last is not None:
+            elevation = elevation if elevation is not None else self._last[2]
+            point_time = point_time if point_time is not None else self._last[3]
+        self._last = (latitude, longitude, elevation, point_time)
+
+    def _match_route(self, latitude, longitude):
+        """
+        Update the position along the planned route from a bounded window of vertices
+        """
+        if self.route_index is None:
+            start, end = 0, len(self.route_distance)
+        else:
+            start = max(0, self.route_index - 5)
+            end = min(len(self.route_distance), self.route_index + self.search_window)
+
+        best_index, best_distance = self._nearest_vertex(latitude, longitude, start, end)
+
+        # Lost the runner (detour or recording restart): widen the search around the last match
+        # step by step, pausing for reacquire_interval points after a failed whole-route search
+        if best_distance <= self.reacquire_distance_m:
+            self._reacquire_step = 0
+        elif self._reacquire_wait > 0:
+            self._reacquire_wait -= 1
+        elif (start, end) != (0, len(self.route_distance)):
+            self._reacquire_step += 1
+            span = self.search_window * 2 ** min(self._reacquire_step, 40)
+            start = max(0, self.route_index - span)
+            end = min(len(self.route_distance), self.route_index + span)
+            wide_index, wide_distance = self._nearest_vertex(latitude, longitude, start, end)
+            if wide_distance < best_distance:
+                best_index, best_distance = wide_index, wide_distance
+            if (start, end) == (0, len(self.route_distance)) and best_distance > self.reacquire_distance_m:
+                self._reacquire_step = 0
+                self._reacquire_wait = self.reacquire_interval
+
+        self.route_index = best_index
+        self.off_route_m = best_distance
+
+    def _nearest_vertex(self, latitude, longitude, start, end):
+        distances = haversine_m(latitude, longitude, self.route_lat[start:end], self.route_lon[start:end])
+        offset = int(np.argmin(distances))
+        return start + offset, float(distances[offset])
+
+    def update(self, points):
+        """
+        Fold a batch of (latitude, longitude, elevation, time[, new_segment]) points and return a snapshot
+        """
+        for point in points:
+            self.add_point(*point)
+        return self.snapshot()
+
+    def snapshot(self):
+        """
+        Current statistics, including the position on the planned route and next RV stop ETA
+        """
+        speed_kmh = self.moving_distance_km / (self.moving_time_s / 3600) if self.moving_time_s > 0 else None
+        stats = {
+            'points': self.points,
+            'distance_km': self.distance_km,
+            'elevation_gain_m': self.elevation_gain_m,
+            'moving_distance_km': self.moving_distance_km,
+            'moving_time_s': self.moving_time_s,
+            'avg_speed_kmh': speed_kmh,
+            'jitter_runs': self.jitter_runs,
+            'jitter_points': self.jitter_points,
+            'time_gaps': self.time_gaps,
+            'max_time_gap_s': self.max_time_gap_s,
+            'last_time': self._last[3].isoformat() if self._last and self._last[3] else None
+        }
+
+        if self.route_index is not None:
+            route_km = float(self.route_distance[self.route_index])
+            stats.update({
+                'route_distance_km': route_km,
+                'route_progress_pct': route_km / self.route_distance[-1] * 100 if self.route_distance[-1] else 100.0,
+                'off_route_m': self.off_route_m
+            })
+
+            next_stops = [distance for distance in self.stop_distances if distance > route_km]
+            if next_stops:
+                remaining_km = next_stops[0] - route_km
+                stats['next_stop_distance_km'] = next_stops[0]
+                stats['next_stop_remaining_km'] = remaining_km
+                if speed_kmh:
+                    eta_hours = remaining_km / speed_kmh
+                    stats['next_stop_eta_hours'] = eta_hours
+                    if self._last[3] is not None:
+                        stats['next_stop_eta'] = (self._last[3] + timedelta(hours=eta_hours)).isoformat()
+
+        return stats
+
+
+def _parse_gpx_fragment(attributes, body, new_segment=False):
+    lat = float(LAT_PATTERN.search(attributes).group(1))
+    lon = float(LON_PATTERN.search(attributes).group(1))
+    elevation = None
+    point_time = None
+    if body:
+        ele_match = ELE_PATTERN.search(body)
+        time_match = TIME_PATTERN.search(body)
+        elevation = float(ele_match.group(1)) if ele_match else None
+        point_time = parse_gpx_time(time_match.group(1)) if time_match else None
+    return (lat, lon, elevation, point_time, new_segment)
+
+
+def parse_feed_line(line):
+    """
+    Parse one feed line (JSON object or CSV) into a (latitude, longitude, elevation, time) point
+    """
+    line = line.strip()
+    if line.startswith('{'):
+        record = json.loads(line)
+        elevation = record.get('ele', record.get('elevation'))
+        return (
+            float(record.get('lat', record.get('latitude'))),
+            float(record.get('lon', record.get('longitude'))),
+            float(elevation) if elevation is not None else None,
+            parse_gpx_time(record.get('time'))
+        )
+
+    fields = [field.strip() for field in line.split(',')]
+    return (
+        float(fields[0]),
+        float(fields[1]),
+        float(fields[2]) if len(fields) > 2 and fields[2] else None,
+        parse_gpx_time(fields[3]) if len(fields) > 3 else None
+    )
+
+
+def _tail_text(path, poll_interval, idle_timeout):
+    """
+    Yield text appended to a file, polling until it has been idle for idle_timeout seconds
+    """
+    offset = 0
+    idle_since = time.monotonic()
+    while True:
+        if os.path.exists(path) and os.path.getsize(path) > offset:
+            with open(path, 'r') as f:
+                f.seek(offset)
+                text = f.read()
+                offset = f.tell()
+            idle_since = time.monotonic()
+            yield text
+        elif idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+            return
+        else:
+            time.sleep(poll_interval)
+
+
+def tail_gpx(path, poll_interval=5.0, idle_timeout=None):
+    """
+    Follow a growing GPX file and yield batches of newly completed track points
+
+    Parameters:
+    - path: GPX file being written by a recorder
+    - poll_interval: Seconds between checks for new data
+    - idle_timeout: Stop after this many seconds without new data (None follows forever)
+    """
+    pending = ''
+    for text in _tail_text(path, poll_interval, idle_timeout):
+        pending += text
+        batch = []
+        consumed = 0
+        for match in TRKPT_PATTERN.finditer(pending):
+            new_segment = SEGMENT_PATTERN.search(pending, consumed, match.start()) is not None
+            batch.append(_parse_gpx_fragment(match.group(1), match.group(2), new_segment))
+            consumed = match.end()
+        # Keep any partially written <trkpt> for the next read
+        pending = pending[consumed:]
+        if batch:
+            yield batch
+
+
+def tail_point_feed(path, poll_interval=1.0, idle_timeout=None):
+    """
+    Follow a growing text feed of one point per line and yield batches of points
+    """
+    pending = ''
+    for text in _tail_text(path, poll_interval, idle_timeout):
+        pending += text
+        lines = pending.split('\n')
+        pending = lines.pop()
+        batch = [parse_feed_line(line) for line in lines if line.strip()]
+        if batch:
+            yield batch
+
+
+def socket_point_feed(address, flush_interval=1.0, batch_size=500):
+    """
+    Read points from a local socket and yield them in batches
+
+    Parameters:
+    - address: 'host:port' for TCP or a filesystem path for a Unix socket
+    - flush_interval: Yield a partial batch after this many quiet seconds
+    - batch_size: Yield as soon as this many points have arrived
+    """
+    if ':' in address and not os.path.exists(address):
+        host, port = address.rsplit(':', 1)
+        connection = socket.create_connection((host, int(port)))
+    else:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(address)
+    connection.settimeout(flush_interval)
+
+    pending = b''
+    batch = []
+    with connection:
+        while True:
+            try:
+                data = connection.recv(65536)
+            except socket.timeout:
+                data = None
+
+            if data:
+                pending += data
+                lines = pending.split(b'\n')
+                pending = lines.pop()
+                batch.extend(parse_feed_line(line.decode()) for line in lines if line.strip())
+
+            closed = data == b''
+            if batch and (data is None or closed or len(batch) >= batch_size):
+                yield batch
+                batch = []
+            if closed:
+                if pending.strip():
+                    yield [parse_feed_line(pending.decode())]
+                return
+
+
+def track_live(planned_gpx, feed, target_daily_distance=125, emit=None):
+    """
+    Follow a run against a planned route, emitting updated statistics per batch
+
+    Parameters:
+    - planned_gpx: GPX file of the planned route
+    - feed: Iterable of point batches (from tail_gpx, tail_point_feed or socket_point_feed)
+    - target_daily_distance: Target distance per day in km for the planned RV stops
+    - emit: Callable receiving each snapshot (prints a progress line by default)
+
+    Returns:
+    - The LiveTracker with its final state
+    """
+    from route_compare import load_gpx_to_dataframe, calculate_optimal_rv_stops
+
+    route_df = load_gpx_to_dataframe(planned_gpx)
+    rv_stops = calculate_optimal_rv_stops(route_df, target_daily_distance)
+    tracker = LiveTracker(route_df, rv_stops)
+
+    if emit is None:
+        emit = print_snapshot
+
+    for batch in feed:
+        emit(tracker.update(batch))
+
+    return tracker
+
+
+def print_snapshot(stats):
+    """
+    Print a one-line summary of a LiveTracker snapshot
+    """
+    line = f"{stats['points']} pts, {stats['distance_km']:.2f} km, +{stats['elevation_gain_m']:.0f} m"
+    if 'route_distance_km' in stats:
+        line += f", route km {stats['route_distance_km']:.2f} ({stats['route_progress_pct']:.1f}%), off route {stats['off_route_m']:.0f} m"
+    if 'next_stop_remaining_km' in stats:
+        line += f", next RV stop in {stats['next_stop_remaining_km']:.2f} km"
+        if 'next_stop_eta_hours' in stats:
+            line += f" (ETA {stats['next_stop_eta_hours']:.1f} h)"
+    if stats['time_gaps']:
+        line += f", {stats['time_gaps']} time gaps"
+    print(line)
@@ -0,0 +1,124 @@
+"""
+Stage checkpoints for the route planning pipeline
+
+Each stage result is pickled per route together with a key hashed from the
+stage's inputs (the GPX file contents, the parameters and the keys of the
+stages it depends on). A re-run loads every stage whose key still matches
+and recomputes only the stages whose inputs changed, so a crash or quota
+error late in a long, rate-limited Google Maps run loses at most the stage
+that was in progress.
+"""
+import hashlib
+import json
+import os
+import pickle
+
+
+def file_digest(path, block_size=1 << 20):
+    """
+    SHA-256 of a file's contents
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def stage_key(*inputs):
+    """
+    Hash the inputs of a stage (JSON-serialisable values or keys of earlier stages)
+    """
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class StageCheckpoints:
+    """
+    Per-route store of stage results keyed by input hashes
+
+    Parameters:
+    - checkpoint_dir: Directory holding one subdirectory per route; if None,
+      stages always run and nothing is stored
+    - metrics: Optional PipelineMetrics; checkpoint hits and misses are counted,
+      and results of stages during which a Google Maps call failed are not
+      stored, so they are retried on the next run
+    """
+
+    def __init__(self, checkpoint_dir=None, metrics=None):
+        self.checkpoint_dir = checkpoint_dir
+        self.metrics = metrics
+        # Keys of stages computed this run but not stored; their dependents are not stored either
+        self._unsaved = set()
+        if checkpoint_dir:
+            os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def _path(self, route_name, stage):
+        return os.path.join(self.checkpoint_dir, route_name, f"{stage}.pkl")
+
+    def load(self, route_name, stage, key):
+        """
+        Stored result of a stage if its key matches
+
+        Returns:
+        - (True, result) on a hit, (False, None) otherwise
+        """
+        if not self.checkpoint_dir:
+            return False, None
+        try:
+            with open(self._path(route_name, stage), 'rb') as f:
+                stored = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False, None
+        if stored.get('key') != key:
+            return False, None
+        return True, stored['result']
+
+    def save(self, route_name, stage, key, result):
+        """
+        Store the result of a stage, replacing the previous checkpoint atomically
+        """
+        if not self.checkpoint_dir:
+            return
+        path = self._path(route_name, stage)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'wb') as f:
+            pickle.dump({'key': key, 'result': result}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, path)
+
+    def run(self, route_name, stage, key, compute, depends_on=()):
+        """
+        Return the checkpointed result of a stage, or compute and store it
+
+        depends_on lists the keys of the stages whose results compute uses.
+        """
+        hit, result = self.load(route_name, stage, key)
+        if hit:
+            print(f"  Reusing checkpoint: {stage}")
+            if self.metrics:
+                self.metrics.count('checkpoint_hits')
+            return result
+
+        if self.metrics:
+            self.metrics.count('checkpoint_misses')
+        errors_before = self.metrics.counters.get('api_errors', 0) if self.metrics else 0
+
+        result = compute()
+
+        errors = (self.metrics.counters.get('api_errors', 0) if self.metrics else 0) - errors_before
+        if errors:
+            print(f"  Not saving checkpoint for {stage}: {errors} Google Maps call(s) failed")
+            self._unsaved.add(key)
+        elif self._unsaved.intersection(depends_on):
+            print(f"  Not saving checkpoint for {stage}: it uses results that were not saved")
+            self._unsaved.add(key)
+        else:
+            self.save(route_name, stage, key, result)
+            self._unsaved.discard(key)
+        return result
+
+    def incomplete(self, key):
+        """
+        True if the last run of a stage had failed Google Maps calls (or used such results)
+        """
+        return key in self._unsaved
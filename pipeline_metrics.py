@@ -0,0 +1,176 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import time
+from contextlib import contextmanager
+
+
+class PipelineMetrics:
+    """
+    Collect stage timings and counters for the GPX pipelines
+
+    Parameters:
+    - json_path: Optional path the metrics are written to as JSON on finish()
+    - callback: Optional callable receiving the metrics dictionary on finish()
+    - profile: If True, run cProfile around each stage and dump the hottest one
+    - profile_path: Optional path for the raw cProfile dump (printed if omitted)
+    """
+
+    def __init__(self, json_path=None, callback=None, profile=False, profile_path=None):
+        self.json_path = json_path
+        self.callback = callback
+        self.profile = profile
+        self.profile_path = profile_path
+        self.stages = {}
+        self.counters = {
+            'points': 0,
+            'bytes_read': 0,
+            'api_calls': 0,
+            'api_errors': 0,
+            'cache_hits': 0,
+            'cache_misses': 0,
+            'map_bytes': 0
+        }
+        self._profilers = {}
+        self._profiling_stage = None
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a pipeline stage; repeated stages accumulate
+        """
+        profiler = None
+        # cProfile only allows one active profiler, so nested stages are timed but not profiled
+        if self.profile and self._profiling_stage is None:
+            profiler = self._profilers.setdefault(name, cProfile.Profile())
+            self._profiling_stage = name
+            profiler.enable()
+
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - start
+            if profiler:
+                profiler.disable()
+                self._profiling_stage = None
+
+            entry = self.stages.setdefault(name, {'wall_time_s': 0.0, 'calls': 0})
+            entry['wall_time_s'] += elapsed
+            entry['calls'] += 1
+
+    def count(self, name, amount=1):
+        """
+        Increment a counter
+        """
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record_file_read(self, path):
+        """
+        Add the size of an input file to the bytes read counter
+        """
+        self.count('bytes_read', os.path.getsize(path))
+
+    def record_map_output(self, path):
+        """
+        Add the size of a written map file to the map output counter
+        """
+        self.count('map_bytes', os.path.getsize(path))
+
+    def instrument_client(self, client):
+        """
+        Wrap a Google Maps client so every API call is counted
+        """
+        if client is None or isinstance(client, _CountingClient):
+            return client
+        return _CountingClient(client, self)
+
+    def hottest_stage(self):
+        """
+        Name of the stage with the largest accumulated wall time
+        """
+        if not self.stages:
+            return None
+        return max(self.stages, key=lambda name: self.stages[name]['wall_time_s'])
+
+    def profile_report(self, limit=25):
+        """
+        cProfile statistics for the hottest profiled stage as text
+        """
+        profiled = {name: self.stages[name] for name in self._profilers if name in self.stages}
+        if not profiled:
+            return ""
+        hottest = max(profiled, key=lambda name: profiled[name]['wall_time_s'])
+
+        stream = io.StringIO()
+        stats = pstats.Stats(self._profilers[hottest], stream=stream)
+        stats.sort_stats('cumulative').print_stats(limit)
+        return f"Profile for stage '{hottest}':\n{stream.getvalue()}"
+
+    def to_dict(self):
+        """
+        Metrics as a JSON-serialisable dictionary
+        """
+        return {
+            'total_wall_time_s': time.perf_counter() - self._started,
+            'stages': {name: dict(entry) for name, entry in self.stages.items()},
+            'counters': dict(self.counters),
+            'hottest_stage': self.hottest_stage()
+        }
+
+    def finish(self):
+        """
+        Write the metrics to JSON, push them to the callback and dump the profile
+
+        Returns:
+        - Metrics dictionary
+        """
+        metrics = self.to_dict()
+
+        if self.json_path:
+            with open(self.json_path, 'w') as f:
+                json.dump(metrics, f, indent=2)
+
+        if self.callback:
+            self.callback(metrics)
+
+        if self.profile and self._profilers:
+            if self.profile_path:
+                hottest = max(
+                    (name for name in self._profilers if name in self.stages),
+                    key=lambda name: self.stages[name]['wall_time_s']
+                )
+                self._profilers[hottest].dump_stats(self.profile_path)
+                print(f"Profile for stage '{hottest}' saved to: {self.profile_path}")
+            else:
+                print(self.profile_report())
+
+        return metrics
+
+
+class _CountingClient:
+    """
+    Proxy around a Google Maps client that counts API calls and failed calls
+    """
+
+    def __init__(self, client, metrics):
+        self._client = client
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def counted(*args, **kwargs):
+            self._metrics.count('api_calls')
+            try:
+                return attr(*args, **kwargs)
+            except Exception:
+                self._metrics.count('api_errors')
+                raise
+
+        return counted
@@ -0,0 +1,576 @@
+"""
+Differential checks of the fast paths against reference implementations
+
+The reference_* functions keep the original point-by-point loops of
+filter_by_distance, filter_jitter_clusters, calculate_total_distance,
+calculate_optimal_rv_stops (without Google Maps), the anomalies of
+compute_gpx_stats and the distance and elevation columns of
+load_gpx_to_dataframe, applied to each track segment on its own. They are
+slow but simple enough to trust. run_checks runs each fast path and its
+reference on the same tracks, reports the largest absolute and relative
+difference next to the speedup, and fails a check when the results disagree
+beyond the tolerance. collapse_stationary_periods has no loop to compare
+against; it is checked to give the same points on the whole track as on
+each segment separately.
+
+Tracks are the bundled GPX files plus generated ones covering the edge
+cases: duplicate points, antimeridian crossings, zero-length and
+single-point tracks, missing elevations and times, jitter runs, stops and
+a steady walk (on which no dwell may be detected, with or without times),
+each as a single segment and split into segments separated by jumps and
+time gaps. Pass a distance model to see whether a cheaper model stays
+within tolerance before enabling it.
+
+Usage:
+    python cli.py verify gpx/HS_TSP_Solo.gpx TSP_solo.gpx --cases 20
+"""
+import contextlib
+import io
+import math
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import gpxpy
+import gpxpy.gpx
+import numpy as np
+from haversine import haversine
+
+from gpx_analyser import (
+    add_point_distances, calculate_total_distance, collapse_stationary_periods, compute_gpx_stats,
+    detect_stationary_periods, filter_by_distance, filter_jitter_clusters, load_gpx_points
+)
+from route_compare import calculate_optimal_rv_stops, load_gpx_to_dataframe
+
+# Kinds of generated tracks, cycled through by generated_tracks
+TRACK_KINDS = ('random_walk', 'duplicates', 'antimeridian', 'zero_length', 'single_point', 'missing_elevation',
+               'missing_time', 'jitter', 'stops', 'walk')
+
+# Segments of the generated tracks in the second pass through TRACK_KINDS
+MULTI_SEGMENT_COUNT = 4
+
+
+def _segment_frames(df):
+    """
+    (start position, DataFrame) of each track segment of a point DataFrame
+    """
+    if 'segment' not in df.columns:
+        return [(0, df)]
+    segment = df['segment'].to_numpy()
+    bounds = np.concatenate(([0], np.flatnonzero(segment[1:] != segment[:-1]) + 1, [len(df)]))
+    return [(int(start), df.iloc[start:stop].reset_index(drop=True)) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def reference_load_gpx_to_dataframe(gpx_file):
+    """
+    Original load_gpx_to_dataframe: distance and elevation columns computed row by row
+    """
+    import pandas as pd
+
+    with open(gpx_file, 'r') as f:
+        gpx = gpxpy.parse(f)
+
+    points = []
+    segment_index = 0
+    for track in gpx.tracks:
+        for segment in track.segments:
+            for point in segment.points:
+                points.append({
+                    'latitude': point.latitude,
+                    'longitude': point.longitude,
+                    'elevation': point.elevation if point.elevation else 0,
+                    'time': point.time,
+                    'segment': segment_index
+                })
+            segment_index += 1
+
+    df = pd.DataFrame(points)
+
+    df['segment_distance'] = 0.0
+    for i in range(1, len(df)):
+        # The gap to the previous segment is not part of the route
+        if df.iloc[i]['segment'] != df.iloc[i-1]['segment']:
+            continue
+        point1 = (df.iloc[i-1]['latitude'], df.iloc[i-1]['longitude'])
+        point2 = (df.iloc[i]['latitude'], df.iloc[i]['longitude'])
+        df.loc[i, 'segment_distance'] = haversine(point1, point2, unit='km')
+
+    df['cumulative_distance'] = df['segment_distance'].cumsum()
+
+    df['elevation_change'] = 0.0
+    for i in range(1, len(df)):
+        df.loc[i, 'elevation_change'] = df.iloc[i]['elevation'] - df.iloc[i-1]['elevation']
+
+    df['elevation_gain'] = df['elevation_change'].apply(lambda x: max(0, x))
+    df['elevation_loss'] = df['elevation_change'].apply(lambda x: abs(min(0, x)))
+    df['cumulative_elevation_gain'] = df['elevation_gain'].cumsum()
+
+    return df
+
+
+def reference_filter_by_distance(df, min_distance_meters=5):
+    """
+    Original filter_by_distance: greedy filter measuring each point against the last kept one
+
+    Each segment is filtered on its own and keeps its first and last point.
+    """
+    if len(df) <= 1:
+        return df
+
+    cleaned_points = []
+    for start, segment in _segment_frames(df):
+        kept = [0]
+        last_included = 0
+
+        for i in range(1, len(segment)):
+            point1 = (segment.iloc[last_included]['latitude'], segment.iloc[last_included]['longitude'])
+            point2 = (segment.iloc[i]['latitude'], segment.iloc[i]['longitude'])
+
+            dist_m = haversine(point1, point2, unit='m')
+
+            if dist_m >= min_distance_meters:
+                kept.append(i)
+                last_included = i
+
+        if kept[-1] != len(segment) - 1:
+            kept.append(len(segment) - 1)
+        cleaned_points.extend(start + i for i in kept)
+
+    return df.iloc[cleaned_points].reset_index(drop=True)
+
+
+def _step_distances_m(df):
+    distances = []
+    for i in range(1, len(df)):
+        point1 = (df.iloc[i-1]['latitude'], df.iloc[i-1]['longitude'])
+        point2 = (df.iloc[i]['latitude'], df.iloc[i]['longitude'])
+        distances.append(haversine(point1, point2, unit='m'))
+    return distances
+
+
+def reference_jitter_segments(df):
+    """
+    Original jitter detection: runs of more than 5 consecutive moves under 1 m within a segment
+    """
+    jitter_segments = []
+    for start, segment in _segment_frames(df):
+        current_segment = []
+        for i, dist in enumerate(_step_distances_m(segment)):
+            if dist < 1:
+                current_segment.append(start + i+1)
+            else:
+                if len(current_segment) > 5:
+                    jitter_segments.append(current_segment)
+                current_segment = []
+
+        if current_segment and len(current_segment) > 5:
+            jitter_segments.append(current_segment)
+
+    return jitter_segments
+
+
+def reference_large_jumps(df):
+    """
+    Original large jump detection: (index, meters) of moves over 500 m within a segment
+    """
+    return [(start + i+1, dist) for start, segment in _segment_frames(df)
+            for i, dist in enumerate(_step_distances_m(segment)) if dist > 500]
+
+
+def reference_time_gaps(df):
+    """
+    Original time gap detection: (index, seconds) of steps over 5 minutes between timed points of a segment
+    """
+    time_gaps = []
+    for start, segment in _segment_frames(df):
+        for i in range(1, len(segment)):
+            if segment.iloc[i]['time'] and segment.iloc[i-1]['time']:
+                gap = (segment.iloc[i]['time'] - segment.iloc[i-1]['time']).total_seconds()
+                if gap > 300:
+                    time_gaps.append((start + i, gap))
+    return time_gaps
+
+
+def reference_filter_jitter_clusters(df, jitter_segments):
+    """
+    Original filter_jitter_clusters: drop every point of the jitter runs
+    """
+    if not jitter_segments or len(df) <= 1:
+        return df
+
+    points_to_remove = set()
+    for segment in jitter_segments:
+        points_to_remove.update(segment)
+
+    keep_indices = [i for i in range(len(df)) if i not in points_to_remove]
+
+    return df.iloc[keep_indices].reset_index(drop=True)
+
+
+def reference_calculate_total_distance(df):
+    """
+    Original calculate_total_distance: sum of haversine steps in km within each segment
+    """
+    if len(df) <= 1:
+        return 0
+
+    total_dist = 0
+    for _, segment in _segment_frames(df):
+        for i in range(1, len(segment)):
+            point1 = (segment.iloc[i-1]['latitude'], segment.iloc[i-1]['longitude'])
+            point2 = (segment.iloc[i]['latitude'], segment.iloc[i]['longitude'])
+            total_dist += haversine(point1, point2)
+
+    return total_dist
+
+
+def reference_calculate_optimal_rv_stops(route_df, target_distance=125):
+    """
+    Original calculate_optimal_rv_stops without Google Maps: the point closest to each day's target distance
+    """
+    total_distance = route_df['cumulative_distance'].iloc[-1]
+    num_days = math.ceil(total_distance / target_distance)
+
+    initial_stops = []
+    for day in range(1, num_days):
+        target_distance_km = day * target_distance
+        closest_idx = (route_df['cumulative_distance'] - target_distance_km).abs().idxmin()
+        initial_stops.append({
+            'day': day,
+            'distance_km': route_df.loc[closest_idx, 'cumulative_distance'],
+            'latitude': route_df.loc[closest_idx, 'latitude'],
+            'longitude': route_df.loc[closest_idx, 'longitude'],
+            'elevation': route_df.loc[closest_idx, 'elevation'],
+            'elevation_gain_so_far': route_df.loc[closest_idx, 'cumulative_elevation_gain'],
+            'index': closest_idx
+        })
+
+    return initial_stops
+
+
+def generate_track(kind, points=2000, seed=0, segments=1):
+    """
+    Generate a track of one kind (see TRACK_KINDS)
+
+    With several segments, each later segment starts about a kilometre away
+    from where the previous one ended and after a time gap of 10 minutes to
+    2 hours, as when a recording is paused. Every track also has a few time
+    gaps within its segments.
+
+    Returns:
+    - List of (latitude, longitude, elevation, time, segment) tuples; elevation and time may be None
+    """
+    rng = np.random.default_rng(seed)
+    if kind in ('zero_length', 'single_point'):
+        # One point recorded over and over, or just once
+        points = 1 if kind == 'single_point' else points
+        lat = np.full(points, rng.uniform(-60, 60))
+        lon = np.full(points, rng.uniform(-180, 180))
+    elif kind == 'walk':
+        # Steady walk of 1-2 m steps along a slowly turning heading, with metre-scale noise
+        heading = rng.uniform(0, 2 * np.pi) + np.cumsum(rng.normal(0, 0.05, points))
+        step_m = rng.uniform(1, 2, points)
+        lat = rng.uniform(-60, 60) + np.cumsum(step_m * np.cos(heading)) / 111195 + rng.normal(0, 1e-5, points)
+        lon = rng.uniform(-170, 170) + np.cumsum(step_m * np.sin(heading)) / (111195 * np.cos(np.radians(lat))) + rng.normal(0, 1e-5, points)
+    else:
+        # Steps of a few metres, with occasional large jumps
+        step = rng.normal(0, 5e-5, (points, 2))
+        step[rng.random(points) < 0.002] *= 200
+        start_lon = 179.9 if kind == 'antimeridian' else rng.uniform(-170, 170)
+        if kind == 'antimeridian':
+            step[:, 1] += 2e-4
+        lat = np.clip(rng.uniform(-60, 60) + np.cumsum(step[:, 0]), -89.9, 89.9)
+        lon = (start_lon + np.cumsum(step[:, 1]) + 180) % 360 - 180
+
+    # First point of every segment after the first
+    segments = min(segments, points)
+    splits = np.sort(rng.choice(np.arange(1, points), segments - 1, replace=False)) if segments > 1 else np.zeros(0, dtype=int)
+
+    if kind == 'duplicates':
+        # Repeat random points in place
+        repeats = rng.choice([1, 2, 5], points, p=[0.8, 0.15, 0.05])
+        lat, lon = np.repeat(lat, repeats)[:points], np.repeat(lon, repeats)[:points]
+    elif kind == 'jitter':
+        # Runs of sub-metre drift around fixed spots
+        for start in rng.choice(points, 20, replace=False):
+            stop = min(start + int(rng.integers(3, 15)), points)
+            lat[start:stop] = lat[start] + rng.normal(0, 2e-6, stop - start)
+            lon[start:stop] = lon[start] + rng.normal(0, 2e-6, stop - start)
+    elif kind == 'stops':
+        # Stops of a few minutes with metre-scale drift, including one ending and one starting each segment
+        spots = [(start, min(start + int(rng.integers(30, 80)), points)) for start in rng.choice(points, 8, replace=False)]
+        spots += [(max(split - 40, 0), split) for split in splits] + [(split, min(split + 40, points)) for split in splits]
+        for start, stop in spots:
+            lat[start:stop] = lat[start] + rng.normal(0, 2e-5, stop - start)
+            lon[start:stop] = lon[start] + rng.normal(0, 2e-5, stop - start)
+
+    if kind != 'zero_length':
+        for split in splits:
+            lat[split:] = np.clip(lat[split:] + rng.choice([-1, 1]) * 0.01, -89.9, 89.9)
+            lon[split:] = (lon[split:] + rng.choice([-1, 1]) * 0.01 + 180) % 360 - 180
+
+    elevation = 500 + np.cumsum(rng.normal(0, 1, len(lat)))
+    start_time = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    step_s = rng.integers(1, 10, len(lat))
+    step_s[rng.random(len(lat)) < 0.003] += rng.integers(600, 3600)
+    step_s[splits] += rng.integers(600, 7200, len(splits))
+    seconds = np.cumsum(step_s)
+    segment = np.searchsorted(splits, np.arange(len(lat)), side='right')
+    track = []
+    for i in range(len(lat)):
+        point_elevation = float(elevation[i])
+        point_time = start_time + timedelta(seconds=int(seconds[i]))
+        if kind == 'missing_elevation' and rng.random() < 0.3:
+            point_elevation = None
+        if kind == 'missing_time' and rng.random() < 0.3:
+            point_time = None
+        track.append((float(lat[i]), float(lon[i]), point_elevation, point_time, int(segment[i])))
+    return track
+
+
+def write_track(track, output_path):
+    """
+    Write a generated track to a GPX file, one <trkseg> per segment
+    """
+    gpx = gpxpy.gpx.GPX()
+    gpx_track = gpxpy.gpx.GPXTrack()
+    gpx.tracks.append(gpx_track)
+    segment = None
+    for lat, lon, elevation, point_time, segment_index in track:
+        if segment is None or segment_index != len(gpx_track.segments) - 1:
+            segment = gpxpy.gpx.GPXTrackSegment()
+            gpx_track.segments.append(segment)
+        segment.points.append(gpxpy.gpx.GPXTrackPoint(lat, lon, elevation=elevation, time=point_time))
+    with open(output_path, 'w') as f:
+        f.write(gpx.to_xml())
+    return output_path
+
+
+def _timed(function, *args, **kwargs):
+    """
+    Call a function with its output silenced; returns the result and the wall time
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+    return result, elapsed
+
+
+def _difference(reference, fast, rtol, atol):
+    """
+    Compare two numeric arrays
+
+    Returns:
+    - Largest absolute and relative difference, and whether every difference
+      is within atol + rtol * |reference| (False if the shapes differ)
+    """
+    reference = np.atleast_1d(np.asarray(reference, dtype=float))
+    fast = np.atleast_1d(np.asarray(fast, dtype=float))
+    if reference.shape != fast.shape:
+        return math.inf, math.inf, False
+    if not reference.size:
+        return 0.0, 0.0, True
+    absolute = np.abs(reference - fast)
+    relative = absolute / np.maximum(np.abs(reference), np.finfo(float).tiny)
+    relative[absolute == 0] = 0.0
+    within = bool(np.all(absolute <= atol + rtol * np.abs(reference)))
+    return float(absolute.max()), float(relative.max()), within
+
+
+def _compare_columns(reference_df, fast_df, columns, rtol, atol):
+    differences = [_difference(reference_df[column], fast_df[column], rtol, atol) for column in columns]
+    return max(d[0] for d in differences), max(d[1] for d in differences), all(d[2] for d in differences)
+
+
+def _compare_points(reference_df, fast_df, rtol, atol):
+    """
+    Compare the points kept by two filters
+    """
+    if len(reference_df) != len(fast_df):
+        return math.inf, math.inf, False, f"kept {len(fast_df)} points, reference kept {len(reference_df)}"
+    return _compare_columns(reference_df, fast_df, ['latitude', 'longitude'], rtol, atol)
+
+
+def _compare_stops(reference_stops, fast_stops, rtol, atol):
+    if len(reference_stops) != len(fast_stops):
+        return math.inf, math.inf, False, f"{len(fast_stops)} stops, reference placed {len(reference_stops)}"
+    if [stop['index'] for stop in reference_stops] != [stop['index'] for stop in fast_stops]:
+        return math.inf, math.inf, False, "stops at different points"
+    fields = ['distance_km', 'latitude', 'longitude', 'elevation', 'elevation_gain_so_far']
+    return _difference([[stop[field] for field in fields] for stop in reference_stops],
+                       [[stop[field] for field in fields] for stop in fast_stops], rtol, atol)
+
+
+def _compare_anomalies(reference_stats, fast_stats, rtol, atol):
+    """
+    Compare the large jumps, jitter runs and time gaps found by two paths
+    """
+    for key in ('large_jumps', 'jitter_segments', 'time_gaps'):
+        if key == 'jitter_segments':
+            same = reference_stats[key] == fast_stats[key]
+        else:
+            same = [i for i, _ in reference_stats[key]] == [i for i, _ in fast_stats[key]]
+        if not same:
+            return math.inf, math.inf, False, f"{key} at different points"
+    differences = [_difference([value for _, value in reference_stats[key]], [value for _, value in fast_stats[key]], rtol, atol)
+                   for key in ('large_jumps', 'time_gaps')]
+    return max(d[0] for d in differences), max(d[1] for d in differences), all(d[2] for d in differences)
+
+
+def check_track(gpx_file, distance_model='haversine', min_distance_m=5, target_daily_distance=125, rtol=1e-9, atol=1e-9):
+    """
+    Run every fast path and its reference on one GPX file
+
+    Returns:
+    - List of dictionaries with the check name, largest absolute and relative
+      difference, whether the results agree within tolerance, a note on
+      mismatches, and the reference and fast wall times
+    """
+    results = []
+
+    def record(check, reference_s, fast_s, max_abs, max_rel, passed, note=''):
+        results.append({
+            'check': check, 'passed': passed, 'max_abs_error': max_abs, 'max_rel_error': max_rel, 'note': note,
+            'reference_s': reference_s, 'fast_s': fast_s
+        })
+
+    reference_route, reference_s = _timed(reference_load_gpx_to_dataframe, gpx_file)
+    fast_route, fast_s = _timed(load_gpx_to_dataframe, gpx_file, distance_model=distance_model)
+    columns = ['segment_distance', 'cumulative_distance', 'elevation_change', 'elevation_gain',
+               'elevation_loss', 'cumulative_elevation_gain']
+    record('load_gpx_to_dataframe', reference_s, fast_s, *_compare_columns(reference_route, fast_route, columns, rtol, atol))
+
+    reference_stops, reference_s = _timed(reference_calculate_optimal_rv_stops, reference_route, target_daily_distance)
+    fast_stops, fast_s = _timed(calculate_optimal_rv_stops, fast_route, target_daily_distance)
+    record('calculate_optimal_rv_stops', reference_s, fast_s, *_compare_stops(reference_stops, fast_stops, rtol, atol))
+
+    points, _ = load_gpx_points(gpx_file)
+
+    reference_total, reference_s = _timed(reference_calculate_total_distance, points)
+    fast_total, fast_s = _timed(calculate_total_distance, points, distance_model)
+    record('calculate_total_distance', reference_s, fast_s, *_difference(reference_total, fast_total, rtol, atol))
+
+    reference_kept, reference_s = _timed(reference_filter_by_distance, points, min_distance_m)
+    fast_kept, fast_s = _timed(filter_by_distance, points, min_distance_m, distance_model)
+    record('filter_by_distance', reference_s, fast_s, *_compare_points(reference_kept, fast_kept, rtol, atol))
+
+    def reference_anomalies(df):
+        return {'large_jumps': reference_large_jumps(df), 'jitter_segments': reference_jitter_segments(df),
+                'time_gaps': reference_time_gaps(df)}
+    reference_stats, reference_s = _timed(reference_anomalies, points)
+    fast_stats, fast_s = _timed(lambda df: compute_gpx_stats(add_point_distances(df.copy(), distance_model)), points)
+    record('compute_gpx_stats', reference_s, fast_s, *_compare_anomalies(reference_stats, fast_stats, rtol, atol))
+
+    # The jitter runs come from each path: the original loop, or compute_gpx_stats
+    reference_kept, reference_s = _timed(reference_filter_jitter_clusters, points, reference_stats['jitter_segments'])
+    fast_kept, fast_s = _timed(filter_jitter_clusters, points, fast_stats['jitter_segments'])
+    record('filter_jitter_clusters', reference_s, fast_s, *_compare_points(reference_kept, fast_kept, rtol, atol))
+
+    # No dwell may join two segments: collapsing the whole track must equal collapsing each segment
+    def collapse_per_segment(df):
+        import pandas as pd
+        return pd.concat([collapse_stationary_periods(segment) for _, segment in _segment_frames(df)], ignore_index=True)
+    reference_kept, reference_s = _timed(collapse_per_segment, points)
+    fast_kept, fast_s = _timed(collapse_stationary_periods, points)
+    record('collapse_stationary_periods', reference_s, fast_s, *_compare_points(reference_kept, fast_kept, rtol, atol))
+
+    return results
+
+
+def check_moving_track(gpx_file):
+    """
+    Check that no dwell is detected on a track that keeps moving, with and without its times
+
+    Returns:
+    - Results in the format of check_track, with the dwells found as the
+      error and no reference timing
+    """
+    points, _ = load_gpx_points(gpx_file)
+    results = []
+    for check, df in (('detect_stationary_periods (moving, timed)', points),
+                      ('detect_stationary_periods (moving, untimed)', points.assign(time=None))):
+        dwells, fast_s = _timed(detect_stationary_periods, df)
+        results.append({
+            'check': check, 'passed': dwells.empty, 'max_abs_error': float(len(dwells)), 'max_rel_error': 0.0,
+            'note': f"{len(dwells)} dwells, the longest {int(dwells['points'].max())} points" if len(dwells) else '',
+            'reference_s': math.nan, 'fast_s': fast_s
+        })
+    return results
+
+
+def generated_tracks(count, points=2000, seed=0):
+    """
+    (kind, seed, segments) of count generated tracks, cycling through TRACK_KINDS
+
+    Every other pass through the kinds splits the tracks into MULTI_SEGMENT_COUNT segments.
+    """
+    return [(TRACK_KINDS[i % len(TRACK_KINDS)], seed + i, MULTI_SEGMENT_COUNT if (i // len(TRACK_KINDS)) % 2 else 1)
+            for i in range(count)]
+
+
+def run_checks(gpx_files=(), cases=2 * len(TRACK_KINDS), points=2000, seed=0, distance_model='haversine',
+               rtol=1e-9, atol=1e-9, min_distance_m=5, target_daily_distance=125):
+    """
+    Check the fast paths against the references on GPX files and generated tracks
+
+    Parameters:
+    - gpx_files: GPX files to check (e.g. the bundled routes)
+    - cases: Generated tracks to check, cycling through TRACK_KINDS as single
+      and multi-segment tracks (see generated_tracks)
+    - points, seed: Length of the generated tracks and the seed of the first one
+    - distance_model: Distance model for the fast paths (see distance_models)
+    - rtol, atol: A check passes when every difference is within atol + rtol * |reference|
+      (in the units each function returns: km, m or degrees); filters and
+      stops must also keep the same points
+    - min_distance_m, target_daily_distance: Parameters of the distance filter and RV stops
+
+    Returns:
+    - DataFrame with one row per track and check: errors, pass/fail, wall times and speedup
+    """
+    import pandas as pd
+
+    rows = []
+
+    def add(track, points_count, results):
+        for result in results:
+            rows.append({
+                'track': track,
+                'points': points_count,
+                **result,
+                'speedup': result['reference_s'] / result['fast_s'] if result['fast_s'] > 0 else math.inf
+            })
+
+    for gpx_file in gpx_files:
+        points_count = len(load_gpx_points(gpx_file)[0])
+        add(os.path.basename(gpx_file), points_count,
+            check_track(gpx_file, distance_model, min_distance_m, target_daily_distance, rtol, atol))
+
+    with tempfile.TemporaryDirectory(prefix='reference_check_') as work_dir:
+        for kind, track_seed, segments in generated_tracks(cases, points, seed):
+            track = generate_track(kind, points, track_seed, segments)
+            gpx_file = write_track(track, os.path.join(work_dir, f"{kind}_{track_seed}.gpx"))
+            results = check_track(gpx_file, distance_model, min_distance_m, target_daily_distance, rtol, atol)
+            if kind == 'walk':
+                results += check_moving_track(gpx_file)
+            add(f"{kind} (seed {track_seed}, {segments} segments)", len(track), results)
+
+    columns = ['track', 'points', 'check', 'passed', 'max_abs_error', 'max_rel_error',
+               'reference_s', 'fast_s', 'speedup', 'note']
+    return pd.DataFrame(rows, columns=columns)
+
+
+def print_check_report(report):
+    """
+    Print the results of run_checks, one summary line per check
+    """
+    print("\nDifferential check against the reference implementations:")
+    for check, rows in report.groupby('check', sort=False):
+        failed = rows[~rows['passed']]
+        status = 'ok' if failed.empty else f"FAILED on {len(failed)} of {len(rows)} tracks"
+        speedup = f"{rows['reference_s'].sum() / rows['fast_s'].sum():.1f}x" if rows['reference_s'].notna().any() else 'n/a'
+        print(f"  - {check}: {status}; max abs error {rows['max_abs_error'].max():.3g}, "
+              f"max rel error {rows['max_rel_error'].max():.3g}, speedup {speedup}")
+        for _, row in failed.iterrows():
+            print(f"      {row['track']}: {row['note'] or 'difference beyond tolerance'}")
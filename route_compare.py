@@ -1,69 +1,151 @@
 import gpxpy
-import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
-import folium
-from folium.plugins import MeasureControl
-from haversine import haversine
 import json
 import os
 import colorsys
 import random
 import math
-import googlemaps
 import time
 from datetime import datetime
-import polyline
-from dotenv import load_dotenv
+from pipeline_metrics import PipelineMetrics
+from pipeline_checkpoints import StageCheckpoints, file_digest, stage_key
+from distance_models import MEAN_EARTH_RADIUS_M, consecutive_distances
+from distance_models import haversine as haversine_m
+from track_segments import segment_offsets, step_distances
+
+# pandas, folium, googlemaps and dotenv are imported where they are used so
+# that importing this module (or running a non-rendering command) stays fast
+
+# Version of the load_gpx_to_dataframe output, part of the parse checkpoint key
+ROUTE_FORMAT_VERSION = 2
+
+def resolve_api_key(api_key=None):
+    """
+    Google Maps API key, falling back to MAPS_API_KEY from the environment or a .env file
+    """
+    if api_key:
+        return api_key
+    from dotenv import load_dotenv
+    load_dotenv()
+    return os.getenv("MAPS_API_KEY")
 
 def initialize_google_maps_client(api_key):
     """
     Initialize Google Maps client with API key
     """
+    import googlemaps
     return googlemaps.Client(key=api_key)
 
-def load_gpx_to_dataframe(gpx_file):
+def load_gpx_to_dataframe(gpx_file, compact=False, distance_model='haversine'):
     """
     Load a GPX file into a pandas DataFrame with distance calculations
+    
+    Parameters:
+    - gpx_file: Path to the GPX file
+    - compact: If True, return a smaller DataFrame for processing many routes per worker:
+        latitude/longitude/elevation as float32 (coordinates lose at most about
+        0.5 m), segment_distance as float32, time as datetime64[s] instead of
+        Python objects, and no elevation_change/elevation_gain/elevation_loss
+        columns (add them on demand with add_elevation_columns). Distances are
+        computed at full precision before the columns are narrowed, so
+        cumulative_distance and cumulative_elevation_gain are unchanged.
+    - distance_model: Distance model for segment_distance (see distance_models)
+
+    The segment column holds the index of each point's track segment;
+    segment_distance is 0 at the start of every segment, so the gap between
+    two segments is not part of the route distance.
     """
+    import pandas as pd
+    
     with open(gpx_file, 'r') as f:
         gpx = gpxpy.parse(f)
     
     # Extract points
     points = []
-    for track in gpx.tracks:
-        for segment in track.segments:
-            for point in segment.points:
-                points.append({
-                    'latitude': point.latitude,
-                    'longitude': point.longitude,
-                    'elevation': point.elevation if point.elevation else 0,
-                    'time': point.time
-                })
+    segments = (segment for track in gpx.tracks for segment in track.segments)
+    for segment_index, segment in enumerate(segments):
+        for point in segment.points:
+            points.append({
+                'latitude': point.latitude,
+                'longitude': point.longitude,
+                'elevation': point.elevation if point.elevation else 0,
+                'time': point.time,
+                'segment': segment_index
+            })
     
     # Convert to DataFrame
-    df = pd.DataFrame(points)
+    df = pd.DataFrame(points, columns=['latitude', 'longitude', 'elevation', 'time', 'segment'])
     
     # Calculate cumulative distance
-    df['segment_distance'] = 0.0
-    for i in range(1, len(df)):
-        point1 = (df.iloc[i-1]['latitude'], df.iloc[i-1]['longitude'])
-        point2 = (df.iloc[i]['latitude'], df.iloc[i]['longitude'])
-        df.loc[i, 'segment_distance'] = haversine(point1, point2, unit='km')
+    df['segment_distance'] = step_distances(df['latitude'], df['longitude'], segment_offsets(df['segment']), distance_model) / 1000
     
     df['cumulative_distance'] = df['segment_distance'].cumsum()
     
-    # Calculate elevation gain/loss
-    df['elevation_change'] = 0.0
-    for i in range(1, len(df)):
-        df.loc[i, 'elevation_change'] = df.iloc[i]['elevation'] - df.iloc[i-1]['elevation']
+    if compact:
+        return compact_route_dataframe(df)
     
-    df['elevation_gain'] = df['elevation_change'].apply(lambda x: max(0, x))
-    df['elevation_loss'] = df['elevation_change'].apply(lambda x: abs(min(0, x)))
+    # Calculate elevation gain/loss
+    add_elevation_columns(df)
     df['cumulative_elevation_gain'] = df['elevation_gain'].cumsum()
     
     return df
 
+def add_elevation_columns(df):
+    """
+    Add the elevation_change, elevation_gain and elevation_loss columns
+    """
+    elevation = df['elevation'].to_numpy(dtype=float)
+    change = np.zeros(len(df))
+    change[1:] = np.diff(elevation)
+    
+    df['elevation_change'] = change
+    df['elevation_gain'] = np.maximum(change, 0)
+    df['elevation_loss'] = np.abs(np.minimum(change, 0))
+    return df
+
+def compact_route_dataframe(df):
+    """
+    Narrow a route DataFrame to the compact representation (see load_gpx_to_dataframe)
+    """
+    import pandas as pd
+    
+    elevation = df['elevation'].to_numpy(dtype=float)
+    gain = np.zeros(len(df))
+    gain[1:] = np.maximum(np.diff(elevation), 0)
+    
+    return pd.DataFrame({
+        'latitude': df['latitude'].to_numpy(dtype=np.float32),
+        'longitude': df['longitude'].to_numpy(dtype=np.float32),
+        'elevation': elevation.astype(np.float32),
+        'time': pd.to_datetime(df['time'], utc=True).dt.as_unit('s'),
+        'segment': df['segment'].to_numpy(dtype=np.int32),
+        'segment_distance': df['segment_distance'].to_numpy(dtype=np.float32),
+        'cumulative_distance': df['cumulative_distance'].to_numpy(dtype=float),
+        'cumulative_elevation_gain': np.cumsum(gain)
+    })
+
+def memory_report(df):
+    """
+    Memory used by each column of a DataFrame, including Python objects
+    
+    Returns:
+    - Dictionary of column name to bytes, plus 'total'
+    """
+    usage = df.memory_usage(deep=True, index=True)
+    report = {name: int(size) for name, size in usage.items()}
+    report['total'] = int(usage.sum())
+    return report
+
+def print_memory_report(route_name, df):
+    """
+    Print the per-column memory use of a route DataFrame
+    """
+    report = memory_report(df)
+    print(f"  Memory for {route_name}: {report['total'] / 1024:.1f} KiB ({len(df)} points)")
+    for name, size in report.items():
+        if name != 'total':
+            print(f"    {name}: {size / 1024:.1f} KiB")
+
 def get_distinct_colors(n):
     """
     Generate n visually distinct colors for routes
@@ -80,11 +162,254 @@ def get_distinct_colors(n):
         colors.append(color)
     return colors
 
+def _distance_to_segments(lat, lon, lat1, lon1, lat2, lon2):
+    """
+    Distance in meters from points to segments, in a plane local to each point
+
+    Returns:
+    - Distance and the fraction along each segment of the closest point
+    """
+    meters_per_degree = MEAN_EARTH_RADIUS_M * math.pi / 180
+    local_x = meters_per_degree * np.cos(np.radians(lat))
+    ax = (lon1 - lon) * local_x
+    ay = (lat1 - lat) * meters_per_degree
+    dx = (lon2 - lon1) * local_x
+    dy = (lat2 - lat1) * meters_per_degree
+    length2 = dx * dx + dy * dy
+    t = np.clip(-(ax * dx + ay * dy) / np.where(length2 > 0, length2, 1), 0, 1)
+    return np.hypot(ax + t * dx, ay + t * dy), t
+
+def _match_to_geometry(lat, lon, geometry_lat, geometry_lon, linked, tolerance_m):
+    """
+    Find the nearest stored segment within tolerance_m of each point
+
+    Segments (geometry point k to k+1, where linked[k]) are sampled at most
+    tolerance_m / 2 apart and hashed into a grid of tolerance-sized cells,
+    so each point is only measured against segments in its 3x3 neighbourhood.
+
+    Returns:
+    - segment index, fraction along it and distance in meters for each
+      point (segment -1 where nothing is within tolerance)
+    """
+    meters_per_degree = MEAN_EARTH_RADIUS_M * math.pi / 180
+    segment = np.full(len(lat), -1)
+    fraction = np.zeros(len(lat))
+    distance = np.full(len(lat), np.inf)
+
+    segments = np.flatnonzero(linked)
+    if not segments.size or not len(lat):
+        return segment, fraction, distance
+
+    # Grid x scale at the highest latitude never overstates east-west distance, so no neighbour is missed
+    max_abs_lat = max(np.abs(lat).max(), np.abs(geometry_lat).max())
+    cell_m = tolerance_m * 1.1
+    x_scale = meters_per_degree * math.cos(math.radians(min(max_abs_lat, 89.0))) / cell_m
+    y_scale = meters_per_degree / cell_m
+
+    lengths = haversine_m(geometry_lat[segments], geometry_lon[segments], geometry_lat[segments + 1], geometry_lon[segments + 1])
+    counts = np.maximum(np.ceil(lengths / (tolerance_m / 2)), 1).astype(int)
+    sample_segment = np.repeat(segments, counts)
+    sample_t = (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)) / np.repeat(counts, counts)
+    sample_lat = geometry_lat[sample_segment] + sample_t * (geometry_lat[sample_segment + 1] - geometry_lat[sample_segment])
+    sample_lon = geometry_lon[sample_segment] + sample_t * (geometry_lon[sample_segment + 1] - geometry_lon[sample_segment])
+
+    row_size = np.int64(1 << 32)
+    sample_keys = np.floor(sample_lon * x_scale).astype(np.int64) * row_size + np.floor(sample_lat * y_scale).astype(np.int64)
+    order = np.argsort(sample_keys, kind='stable')
+    sample_keys = sample_keys[order]
+    sample_segment = sample_segment[order]
+
+    point_x = np.floor(lon * x_scale).astype(np.int64)
+    point_y = np.floor(lat * y_scale).astype(np.int64)
+    candidate_points = []
+    candidate_segments = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            keys = (point_x + dx) * row_size + point_y + dy
+            left = np.searchsorted(sample_keys, keys, 'left')
+            found = np.searchsorted(sample_keys, keys, 'right') - left
+            points = np.repeat(np.arange(len(lat)), found)
+            offsets = np.arange(found.sum()) - np.repeat(np.cumsum(found) - found, found)
+            candidate_points.append(points)
+            candidate_segments.append(sample_segment[np.repeat(left, found) + offsets])
+
+    points = np.concatenate(candidate_points)
+    if not points.size:
+        return segment, fraction, distance
+    segments = np.concatenate(candidate_segments)
+
+    d, t = _distance_to_segments(lat[points], lon[points], geometry_lat[segments], geometry_lon[segments],
+                                 geometry_lat[segments + 1], geometry_lon[segments + 1])
+
+    best = np.lexsort((d, points))
+    first = best[np.unique(points[best], return_index=True)[1]]
+    within = d[first] <= tolerance_m
+    first = first[within]
+    segment[points[first]] = segments[first]
+    fraction[points[first]] = t[first]
+    distance[points[first]] = d[first]
+    return segment, fraction, distance
+
+def share_route_geometry(routes, tolerance_m=10, min_shared_points=3):
+    """
+    Store the geometry of several routes once, sharing coincident stretches
+
+    Routes are added in order. Each point of a route is matched to the
+    nearest segment of the geometry stored so far; consecutive matched points
+    that advance steadily along it (in either direction) become a reference
+    to that stretch, and everything else is stored as new geometry. Stored
+    vertices are only shared if they lie within tolerance_m of the route, and
+    the first and last point of a shared run are kept as the route's own, so
+    the drawn route stays within about tolerance_m of the original.
+
+    Parameters:
+    - routes: Dictionary of route name -> (latitudes, longitudes)
+    - tolerance_m: Maximum distance of a route point from the geometry it shares
+    - min_shared_points: Shorter matched runs (crossings, brief contact) are stored as new geometry
+
+    Returns:
+    - Latitudes and longitudes of the stored geometry
+    - Dictionary of route name -> {'pieces': list of inclusive (start, stop)
+      index ranges into the stored geometry, reversed when stop < start;
+      'positions': fractional position of every route point along the
+      route's resolved vertices, for interpolating per-point values onto them}
+    """
+    geometry_lat = np.zeros(0)
+    geometry_lon = np.zeros(0)
+    linked = np.zeros(0, dtype=bool)
+    shared = {}
+
+    for route_name, (lat, lon) in routes.items():
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        n = len(lat)
+
+        segment, fraction, _ = _match_to_geometry(lat, lon, geometry_lat, geometry_lon, linked, tolerance_m)
+        position = segment + fraction
+        matched = segment >= 0
+
+        # Consecutive matched points continue a stretch if the stored geometry between them is
+        # connected and about as long as the step of the route itself
+        if len(linked):
+            segment_lengths = np.where(linked, haversine_m(geometry_lat[:-1], geometry_lon[:-1], geometry_lat[1:], geometry_lon[1:]), 0)
+            along = np.concatenate(([0.0], np.cumsum(segment_lengths)))
+            unlinked = np.concatenate(([0], np.cumsum(~linked)))
+            safe_segment = np.maximum(segment, 0)
+            along_m = along[safe_segment] + fraction * segment_lengths[safe_segment]
+            low = np.minimum(safe_segment[:-1], safe_segment[1:])
+            high = np.maximum(safe_segment[:-1], safe_segment[1:])
+            steps = consecutive_distances(lat, lon)
+            continues = (matched[:-1] & matched[1:]
+                         & (unlinked[high + 1] - unlinked[low] == 0)
+                         & (np.abs(np.diff(along_m)) <= 1.5 * steps + 2 * tolerance_m))
+
+            # Stored vertices passed over between two route points must lie within tolerance of that step
+            first_vertex = np.floor(np.minimum(position[:-1], position[1:])).astype(int) + 1
+            last_vertex = np.ceil(np.maximum(position[:-1], position[1:])).astype(int) - 1
+            skipped = np.where(continues, np.maximum(last_vertex - first_vertex + 1, 0), 0)
+            step = np.repeat(np.arange(n - 1), skipped)
+            vertex = np.repeat(first_vertex, skipped) + np.arange(skipped.sum()) - np.repeat(np.cumsum(skipped) - skipped, skipped)
+            off_route, _ = _distance_to_segments(geometry_lat[vertex], geometry_lon[vertex],
+                                                 lat[step], lon[step], lat[step + 1], lon[step + 1])
+            continues[step[off_route > tolerance_m]] = False
+        else:
+            continues = np.zeros(max(n - 1, 0), dtype=bool)
+
+        # Split into runs: shared stretches and stretches of new geometry
+        breaks = np.flatnonzero(~continues) + 1
+        runs = []
+        for start, stop in zip(np.concatenate(([0], breaks)), np.concatenate((breaks, [n]))):
+            if not matched[start]:
+                runs.append((start, stop - 1, False))
+                continue
+            # A shared stretch must not change direction along the stored geometry
+            direction = np.sign(np.diff(position[start:stop]))
+            run_start = start
+            run_direction = 0
+            for offset, step_direction in enumerate(direction):
+                if step_direction and run_direction and step_direction != run_direction:
+                    runs.append((run_start, start + offset, True))
+                    run_start = start + offset + 1
+                    run_direction = 0
+                elif step_direction:
+                    run_direction = step_direction
+            runs.append((run_start, stop - 1, True))
+
+        pieces = []
+        positions = np.empty(n)
+        resolved = 0
+        new_lat, new_lon, new_linked = [], [], []
+        pending_start = None
+
+        def add_piece(first, last):
+            # Join a piece onto the previous one when it simply continues it
+            if pieces and pieces[-1][1] != pieces[-1][0] and first == pieces[-1][1] + np.sign(pieces[-1][1] - pieces[-1][0]) \
+                    and np.sign(last - first) in (0, np.sign(pieces[-1][1] - pieces[-1][0])):
+                pieces[-1] = (pieces[-1][0], last)
+            else:
+                pieces.append((first, last))
+
+        def flush_new(stop):
+            # Store route points pending_start..stop as new geometry
+            nonlocal resolved, pending_start
+            if pending_start is None:
+                return
+            first = len(geometry_lat) + len(new_lat)
+            new_lat.extend(lat[pending_start:stop + 1])
+            new_lon.extend(lon[pending_start:stop + 1])
+            new_linked.extend([False] + [True] * (stop - pending_start))
+            count = stop - pending_start + 1
+            add_piece(first, first + count - 1)
+            positions[pending_start:stop + 1] = resolved + np.arange(count)
+            resolved += count
+            pending_start = None
+
+        for start, stop, is_shared in runs:
+            if is_shared and stop - start + 1 >= min_shared_points:
+                forward = position[stop] >= position[start]
+                if forward:
+                    first, last = int(np.ceil(position[start])), int(np.floor(position[stop]))
+                    usable = first <= last
+                else:
+                    first, last = int(np.floor(position[start])), int(np.ceil(position[stop]))
+                    usable = first >= last
+                if usable:
+                    # The run's end points stay the route's own so joins do not cut corners
+                    if pending_start is None:
+                        pending_start = start
+                    flush_new(start)
+                    add_piece(first, last)
+                    span = abs(last - first)
+                    offset = position[start + 1:stop] - first if forward else first - position[start + 1:stop]
+                    positions[start + 1:stop] = resolved + np.clip(offset, 0, span)
+                    resolved += span + 1
+                    pending_start = stop
+                    continue
+            if pending_start is None:
+                pending_start = start
+        flush_new(n - 1)
+
+        # The first new point of each stored stretch is not connected to the point before it
+        if new_lat:
+            linked = np.concatenate((linked, new_linked[1:] if not len(geometry_lat) else new_linked))
+            geometry_lat = np.concatenate((geometry_lat, new_lat))
+            geometry_lon = np.concatenate((geometry_lon, new_lon))
+
+        shared[route_name] = {'pieces': pieces, 'positions': positions}
+
+    return geometry_lat, geometry_lon, shared
+
 def calculate_optimal_rv_stops(route_df, target_distance=125, gmaps_client=None):
     """
     Calculate optimal RV stop locations based on target daily distance
     and check for RV accessibility using Google Maps API
     """
+    return enrich_rv_stops(place_rv_stops(route_df, target_distance), gmaps_client)
+
+def place_rv_stops(route_df, target_distance=125):
+    """
+    Place one RV stop at the route point closest to each multiple of the target daily distance
+    """
     total_distance = route_df['cumulative_distance'].iloc[-1]
     num_days = math.ceil(total_distance / target_distance)
     
@@ -104,6 +429,15 @@ def calculate_optimal_rv_stops(route_df, target_distance=125, gmaps_client=None)
             'index': closest_idx
         })
     
+    return initial_stops
+
+def enrich_rv_stops(initial_stops, gmaps_client=None):
+    """
+    Move RV stops to nearby campgrounds, RV parks or addressable roads using Google Maps API
+    
+    The input stops are left unchanged; enriched copies are returned.
+    """
+    initial_stops = [dict(stop) for stop in initial_stops]
     optimal_stops = []
     
     # If we have Google Maps API access, optimize stops for RV accessibility
@@ -347,17 +681,28 @@ def analyze_route_segments(route_df, stops, gmaps_client=None):
     
     return segments
 
-def create_integrated_map(route_data, google_maps_api_key=None):
+def create_integrated_map(route_data, google_maps_api_key=None, metrics=None, geometry_tolerance_m=10):
     """
     Create an integrated interactive map with hover information and optimized RV stops
     
+    Route coordinates are embedded once: stretches that several routes share
+    (see share_route_geometry) are stored a single time and each route's line
+    and hover data are rebuilt from them in the browser, keeping its own color.
+    
     Parameters:
     - route_data: Dictionary containing processed route data
     - google_maps_api_key: Optional Google Maps API key for additional features
+    - metrics: Optional PipelineMetrics collecting API calls, cache use and map size
+    - geometry_tolerance_m: Maximum distance between routes for a stretch to be shared
     
     Returns:
     - Path to the generated HTML file
     """
+    import folium
+    from folium.plugins import MeasureControl
+    from branca.element import MacroElement
+    from jinja2 import Template
+    
     # Get all coordinates to center the map
     all_lats = []
     all_lons = []
@@ -378,11 +723,20 @@ def create_integrated_map(route_data, google_maps_api_key=None):
     # Generate distinct colors for each route
     colors = get_distinct_colors(len(route_data))
     
+    # One client and a facility cache shared by every stop marker
+    facilities_client = None
+    if google_maps_api_key:
+        facilities_client = initialize_google_maps_client(google_maps_api_key)
+        if metrics:
+            facilities_client = metrics.instrument_client(facilities_client)
+    facilities_cache = {}
+    
     # Create the JavaScript for interactive hover functionality
     hover_js = """
     <script>
     // Store route data for hover lookups
     var routeDataPoints = {};
+    var sharedGeometry = [];
     var currentRouteIndex = -1;
     var mapObject = null;
     
@@ -414,6 +768,22 @@ def create_integrated_map(route_data, google_maps_api_key=None):
         return null;
     }
     
+    // Expand a route's pieces of the shared geometry into its list of vertices
+    function routeLatLngs(route) {
+        if (route.latlngs) return route.latlngs;
+        
+        var latlngs = [];
+        for (var p = 0; p < route.pieces.length; p += 2) {
+            var start = route.pieces[p], stop = route.pieces[p + 1];
+            var step = stop >= start ? 1 : -1;
+            for (var k = start; k !== stop + step; k += step) {
+                latlngs.push([sharedGeometry[2 * k], sharedGeometry[2 * k + 1]]);
+            }
+        }
+        route.latlngs = latlngs;
+        return latlngs;
+    }
+    
     // Show information for the closest point on a route
     function showPointInfo(map, latlng) {
         if (currentRouteIndex === -1) return;
@@ -422,29 +792,28 @@ def create_integrated_map(route_data, google_maps_api_key=None):
         if (currentRouteIndex >= routeNames.length) return;
         
         var routeName = routeNames[currentRouteIndex];
-        var points = routeDataPoints[routeName];
+        var route = routeDataPoints[routeName];
+        var points = routeLatLngs(route);
         
         // Find closest point
         var minDist = Infinity;
-        var closestPoint = null;
+        var closest = -1;
         
         for (var i = 0; i < points.length; i++) {
-            var point = points[i];
-            var pointLatLng = L.latLng(point.lat, point.lng);
-            var dist = map.distance(latlng, pointLatLng);
+            var dist = map.distance(latlng, L.latLng(points[i][0], points[i][1]));
             
             if (dist < minDist) {
                 minDist = dist;
-                closestPoint = point;
+                closest = i;
             }
         }
         
         // Only show info if point is within 100 meters
-        if (closestPoint && minDist < 100) {
+        if (closest !== -1 && minDist < 100) {
             document.getElementById('route-name').textContent = routeName;
-            document.getElementById('distance-info').textContent = 'Distance from start: ' + closestPoint.distance.toFixed(2) + ' km';
-            document.getElementById('elevation-info').textContent = 'Current elevation: ' + closestPoint.elevation.toFixed(0) + ' m';
-            document.getElementById('elev-gain-info').textContent = 'Cumulative gain: ' + closestPoint.elevGain.toFixed(0) + ' m';
+            document.getElementById('distance-info').textContent = 'Distance from start: ' + route.distance[closest].toFixed(2) + ' km';
+            document.getElementById('elevation-info').textContent = 'Current elevation: ' + route.elevation[closest].toFixed(0) + ' m';
+            document.getElementById('elev-gain-info').textContent = 'Cumulative gain: ' + route.elevGain[closest].toFixed(0) + ' m';
             
             infoBox.style.display = 'block';
         } else {
@@ -480,61 +849,66 @@ def create_integrated_map(route_data, google_maps_api_key=None):
     # Add the hover JavaScript to the map
     integrated_map.get_root().html.add_child(folium.Element(hover_js))
     
+    # Store coordinates shared by several routes once
+    geometry_lat, geometry_lon, shared = share_route_geometry(
+        {route_name: (data['df']['latitude'], data['df']['longitude']) for route_name, data in route_data.items()},
+        geometry_tolerance_m
+    )
+    total_points = sum(len(data['df']) for data in route_data.values())
+    print(f"Shared geometry: {len(geometry_lat)} stored points for {total_points} route points")
+    
+    geometry = np.round(np.column_stack((geometry_lat, geometry_lon)), 5).ravel().tolist()
+    integrated_map.get_root().script.add_child(folium.Element(
+        f'sharedGeometry = {json.dumps(geometry)};'
+    ))
+    
+    # Route lines are built in the browser from the shared geometry
+    route_line_template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = L.polyline(
+            routeLatLngs(routeDataPoints[{{ this.route_name|tojson }}]),
+            {{ this.options|tojson }}
+        ).bindTooltip({{ this.tooltip|tojson }}).addTo({{ this._parent.get_name() }});
+        {{ this.get_name() }}.on('mouseover', function() {
+            currentRouteIndex = {{ this.route_index }};
+        });
+        {{ this.get_name() }}.on('mouseout', function() {
+            currentRouteIndex = -1;
+            document.getElementById('hover-info-box').style.display = 'none';
+        });
+        {% endmacro %}
+    """)
+    
     # Process and add each route to the map
     for i, (route_name, data) in enumerate(route_data.items()):
         route_df = data['df']
         rv_stops = data['rv_stops']
         color = colors[i]
         
-        # Prepare points data for hover functionality
-        js_points = []
-        for _, row in route_df.iterrows():
-            js_points.append({
-                'lat': row['latitude'],
-                'lng': row['longitude'],
-                'elevation': row['elevation'],
-                'distance': row['cumulative_distance'],
-                'elevGain': row['cumulative_elevation_gain']
-            })
+        # Hover values at the route's vertices in the shared geometry
+        pieces = shared[route_name]['pieces']
+        positions = shared[route_name]['positions']
+        vertices = np.arange(sum(abs(stop - start) + 1 for start, stop in pieces))
+        js_route = {
+            'pieces': [int(index) for piece in pieces for index in piece],
+            'distance': np.round(np.interp(vertices, positions, route_df['cumulative_distance']), 3).tolist(),
+            'elevation': np.round(np.interp(vertices, positions, route_df['elevation'])).tolist(),
+            'elevGain': np.round(np.interp(vertices, positions, route_df['cumulative_elevation_gain'])).tolist()
+        }
         
         # Add route data to JavaScript
-        js_points_str = json.dumps(js_points)
         integrated_map.get_root().script.add_child(folium.Element(
-            f'routeDataPoints["{route_name}"] = {js_points_str};'
+            f'routeDataPoints[{json.dumps(route_name)}] = {json.dumps(js_route)};'
         ))
         
-        # Create route line with mouseover/mouseout events
-        points = [(row['latitude'], row['longitude']) for _, row in route_df.iterrows()]
-        
-        # Add route path
-        route_line = folium.PolyLine(
-            points,
-            color=color,
-            weight=4,
-            opacity=0.8,
-            tooltip=f"{route_name} - {data['total_distance']:.1f} km"
-        ).add_to(integrated_map)
-        
-        # Add event handlers for this route
-        route_event_js = f"""
-        // Route event handlers for {route_name}
-        (function() {{
-            var route = document.querySelector('.leaflet-interactive:nth-child({i+1})');
-            if (route) {{
-                route.addEventListener('mouseover', function() {{ 
-                    currentRouteIndex = {i}; 
-                    console.log("Activated route: {route_name}");
-                }});
-                
-                route.addEventListener('mouseout', function() {{ 
-                    currentRouteIndex = -1; 
-                    document.getElementById('hover-info-box').style.display = 'none';
-                }});
-            }}
-        }})();
-        """
-        
-        integrated_map.get_root().script.add_child(folium.Element(route_event_js))
+        # Add route path with mouseover/mouseout events
+        route_line = MacroElement()
+        route_line._template = route_line_template
+        route_line.route_name = route_name
+        route_line.route_index = i
+        route_line.options = {'color': color, 'weight': 4, 'opacity': 0.8}
+        route_line.tooltip = f"{route_name} - {data['total_distance']:.1f} km"
+        integrated_map.add_child(route_line)
         
         # Add start marker
         folium.Marker(
@@ -553,9 +927,18 @@ def create_integrated_map(route_data, google_maps_api_key=None):
         # Add RV stop markers with detailed popups
         for stop in rv_stops:
             # Get facility information if available
-            if google_maps_api_key:
-                gmaps = initialize_google_maps_client(google_maps_api_key)
-                facilities = find_nearby_facilities(gmaps, stop['latitude'], stop['longitude'])
+            if 'facilities' in stop:
+                facilities = stop['facilities']
+            elif facilities_client:
+                cache_key = (round(stop['latitude'], 5), round(stop['longitude'], 5))
+                if cache_key in facilities_cache:
+                    if metrics:
+                        metrics.count('cache_hits')
+                else:
+                    if metrics:
+                        metrics.count('cache_misses')
+                    facilities_cache[cache_key] = find_nearby_facilities(facilities_client, stop['latitude'], stop['longitude'])
+                facilities = facilities_cache[cache_key]
             else:
                 facilities = {
                     'has_gas_station': False,
@@ -661,28 +1044,63 @@ def create_integrated_map(route_data, google_maps_api_key=None):
     # Save the map
     html_filename = "integrated_route_map.html"
     integrated_map.save(html_filename)
+    if metrics:
+        metrics.record_map_output(html_filename)
     print(f"Integrated map saved to: {html_filename}")
     
     return html_filename
 
-def process_gpx_files(gpx_files, google_maps_api_key=None, target_daily_distance=125):
+def route_stage_keys(file_key, target_daily_distance=125, uses_api=False, compact=False, distance_model='haversine'):
     """
-    Process multiple GPX files and create an integrated visualization
+    Checkpoint keys of the planning stages of one route (see pipeline_checkpoints)
+    
+    Each key chains the keys of the stages it depends on, so changing an
+    input invalidates that stage and everything after it.
+    
+    Parameters:
+    - file_key: Digest of the GPX file (pipeline_checkpoints.file_digest)
+    - target_daily_distance, uses_api, compact, distance_model: Planning inputs
+    
+    Returns:
+    - Dictionary of stage name to key
+    """
+    keys = {'parse': stage_key('parse', ROUTE_FORMAT_VERSION, file_key, compact, str(distance_model))}
+    keys['rv_stops'] = stage_key('rv_stops', keys['parse'], target_daily_distance)
+    keys['enriched_stops'] = stage_key('enriched_stops', keys['rv_stops'], uses_api)
+    keys['segments'] = stage_key('segments', keys['enriched_stops'], uses_api)
+    keys['facilities'] = stage_key('facilities', keys['enriched_stops'])
+    return keys
+
+def plan_routes(gpx_files, google_maps_api_key=None, target_daily_distance=125, metrics=None, compact=False, report_memory=False,
+                distance_model='haversine', checkpoint_dir=None, facilities=False):
+    """
+    Load GPX files and plan RV stops and daily segments without rendering a map
     
     Parameters:
     - gpx_files: List of GPX file paths
     - google_maps_api_key: Optional Google Maps API key
     - target_daily_distance: Target distance per day in km
+    - metrics: Optional PipelineMetrics; filled with stage timings and counters
+    - compact: Load routes in the compact representation (see load_gpx_to_dataframe)
+    - report_memory: Print the memory used by each route DataFrame
+    - distance_model: Distance model for the route distances (see distance_models)
+    - checkpoint_dir: Optional directory of stage checkpoints (see pipeline_checkpoints);
+      stages whose inputs are unchanged since a previous run are loaded instead of rerun
+    - facilities: Also look up the facilities near each RV stop (stored on the stops
+      as 'facilities' and used by create_integrated_map)
     
     Returns:
     - Dictionary with processed route data
-    - Path to the generated HTML file
     """
+    if metrics is None:
+        metrics = PipelineMetrics()
+    checkpoints = StageCheckpoints(checkpoint_dir, metrics)
+    
     # Initialize Google Maps client if API key is provided
     gmaps_client = None
     if google_maps_api_key:
         try:
-            gmaps_client = initialize_google_maps_client(google_maps_api_key)
+            gmaps_client = metrics.instrument_client(initialize_google_maps_client(google_maps_api_key))
             print("Google Maps API initialized successfully.")
         except Exception as e:
             print(f"Error initializing Google Maps API: {e}")
@@ -694,19 +1112,45 @@ def process_gpx_files(gpx_files, google_maps_api_key=None, target_daily_distance
         route_name = os.path.basename(gpx_file).replace('.gpx', '')
         print(f"\nProcessing route: {route_name}")
         
+        keys = route_stage_keys(file_digest(gpx_file), target_daily_distance, gmaps_client is not None, compact, distance_model)
+        
         # Load GPX data
-        route_df = load_gpx_to_dataframe(gpx_file)
+        with metrics.stage('load'):
+            route_df = checkpoints.run(route_name, 'parse', keys['parse'],
+                                       lambda: load_gpx_to_dataframe(gpx_file, compact, distance_model))
+        metrics.record_file_read(gpx_file)
+        metrics.count('points', len(route_df))
         total_distance = route_df['cumulative_distance'].iloc[-1]
         total_elevation_gain = route_df['cumulative_elevation_gain'].iloc[-1]
         
         print(f"  Total distance: {total_distance:.2f} km")
         print(f"  Total elevation gain: {total_elevation_gain:.0f} m")
+        if report_memory:
+            print_memory_report(route_name, route_df)
         
         # Calculate optimal RV stops
-        rv_stops = calculate_optimal_rv_stops(route_df, target_daily_distance, gmaps_client)
+        with metrics.stage('rv_stops'):
+            initial_stops = checkpoints.run(route_name, 'rv_stops', keys['rv_stops'],
+                                            lambda: place_rv_stops(route_df, target_daily_distance), (keys['parse'],))
+            rv_stops = checkpoints.run(route_name, 'enriched_stops', keys['enriched_stops'],
+                                       lambda: enrich_rv_stops(initial_stops, gmaps_client), (keys['rv_stops'],))
         
         # Analyze route segments
-        segments = analyze_route_segments(route_df, rv_stops, gmaps_client)
+        with metrics.stage('segments'):
+            segments = checkpoints.run(route_name, 'segments', keys['segments'],
+                                       lambda: analyze_route_segments(route_df, rv_stops, gmaps_client),
+                                       (keys['parse'], keys['enriched_stops']))
+        
+        # Look up facilities near each stop
+        if facilities and gmaps_client:
+            with metrics.stage('facilities'):
+                stop_facilities = checkpoints.run(
+                    route_name, 'facilities', keys['facilities'],
+                    lambda: [find_nearby_facilities(gmaps_client, stop['latitude'], stop['longitude']) for stop in rv_stops],
+                    (keys['enriched_stops'],)
+                )
+            for stop, found in zip(rv_stops, stop_facilities):
+                stop['facilities'] = found
         
         # Store route data
         route_data[route_name] = {
@@ -725,12 +1169,41 @@ def process_gpx_files(gpx_files, google_maps_api_key=None, target_daily_distance
             else:
                 print(f"    Day {stop['day']}: {stop['distance_km']:.2f} km")
     
+    return route_data
+
+def process_gpx_files(gpx_files, google_maps_api_key=None, target_daily_distance=125, metrics=None, distance_model='haversine',
+                      checkpoint_dir=None):
+    """
+    Process multiple GPX files and create an integrated visualization
+    
+    Parameters:
+    - gpx_files: List of GPX file paths
+    - google_maps_api_key: Optional Google Maps API key
+    - target_daily_distance: Target distance per day in km
+    - metrics: Optional PipelineMetrics; filled with stage timings and counters
+    - distance_model: Distance model for the route distances (see distance_models)
+    - checkpoint_dir: Optional directory of stage checkpoints for resuming an interrupted run
+    
+    Returns:
+    - Dictionary with processed route data
+    - Path to the generated HTML file
+    """
+    if metrics is None:
+        metrics = PipelineMetrics()
+    
+    route_data = plan_routes(gpx_files, google_maps_api_key, target_daily_distance, metrics, distance_model=distance_model,
+                             checkpoint_dir=checkpoint_dir, facilities=True)
+    
     # Create the integrated map
-    html_file = create_integrated_map(route_data, google_maps_api_key)
+    with metrics.stage('map'):
+        html_file = create_integrated_map(route_data, google_maps_api_key, metrics)
+    
+    metrics.finish()
     
     return route_data, html_file
 
-def main(gpx_files, google_maps_api_key=None, target_daily_distance=125):
+def main(gpx_files, google_maps_api_key=None, target_daily_distance=125, metrics=None, distance_model='haversine',
+         checkpoint_dir=None):
     """
     Main function to process GPX files and create integrated visualization
     
@@ -738,12 +1211,16 @@ def main(gpx_files, google_maps_api_key=None, target_daily_distance=125):
     - gpx_files: List of GPX file paths
     - google_maps_api_key: Optional Google Maps API key
     - target_daily_distance: Target distance per day in km
+    - metrics: Optional PipelineMetrics for stage timings, JSON output and profiling
+    - distance_model: Distance model for the route distances (see distance_models)
+    - checkpoint_dir: Optional directory of stage checkpoints for resuming an interrupted run
     
     Returns:
     - Path to the generated HTML file
     """
-    google_maps_api_key = os.getenv("MAPS_API_KEY")
-    route_data, html_file = process_gpx_files(gpx_files, google_maps_api_key, target_daily_distance)
+    google_maps_api_key = resolve_api_key(google_maps_api_key)
+    route_data, html_file = process_gpx_files(gpx_files, google_maps_api_key, target_daily_distance, metrics, distance_model,
+                                             checkpoint_dir)
     
     print(f"\nAnalysis complete!")
     print(f"Integrated map with Google Maps data and hover functionality saved to: {html_file}")
@@ -752,14 +1229,9 @@ def main(gpx_files, google_maps_api_key=None, target_daily_distance=125):
 
 # Example usage:
 # python route_compare.py gpx/HS_TSP_Solo.gpx gpx/LS_TSP_solo.gpx gpx/JP_TSP_Solo.gpx --daily-distance 125
+# (equivalent to: python cli.py compare ...)
 if __name__ == "__main__":
-    import argparse
-    
-    parser = argparse.ArgumentParser(description='Process GPX files for ultra run route planning.')
-    parser.add_argument('gpx_files', nargs='+', help='GPX files to process')
-    parser.add_argument('--api-key', help='Google Maps API key')
-    parser.add_argument('--daily-distance', type=float, default=125, help='Target daily distance in km (default: 125)')
-    
-    args = parser.parse_args()
+    import sys
+    from cli import main as cli_main
     
-    main(args.gpx_files, args.api_key, args.daily_distance)
\ No newline at end of file
+    sys.exit(cli_main(['compare'] + sys.argv[1:]))
@@ -0,0 +1,492 @@
+"""
+Persistent spatial index over a library of GPX routes
+
+Each route is cut into pieces of consecutive points, never spanning two
+track segments, and the gap between segments is not part of the route
+distance (as in load_gpx_to_dataframe). Every piece's bounding
+box goes into a SQLite R*Tree, together with the piece's points and their
+distance along the route. Queries find candidate pieces through the R-tree
+and refine them against the stored points, so "which routes pass within 2 km
+of this town?" is answered without parsing a single GPX file.
+
+Queries return one match per route with the route id, name and path, the
+closest approach in meters, and the ranges of route distance (km from the
+start, measured like load_gpx_to_dataframe) that satisfy the query.
+"""
+import math
+import os
+import sqlite3
+
+import numpy as np
+
+from gpx_stream import iter_gpx_points
+from distance_models import MEAN_EARTH_RADIUS_M, haversine
+
+# Points per indexed piece; pieces share their boundary point so no step is lost
+PIECE_POINTS = 64
+
+# Polyline steps covered by one R-tree lookup in near_polyline
+POLYLINE_STEPS_PER_QUERY = 16
+
+# Bumped when the stored pieces or distances change meaning; older indexes are rebuilt
+INDEX_FORMAT_VERSION = 1
+
+METERS_PER_DEGREE = MEAN_EARTH_RADIUS_M * math.pi / 180
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS routes (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    name TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    points INTEGER NOT NULL,
+    distance_km REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pieces (
+    id INTEGER PRIMARY KEY,
+    route_id INTEGER NOT NULL REFERENCES routes(id),
+    start_km REAL NOT NULL,
+    end_km REAL NOT NULL,
+    points BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pieces_route ON pieces(route_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS piece_boxes USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+"""
+
+
+def _meters_per_degree_lon(latitude):
+    # Clamp near the poles so a search box never becomes infinitely wide
+    return METERS_PER_DEGREE * max(math.cos(math.radians(min(abs(latitude), 89.0))), 1e-6)
+
+
+def _merge_ranges(ranges, decimals=3, gap_km=1e-6):
+    """
+    Round (start_km, end_km) ranges to decimals, then merge overlapping or touching ones
+    """
+    merged = []
+    for start, end in sorted((round(start, decimals), round(end, decimals)) for start, end in ranges):
+        if merged and start <= merged[-1][1] + gap_km:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+class RouteIndex:
+    """
+    On-disk spatial index of GPX routes
+
+    Parameters:
+    - index_path: SQLite file holding the index (created if missing)
+    - piece_points: Points per indexed piece when adding routes
+    """
+
+    def __init__(self, index_path, piece_points=PIECE_POINTS):
+        self.index_path = index_path
+        self.piece_points = piece_points
+        self._db = sqlite3.connect(index_path)
+        if self._db.execute("PRAGMA user_version").fetchone()[0] != INDEX_FORMAT_VERSION:
+            # Unchanged files are skipped when indexing, so stale entries would never be replaced
+            self._db.executescript(
+                "DROP TABLE IF EXISTS piece_boxes; DROP TABLE IF EXISTS pieces; DROP TABLE IF EXISTS routes;"
+            )
+            self._db.execute(f"PRAGMA user_version = {INDEX_FORMAT_VERSION}")
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Building
+
+    def _remove_route(self, route_id):
+        self._db.execute(
+            "DELETE FROM piece_boxes WHERE id IN (SELECT id FROM pieces WHERE route_id = ?)", (route_id,)
+        )
+        self._db.execute("DELETE FROM pieces WHERE route_id = ?", (route_id,))
+        self._db.execute("DELETE FROM routes WHERE id = ?", (route_id,))
+
+    def _insert_piece(self, route_id, lat, lon, km):
+        points = np.column_stack((lat, lon, km)).astype(np.float32)
+        cursor = self._db.execute(
+            "INSERT INTO pieces (route_id, start_km, end_km, points) VALUES (?, ?, ?, ?)",
+            (route_id, float(km[0]), float(km[-1]), points.tobytes())
+        )
+        self._db.execute(
+            "INSERT INTO piece_boxes VALUES (?, ?, ?, ?, ?)",
+            (cursor.lastrowid, float(lat.min()), float(lat.max()), float(lon.min()), float(lon.max()))
+        )
+
+    def _add_piece(self, route_id, lat, lon, start_km):
+        """
+        Index buffered points of one segment starting at start_km; returns the distance at the last point
+        """
+        piece_lat, piece_lon = np.array(lat), np.array(lon)
+        km = start_km + np.concatenate(([0.0], np.cumsum(haversine(piece_lat[:-1], piece_lon[:-1], piece_lat[1:], piece_lon[1:])) / 1000))
+        self._insert_piece(route_id, piece_lat, piece_lon, km)
+        return float(km[-1])
+
+    def add_route(self, gpx_file_path, name=None):
+        """
+        Index one GPX file, replacing an older entry for the same path
+
+        Returns:
+        - Route id, or None if the file is already indexed and unchanged
+        """
+        path = os.path.abspath(gpx_file_path)
+        file_stat = os.stat(path)
+        row = self._db.execute("SELECT id, size_bytes, mtime FROM routes WHERE path = ?", (path,)).fetchone()
+        if row and row[1] == file_stat.st_size and row[2] == file_stat.st_mtime:
+            return None
+
+        with self._db:
+            if row:
+                self._remove_route(row[0])
+
+            name = name or os.path.basename(path).replace('.gpx', '')
+            route_id = self._db.execute(
+                "INSERT INTO routes (path, name, size_bytes, mtime, points, distance_km) VALUES (?, ?, ?, ?, 0, 0)",
+                (path, name, file_stat.st_size, file_stat.st_mtime)
+            ).lastrowid
+
+            points = 0
+            distance_km = 0.0
+            lat, lon = [], []
+            current_segment = None
+            segment_points = 0
+            for segment, point_lat, point_lon, _, _ in iter_gpx_points(path):
+                # A new segment starts a new piece, without a step from the previous segment's end
+                if segment != current_segment:
+                    if len(lat) > 1 or segment_points == 1:
+                        distance_km = self._add_piece(route_id, lat, lon, distance_km)
+                    lat, lon = [], []
+                    current_segment = segment
+                    segment_points = 0
+                lat.append(point_lat)
+                lon.append(point_lon)
+                points += 1
+                segment_points += 1
+                if len(lat) == self.piece_points:
+                    distance_km = self._add_piece(route_id, lat, lon, distance_km)
+                    lat, lon = lat[-1:], lon[-1:]
+
+            if len(lat) > 1 or segment_points == 1:
+                distance_km = self._add_piece(route_id, lat, lon, distance_km)
+
+            self._db.execute(
+                "UPDATE routes SET points = ?, distance_km = ? WHERE id = ?", (points, distance_km, route_id)
+            )
+        return route_id
+
+    def index_library(self, source, prune=True):
+        """
+        Index every GPX file in a directory or glob, skipping unchanged files
+
+        Parameters:
+        - source: Directory to walk or glob pattern (see batch_analyser.find_gpx_files)
+        - prune: Drop indexed routes whose files no longer exist
+
+        Returns:
+        - Dictionary with the number of added, unchanged and removed routes
+        """
+        from batch_analyser import find_gpx_files
+
+        counts = {'added': 0, 'unchanged': 0, 'removed': 0}
+        for path in find_gpx_files(source):
+            if self.add_route(path) is None:
+                counts['unchanged'] += 1
+            else:
+                counts['added'] += 1
+
+        if prune:
+            for route_id, path in self._db.execute("SELECT id, path FROM routes").fetchall():
+                if not os.path.exists(path):
+                    with self._db:
+                        self._remove_route(route_id)
+                    counts['removed'] += 1
+        return counts
+
+    def routes(self):
+        """
+        List indexed routes as dictionaries (id, name, path, points, distance_km)
+        """
+        rows = self._db.execute("SELECT id, name, path, points, distance_km FROM routes ORDER BY name")
+        return [dict(zip(('id', 'name', 'path', 'points', 'distance_km'), row)) for row in rows]
+
+    # Querying
+
+    def _candidate_pieces(self, min_lat, max_lat, min_lon, max_lon):
+        """
+        Pieces whose bounding box intersects a lat/lon box, grouped by route
+        """
+        rows = self._db.execute(
+            """
+            SELECT pieces.route_id, pieces.points
+            FROM piece_boxes JOIN pieces ON pieces.id = piece_boxes.id
+            WHERE piece_boxes.max_lat >= ? AND piece_boxes.min_lat <= ?
+              AND piece_boxes.max_lon >= ? AND piece_boxes.min_lon <= ?
+            """,
+            (min_lat, max_lat, min_lon, max_lon)
+        )
+        by_route = {}
+        for route_id, blob in rows:
+            by_route.setdefault(route_id, []).append(np.frombuffer(blob, dtype=np.float32).reshape(-1, 3).astype(np.float64))
+        return by_route
+
+    def _candidate_pieces_along(self, min_lat, max_lat, min_lon, max_lon, steps_per_query=POLYLINE_STEPS_PER_QUERY):
+        """
+        Pieces whose bounding box intersects any of a sequence of lat/lon boxes, grouped by route
+
+        Consecutive boxes are combined steps_per_query at a time, so a long
+        polyline costs a handful of small R-tree lookups rather than one over
+        its whole extent. A piece found by several lookups is returned once,
+        paired with the indices of the boxes in the lookups that found it.
+        """
+        found = {}
+        for first in range(0, len(min_lat), steps_per_query):
+            batch = slice(first, first + steps_per_query)
+            rows = self._db.execute(
+                """
+                SELECT pieces.id, pieces.route_id, pieces.points
+                FROM piece_boxes JOIN pieces ON pieces.id = piece_boxes.id
+                WHERE piece_boxes.max_lat >= ? AND piece_boxes.min_lat <= ?
+                  AND piece_boxes.max_lon >= ? AND piece_boxes.min_lon <= ?
+                """,
+                (float(min_lat[batch].min()), float(max_lat[batch].max()),
+                 float(min_lon[batch].min()), float(max_lon[batch].max()))
+            )
+            for piece_id, route_id, blob in rows:
+                if piece_id not in found:
+                    found[piece_id] = (route_id, blob, [])
+                found[piece_id][2].append(first)
+
+        by_route = {}
+        for route_id, blob, firsts in found.values():
+            steps = np.concatenate([np.arange(first, min(first + steps_per_query, len(min_lat))) for first in firsts])
+            points = np.frombuffer(blob, dtype=np.float32).reshape(-1, 3).astype(np.float64)
+            by_route.setdefault(route_id, []).append((points, steps))
+        return by_route
+
+    def _matches(self, results):
+        """
+        Attach route metadata to {route_id: (min_distance_m, ranges)} and sort by closest approach
+        """
+        matches = []
+        for route_id, (min_distance_m, ranges) in results.items():
+            name, path, distance_km = self._db.execute(
+                "SELECT name, path, distance_km FROM routes WHERE id = ?", (route_id,)
+            ).fetchone()
+            matches.append({
+                'route_id': route_id,
+                'name': name,
+                'path': path,
+                'route_distance_km': distance_km,
+                'min_distance_m': round(min_distance_m, 1),
+                'ranges_km': _merge_ranges(ranges)
+            })
+        return sorted(matches, key=lambda match: (match['min_distance_m'], match['name']))
+
+    def near_point(self, latitude, longitude, radius_m):
+        """
+        Routes passing within radius_m of a point
+
+        Steps between points are treated as straight lines in a local plane
+        around the query point, which is accurate for radii of tens of km.
+        Ranges are the stretches of each route inside the circle.
+        """
+        dlat = radius_m / METERS_PER_DEGREE
+        dlon = radius_m / _meters_per_degree_lon(latitude)
+        pieces = self._candidate_pieces(latitude - dlat, latitude + dlat, longitude - dlon, longitude + dlon)
+
+        x_scale = _meters_per_degree_lon(latitude)
+        results = {}
+        for route_id, route_pieces in pieces.items():
+            best = math.inf
+            ranges = []
+            for points in route_pieces:
+                x = (points[:, 1] - longitude) * x_scale
+                y = (points[:, 0] - latitude) * METERS_PER_DEGREE
+                km = points[:, 2]
+
+                if len(points) == 1:
+                    distance = math.hypot(x[0], y[0])
+                    best = min(best, distance)
+                    if distance <= radius_m:
+                        ranges.append((km[0], km[0]))
+                    continue
+
+                # Closest approach of each step to the origin (the query point)
+                dx, dy = np.diff(x), np.diff(y)
+                length2 = dx * dx + dy * dy
+                safe_length2 = np.where(length2 > 0, length2, 1)
+                t = np.clip(-(x[:-1] * dx + y[:-1] * dy) / safe_length2, 0, 1)
+                closest = np.hypot(x[:-1] + t * dx, y[:-1] + t * dy)
+                best = min(best, float(closest.min()))
+
+                # Portion of each step inside the circle: solve |a + t*d| = r for t
+                inside = np.flatnonzero(closest <= radius_m)
+                if inside.size:
+                    a = length2[inside]
+                    b = x[inside] * dx[inside] + y[inside] * dy[inside]
+                    c = x[inside] ** 2 + y[inside] ** 2 - radius_m ** 2
+                    root = np.sqrt(np.maximum(b * b - a * c, 0))
+                    safe_a = np.where(a > 0, a, 1)
+                    t0 = np.where(a > 0, np.clip((-b - root) / safe_a, 0, 1), 0)
+                    t1 = np.where(a > 0, np.clip((-b + root) / safe_a, 0, 1), 1)
+                    step_km = km[inside + 1] - km[inside]
+                    ranges.extend(zip(km[inside] + t0 * step_km, km[inside] + t1 * step_km))
+
+            if best <= radius_m:
+                results[route_id] = (best, ranges)
+        return self._matches(results)
+
+    def in_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """
+        Routes crossing a latitude/longitude box
+
+        Ranges are the stretches of each route inside the box (steps are
+        clipped in degree space); min_distance_m is 0 for every match.
+        """
+        pieces = self._candidate_pieces(min_lat, max_lat, min_lon, max_lon)
+
+        results = {}
+        for route_id, route_pieces in pieces.items():
+            ranges = []
+            for points in route_pieces:
+                lat, lon, km = points[:, 0], points[:, 1], points[:, 2]
+                if len(points) == 1:
+                    if min_lat <= lat[0] <= max_lat and min_lon <= lon[0] <= max_lon:
+                        ranges.append((km[0], km[0]))
+                    continue
+
+                # Liang-Barsky clipping of every step against the box
+                t0 = np.zeros(len(points) - 1)
+                t1 = np.ones(len(points) - 1)
+                for start, delta, low, high in ((lat[:-1], np.diff(lat), min_lat, max_lat),
+                                                (lon[:-1], np.diff(lon), min_lon, max_lon)):
+                    moving = delta != 0
+                    safe_delta = np.where(moving, delta, 1)
+                    enter = np.where(moving, np.minimum((low - start) / safe_delta, (high - start) / safe_delta), -np.inf)
+                    leave = np.where(moving, np.maximum((low - start) / safe_delta, (high - start) / safe_delta), np.inf)
+                    # A step parallel to this axis is either always or never inside it
+                    outside = ~moving & ((start < low) | (start > high))
+                    t0 = np.maximum(t0, enter)
+                    t1 = np.where(outside, -1, np.minimum(t1, leave))
+
+                crossing = np.flatnonzero(t0 <= t1)
+                step_km = km[crossing + 1] - km[crossing]
+                ranges.extend(zip(km[crossing] + t0[crossing] * step_km, km[crossing] + t1[crossing] * step_km))
+
+            if ranges:
+                results[route_id] = (0.0, ranges)
+        return self._matches(results)
+
+    def near_polyline(self, latitudes, longitudes, corridor_m):
+        """
+        Routes passing within corridor_m of a polyline (e.g. another route)
+
+        Route steps are sampled at most corridor_m / 2 apart and each sample is
+        measured against the polyline's steps, so range ends are accurate to
+        about a quarter of the corridor width.
+        """
+        line_lat = np.asarray(latitudes, dtype=np.float64)
+        line_lon = np.asarray(longitudes, dtype=np.float64)
+        if len(line_lat) == 1:
+            return self.near_point(line_lat[0], line_lon[0], corridor_m)
+
+        dlat = corridor_m / METERS_PER_DEGREE
+        dlon = corridor_m / _meters_per_degree_lon(max(abs(line_lat.min()), abs(line_lat.max())))
+        box_min_lat = np.minimum(line_lat[:-1], line_lat[1:]) - dlat
+        box_max_lat = np.maximum(line_lat[:-1], line_lat[1:]) + dlat
+        box_min_lon = np.minimum(line_lon[:-1], line_lon[1:]) - dlon
+        box_max_lon = np.maximum(line_lon[:-1], line_lon[1:]) + dlon
+
+        # R-tree lookups along the corridor, then per-piece refinement
+        pieces = self._candidate_pieces_along(box_min_lat, box_max_lat, box_min_lon, box_max_lon)
+
+        results = {}
+        for route_id, route_pieces in pieces.items():
+            best = math.inf
+            ranges = []
+            for points, steps in route_pieces:
+                lat, lon, km = points[:, 0], points[:, 1], points[:, 2]
+                near_steps = steps[
+                    (box_max_lat[steps] >= lat.min()) & (box_min_lat[steps] <= lat.max())
+                    & (box_max_lon[steps] >= lon.min()) & (box_min_lon[steps] <= lon.max())
+                ]
+                if not near_steps.size:
+                    continue
+
+                # Densify the route piece so no crossing of the corridor is missed
+                if len(points) > 1:
+                    step_m = haversine(lat[:-1], lon[:-1], lat[1:], lon[1:])
+                    samples = np.maximum(np.ceil(step_m / (corridor_m / 2)), 1).astype(int)
+                    step = np.repeat(np.arange(len(step_m)), samples)
+                    fraction = (np.arange(samples.sum()) - np.repeat(np.cumsum(samples) - samples, samples)) / np.repeat(samples, samples)
+                    sample_lat = np.append(lat[step] + fraction * (lat[step + 1] - lat[step]), lat[-1])
+                    sample_lon = np.append(lon[step] + fraction * (lon[step + 1] - lon[step]), lon[-1])
+                    sample_km = np.append(km[step] + fraction * (km[step + 1] - km[step]), km[-1])
+                else:
+                    sample_lat, sample_lon, sample_km = lat, lon, km
+
+                # Distance of every sample to every nearby polyline step, in a plane local to each sample
+                x_scale = METERS_PER_DEGREE * np.cos(np.radians(sample_lat))[:, None]
+                ax = (line_lon[near_steps] - sample_lon[:, None]) * x_scale
+                ay = (line_lat[near_steps] - sample_lat[:, None]) * METERS_PER_DEGREE
+                bx = (line_lon[near_steps + 1] - sample_lon[:, None]) * x_scale
+                by = (line_lat[near_steps + 1] - sample_lat[:, None]) * METERS_PER_DEGREE
+                dx, dy = bx - ax, by - ay
+                length2 = dx * dx + dy * dy
+                t = np.clip(-(ax * dx + ay * dy) / np.where(length2 > 0, length2, 1), 0, 1)
+                distance = np.hypot(ax + t * dx, ay + t * dy).min(axis=1)
+                best = min(best, float(distance.min()))
+
+                inside = distance <= corridor_m
+                if inside.any():
+                    # Runs of consecutive samples inside the corridor become ranges
+                    edges = np.diff(np.concatenate(([0], inside.astype(np.int8), [0])))
+                    starts = np.flatnonzero(edges == 1)
+                    ends = np.flatnonzero(edges == -1) - 1
+                    ranges.extend(zip(sample_km[starts], sample_km[ends]))
+
+            if best <= corridor_m:
+                results[route_id] = (best, ranges)
+        return self._matches(results)
+
+    def near_gpx(self, gpx_file_path, corridor_m):
+        """
+        Routes passing within corridor_m of the track in a GPX file
+        """
+        segments = {}
+        for segment, point_lat, point_lon, _, _ in iter_gpx_points(gpx_file_path):
+            lat, lon = segments.setdefault(segment, ([], []))
+            lat.append(point_lat)
+            lon.append(point_lon)
+
+        # Each segment is its own polyline, so the gap between segments is not part of the corridor
+        results = {}
+        for lat, lon in segments.values():
+            for match in self.near_polyline(lat, lon, corridor_m):
+                best, ranges = results.get(match['route_id'], (math.inf, []))
+                results[match['route_id']] = (min(best, match['min_distance_m']), ranges + match['ranges_km'])
+        return self._matches(results)
+
+
+def print_matches(matches):
+    """
+    Print query matches, one route per line with its distance ranges
+    """
+    if not matches:
+        print("No routes found")
+        return
+    for match in matches:
+        # Merge again at display precision so nearby ranges do not print as repeats
+        ranges = ', '.join(f"{start:.1f}-{end:.1f} km" for start, end in _merge_ranges(match['ranges_km'], decimals=1))
+        print(f"  {match['name']} ({match['route_distance_km']:.1f} km): "
+              f"closest {match['min_distance_m']:.0f} m, at {ranges}")
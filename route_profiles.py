@@ -0,0 +1,282 @@
+"""
+Elevation and pace profile charts
+
+Renders one profile per route (elevation against distance with the RV stops
+marked, plus pace per kilometre when the track has times) and an overlay of
+several routes. Profiles are downsampled to the chart width before plotting,
+either with Largest-Triangle-Three-Buckets or by keeping the minimum and
+maximum of each pixel bucket, so climbs and summits keep their shape while
+matplotlib draws a few thousand points instead of every track point. Charts
+are drawn on the Agg canvas directly, without pyplot, so batch rendering
+works headless and in worker processes.
+
+Usage:
+    python cli.py profile gpx/HS_TSP_Solo.gpx gpx/LS_TSP_Solo.gpx --output-dir profiles
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+DOWNSAMPLE_METHODS = ('lttb', 'minmax')
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Indices of the points kept by Largest-Triangle-Three-Buckets downsampling
+
+    The first and last points are always kept. Each bucket in between keeps
+    the point forming the largest triangle with the point kept in the previous
+    bucket and the mean of the next bucket.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # Bucket boundaries splitting the points between the first and last into n_out - 2 buckets
+    edges = (np.arange(n_out - 1) * (n - 2) / (n_out - 2)).astype(np.int64) + 1
+    # Mean of every bucket, for the third vertex of the triangles
+    counts = np.diff(edges)
+    mean_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / counts
+    mean_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / counts
+    mean_x = np.append(mean_x, x[-1])
+    mean_y = np.append(mean_y, y[-1])
+
+    kept = np.empty(n_out, dtype=np.int64)
+    kept[0] = 0
+    kept[-1] = n - 1
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        # Twice the triangle areas; the constant factor does not change the argmax
+        area = np.abs(
+            (x[previous] - mean_x[bucket + 1]) * (y[start:stop] - y[previous])
+            - (x[previous] - x[start:stop]) * (mean_y[bucket + 1] - y[previous])
+        )
+        previous = start + int(np.argmax(area))
+        kept[bucket + 1] = previous
+    return kept
+
+
+def minmax_indices(y, n_buckets):
+    """
+    Indices of the minimum and maximum of each of n_buckets equal index buckets, in order
+
+    The first and last points are always kept, so at most 2 * n_buckets + 2
+    points remain.
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if 2 * n_buckets >= n:
+        return np.arange(n)
+
+    bucket = np.arange(n) * n_buckets // n
+    order = np.lexsort((y, bucket))
+    starts = np.searchsorted(bucket[order], np.arange(n_buckets))
+    ends = np.append(starts[1:], n)
+    return np.unique(np.concatenate(([0, n - 1], order[starts], order[ends - 1])))
+
+
+def downsample_profile(x, y, max_points=2000, method='lttb'):
+    """
+    Downsample a profile for plotting while preserving its shape
+
+    Parameters:
+    - x, y: Profile coordinates (e.g. cumulative distance and elevation)
+    - max_points: Points to keep, about twice the chart width in pixels for 'minmax'
+    - method: 'lttb' or 'minmax'
+
+    Returns:
+    - Downsampled x and y arrays
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if method == 'lttb':
+        kept = lttb_indices(x, y, max_points)
+    elif method == 'minmax':
+        kept = minmax_indices(y, max(max_points // 2 - 1, 1))
+    else:
+        raise ValueError(f"Unknown downsampling method {method!r}; choose from {', '.join(DOWNSAMPLE_METHODS)}")
+    return x[kept], y[kept]
+
+
+def pace_per_km(route_df):
+    """
+    Pace in minutes per kilometre for every full kilometre of a timed track
+
+    Returns:
+    - Arrays of kilometre end distances and paces, or None if the track has no usable times
+    """
+    import pandas as pd
+
+    if 'time' not in route_df:
+        return None
+    times = pd.to_datetime(route_df['time'], utc=True, errors='coerce')
+    valid = times.notna().to_numpy()
+    if valid.sum() < 2:
+        return None
+
+    distance = route_df['cumulative_distance'].to_numpy(dtype=float)[valid]
+    elapsed_s = (times[valid] - times[valid].iloc[0]).dt.total_seconds().to_numpy()
+    if not np.all(np.diff(elapsed_s) >= 0) or distance[-1] < 1:
+        return None
+
+    km = np.arange(1, int(distance[-1]) + 1, dtype=float)
+    # Time of passing each kilometre mark, interpolated between track points
+    mark_s = np.interp(np.concatenate(([0.0], km)), distance, elapsed_s)
+    return km, np.diff(mark_s) / 60
+
+
+def profile_data(route_df, rv_stops=(), max_points=2000, method='lttb'):
+    """
+    Downsampled elevation and pace profile of a route, ready to plot
+
+    Returns:
+    - Dictionary with the distance/elevation arrays, the stop distances and
+      elevations, and the pace arrays (None without times)
+    """
+    distance, elevation = downsample_profile(route_df['cumulative_distance'], route_df['elevation'], max_points, method)
+    pace = pace_per_km(route_df)
+    if pace is not None and len(pace[0]) > max_points:
+        pace = downsample_profile(pace[0], pace[1], max_points, method)
+
+    return {
+        'distance': distance,
+        'elevation': elevation,
+        'stop_distance': np.array([stop['distance_km'] for stop in rv_stops], dtype=float),
+        'stop_elevation': np.array([stop['elevation'] for stop in rv_stops], dtype=float),
+        'pace': pace,
+        'total_distance': float(route_df['cumulative_distance'].iloc[-1]),
+        'total_elevation_gain': float(route_df['cumulative_elevation_gain'].iloc[-1])
+    }
+
+
+def _new_figure(width_px, height_px, dpi):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(width_px / dpi, height_px / dpi), dpi=dpi)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def plot_elevation_profile(name, profile, output_path, width_px=1600, height_px=600, dpi=100):
+    """
+    Save the profile of one route (see profile_data) as an image
+
+    Returns:
+    - Path to the saved image
+    """
+    fig = _new_figure(width_px, height_px, dpi)
+    if profile['pace'] is not None:
+        elevation_ax, pace_ax = fig.subplots(2, 1, sharex=True, gridspec_kw={'height_ratios': [2, 1]})
+    else:
+        elevation_ax, pace_ax = fig.subplots(1, 1), None
+
+    elevation_ax.fill_between(profile['distance'], profile['elevation'], profile['elevation'].min(), alpha=0.3)
+    elevation_ax.plot(profile['distance'], profile['elevation'], linewidth=1)
+    elevation_ax.scatter(profile['stop_distance'], profile['stop_elevation'], color='red', zorder=3, label='RV stops')
+    for day, (stop_distance, stop_elevation) in enumerate(zip(profile['stop_distance'], profile['stop_elevation']), 1):
+        elevation_ax.annotate(f"Day {day}", (stop_distance, stop_elevation), textcoords='offset points',
+                              xytext=(0, 8), ha='center', fontsize=8)
+    elevation_ax.set_ylabel('Elevation (m)')
+    elevation_ax.set_title(f"{name}: {profile['total_distance']:.1f} km, "
+                           f"{profile['total_elevation_gain']:.0f} m elevation gain")
+    elevation_ax.grid(True, alpha=0.3)
+    if len(profile['stop_distance']):
+        elevation_ax.legend(loc='upper right')
+
+    if pace_ax is not None:
+        pace_ax.step(profile['pace'][0], profile['pace'][1], where='pre', linewidth=1)
+        pace_ax.set_ylabel('Pace (min/km)')
+        pace_ax.grid(True, alpha=0.3)
+        pace_ax.set_xlabel('Distance (km)')
+    else:
+        elevation_ax.set_xlabel('Distance (km)')
+
+    fig.tight_layout()
+    fig.savefig(output_path)
+    return output_path
+
+
+def plot_profile_overlay(profiles, output_path, width_px=1600, height_px=600, dpi=100):
+    """
+    Save the elevation profiles of several routes (name -> profile_data) on one chart
+
+    Returns:
+    - Path to the saved image
+    """
+    fig = _new_figure(width_px, height_px, dpi)
+    ax = fig.subplots(1, 1)
+    for name, profile in profiles.items():
+        line, = ax.plot(profile['distance'], profile['elevation'], linewidth=1,
+                        label=f"{name} ({profile['total_distance']:.1f} km, {profile['total_elevation_gain']:.0f} m)")
+        ax.scatter(profile['stop_distance'], profile['stop_elevation'], color=line.get_color(), edgecolor='black', zorder=3)
+    ax.set_xlabel('Distance (km)')
+    ax.set_ylabel('Elevation (m)')
+    ax.set_title('Route Elevation Profiles')
+    ax.grid(True, alpha=0.3)
+    ax.legend(loc='upper right')
+
+    fig.tight_layout()
+    fig.savefig(output_path)
+    return output_path
+
+
+def render_route_profile(gpx_file, output_dir='.', target_daily_distance=125, width_px=1600, method='lttb',
+                         distance_model='haversine'):
+    """
+    Load a route, place its RV stops and save its profile chart
+
+    Returns:
+    - Route name, image path and profile data (for the overlay)
+    """
+    from route_compare import load_gpx_to_dataframe, place_rv_stops
+
+    name = os.path.basename(gpx_file).replace('.gpx', '')
+    route_df = load_gpx_to_dataframe(gpx_file, distance_model=distance_model)
+    profile = profile_data(route_df, place_rv_stops(route_df, target_daily_distance), 2 * width_px, method)
+    output_path = plot_elevation_profile(name, profile, os.path.join(output_dir, f"{name}_profile.png"), width_px)
+    return name, output_path, profile
+
+
+def render_profiles(gpx_files, output_dir='.', target_daily_distance=125, width_px=1600, method='lttb',
+                    processes=None, distance_model='haversine'):
+    """
+    Render the profile of every route in a process pool, then the overlay of all routes
+
+    Parameters:
+    - gpx_files: GPX files to render
+    - output_dir: Directory for the <route>_profile.png files and route_profiles.png
+    - target_daily_distance: Target daily distance in km for the RV stop markers
+    - width_px: Chart width; profiles are downsampled to about two points per pixel
+    - method: Downsampling method, 'lttb' or 'minmax'
+    - processes: Worker processes (defaults to the CPU count; 1 renders in this process)
+    - distance_model: Distance model for the route distances (see distance_models)
+
+    Returns:
+    - Dictionary of route name -> image path, with the overlay under 'overlay'
+    """
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"Unknown downsampling method {method!r}; choose from {', '.join(DOWNSAMPLE_METHODS)}")
+    os.makedirs(output_dir, exist_ok=True)
+    arguments = [(gpx_file, output_dir, target_daily_distance, width_px, method, distance_model) for gpx_file in gpx_files]
+
+    if processes == 1 or len(gpx_files) == 1:
+        results = [render_route_profile(*args) for args in arguments]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(render_route_profile, *zip(*arguments)))
+
+    images = {}
+    for name, output_path, _ in results:
+        images[name] = output_path
+        print(f"Profile saved to: {output_path}")
+
+    if len(results) > 1:
+        images['overlay'] = plot_profile_overlay({name: profile for name, _, profile in results},
+                                                 os.path.join(output_dir, 'route_profiles.png'), width_px)
+        print(f"Profile overlay saved to: {images['overlay']}")
+    return images
@@ -0,0 +1,236 @@
+"""
+Interactive route planning sessions
+
+RouteSet keeps routes in memory between calls, for notebooks. Each GPX file
+is parsed once, and stops, segments and facilities are memoized per route
+under the same input-hash keys as the checkpointed pipeline
+(route_compare.route_stage_keys). Changing the target daily distance only
+recomputes the stops and what depends on them, and editing a GPX file only
+reloads that route. With a checkpoint_dir the results also survive kernel
+restarts and are shared with `cli.py plan/compare --checkpoint-dir`.
+
+Usage:
+    routes = RouteSet(['gpx/HS_TSP_Solo.gpx', 'gpx/LS_TSP_Solo.gpx'], google_maps_api_key)
+    routes.summary(125)
+    routes.render(110)   # only the stops, segments and facilities are recomputed
+"""
+import os
+
+from pipeline_checkpoints import StageCheckpoints, file_digest
+from pipeline_metrics import PipelineMetrics
+from route_compare import (
+    analyze_route_segments, create_integrated_map, enrich_rv_stops, find_nearby_facilities,
+    initialize_google_maps_client, load_gpx_to_dataframe, place_rv_stops, route_stage_keys
+)
+
+
+class RouteSet:
+    """
+    A set of routes with memoized planning stages
+
+    Parameters:
+    - gpx_files: GPX files to load (more can be added with add())
+    - google_maps_api_key: Optional Google Maps API key for stop enrichment,
+      directions and facilities
+    - compact: Load routes in the compact representation (see load_gpx_to_dataframe)
+    - distance_model: Distance model for the route distances (see distance_models)
+    - checkpoint_dir: Optional directory persisting stage results (see pipeline_checkpoints)
+    - metrics: Optional PipelineMetrics collecting stage timings and API calls
+    """
+
+    def __init__(self, gpx_files=(), google_maps_api_key=None, compact=False, distance_model='haversine',
+                 checkpoint_dir=None, metrics=None):
+        self.compact = compact
+        self.distance_model = distance_model
+        self.metrics = metrics if metrics is not None else PipelineMetrics()
+        self._checkpoints = StageCheckpoints(checkpoint_dir, self.metrics)
+        self._api_key = google_maps_api_key
+        self._gmaps_client = None
+        self._files = {}
+        self._memo = {}
+        for gpx_file in gpx_files:
+            self.add(gpx_file)
+
+    @property
+    def names(self):
+        """
+        Route names, in the order the routes were added
+        """
+        return list(self._files)
+
+    def add(self, gpx_file, name=None):
+        """
+        Add a GPX file; returns its route name (the file name without .gpx by default)
+        """
+        name = name or os.path.basename(gpx_file).replace('.gpx', '')
+        self._files[name] = {'path': gpx_file, 'stat': None, 'digest': None}
+        self.invalidate(name)
+        return name
+
+    def remove(self, name):
+        """
+        Remove a route and everything derived from it
+        """
+        del self._files[name]
+        self.invalidate(name)
+
+    def invalidate(self, name=None, stage=None):
+        """
+        Forget memoized results, optionally only of one route and/or stage
+
+        Checkpoints on disk are kept; they are only reused while their inputs match.
+        """
+        self._memo = {
+            memo_key: result for memo_key, result in self._memo.items()
+            if not ((name is None or memo_key[0] == name) and (stage is None or memo_key[1] == stage))
+        }
+
+    def set_api_key(self, google_maps_api_key):
+        """
+        Switch the Google Maps API key (None disables the API)
+
+        Results computed with and without the API are memoized separately, so
+        switching back and forth does not repeat calls.
+        """
+        self._api_key = google_maps_api_key
+        self._gmaps_client = None
+
+    @property
+    def gmaps_client(self):
+        """
+        Google Maps client, created on first use (None without an API key)
+        """
+        if self._gmaps_client is None and self._api_key:
+            self._gmaps_client = self.metrics.instrument_client(initialize_google_maps_client(self._api_key))
+        return self._gmaps_client
+
+    def _file_key(self, name):
+        """
+        Digest of a route's GPX file, recomputed only when its size or mtime changes
+        """
+        entry = self._files[name]
+        file_stat = os.stat(entry['path'])
+        stat = (file_stat.st_size, file_stat.st_mtime_ns)
+        if stat != entry['stat']:
+            digest = file_digest(entry['path'])
+            if entry['digest'] is not None and digest != entry['digest']:
+                self.invalidate(name)
+            entry['stat'] = stat
+            entry['digest'] = digest
+        return entry['digest']
+
+    def _keys(self, name, target_daily_distance=125):
+        return route_stage_keys(self._file_key(name), target_daily_distance, self.gmaps_client is not None,
+                                self.compact, self.distance_model)
+
+    def _stage(self, name, stage, key, compute, depends_on=()):
+        """
+        Memoized result of a stage, loaded from its checkpoint or computed
+        """
+        memo_key = (name, stage, key)
+        if memo_key in self._memo:
+            return self._memo[memo_key]
+
+        with self.metrics.stage(stage):
+            result = self._checkpoints.run(name, stage, key, compute, depends_on)
+        # Results degraded by failed API calls are retried on the next request
+        if not self._checkpoints.incomplete(key):
+            self._memo[memo_key] = result
+        return result
+
+    def route(self, name):
+        """
+        Route DataFrame with distance and elevation columns (see load_gpx_to_dataframe)
+        """
+        keys = self._keys(name)
+        path = self._files[name]['path']
+        return self._stage(name, 'parse', keys['parse'],
+                           lambda: load_gpx_to_dataframe(path, self.compact, self.distance_model))
+
+    def stops(self, name, target_daily_distance=125):
+        """
+        RV stops for a target daily distance, enriched with Google Maps data when available
+        """
+        keys = self._keys(name, target_daily_distance)
+        route_df = self.route(name)
+        initial_stops = self._stage(name, 'rv_stops', keys['rv_stops'],
+                                    lambda: place_rv_stops(route_df, target_daily_distance), (keys['parse'],))
+        return self._stage(name, 'enriched_stops', keys['enriched_stops'],
+                           lambda: enrich_rv_stops(initial_stops, self.gmaps_client), (keys['rv_stops'],))
+
+    def segments(self, name, target_daily_distance=125):
+        """
+        Daily segment analysis between the RV stops (see analyze_route_segments)
+        """
+        keys = self._keys(name, target_daily_distance)
+        route_df = self.route(name)
+        rv_stops = self.stops(name, target_daily_distance)
+        return self._stage(name, 'segments', keys['segments'],
+                           lambda: analyze_route_segments(route_df, rv_stops, self.gmaps_client),
+                           (keys['parse'], keys['enriched_stops']))
+
+    def facilities(self, name, target_daily_distance=125):
+        """
+        Facilities near each RV stop (None without Google Maps access)
+        """
+        if self.gmaps_client is None:
+            return None
+        keys = self._keys(name, target_daily_distance)
+        rv_stops = self.stops(name, target_daily_distance)
+        return self._stage(
+            name, 'facilities', keys['facilities'],
+            lambda: [find_nearby_facilities(self.gmaps_client, stop['latitude'], stop['longitude']) for stop in rv_stops],
+            (keys['enriched_stops'],)
+        )
+
+    def plan(self, target_daily_distance=125, facilities=False):
+        """
+        Route data for every route, in the format returned by route_compare.plan_routes
+        """
+        route_data = {}
+        for name in self._files:
+            route_df = self.route(name)
+            # Copies, so attaching facilities never alters the memoized stops
+            rv_stops = [dict(stop) for stop in self.stops(name, target_daily_distance)]
+            stop_facilities = self.facilities(name, target_daily_distance) if facilities else None
+            if stop_facilities:
+                for stop, found in zip(rv_stops, stop_facilities):
+                    stop['facilities'] = found
+
+            route_data[name] = {
+                'df': route_df,
+                'rv_stops': rv_stops,
+                'segments': self.segments(name, target_daily_distance),
+                'total_distance': route_df['cumulative_distance'].iloc[-1],
+                'total_elevation_gain': route_df['cumulative_elevation_gain'].iloc[-1]
+            }
+        return route_data
+
+    def render(self, target_daily_distance=125, geometry_tolerance_m=10):
+        """
+        Render the integrated map for a target daily distance
+
+        Returns:
+        - Path to the generated HTML file
+        """
+        route_data = self.plan(target_daily_distance, facilities=True)
+        with self.metrics.stage('map'):
+            return create_integrated_map(route_data, metrics=self.metrics, geometry_tolerance_m=geometry_tolerance_m)
+
+    def summary(self, target_daily_distance=125):
+        """
+        One row per route: distance, elevation gain, points and planned days
+        """
+        import pandas as pd
+
+        rows = []
+        for name in self._files:
+            route_df = self.route(name)
+            rows.append({
+                'route': name,
+                'distance_km': float(route_df['cumulative_distance'].iloc[-1]),
+                'elevation_gain_m': float(route_df['cumulative_elevation_gain'].iloc[-1]),
+                'points': len(route_df),
+                'days': len(self.stops(name, target_daily_distance)) + 1
+            })
+        return pd.DataFrame(rows).set_index('route')
@@ -0,0 +1,67 @@
+"""
+Track segment boundaries
+
+GPX tracks are split into <trkseg> segments, e.g. when a recording was
+paused. The loaders keep the segment of every point in a 'segment' column;
+the boundaries are handled as a CSR-style offsets index, where segment k
+spans the points offsets[k]:offsets[k + 1]. Distances, jitter runs and
+filters use it so that the gap between two segments is neither measured
+nor reported as a jump.
+"""
+import numpy as np
+
+from distance_models import consecutive_distances
+
+
+def segment_offsets(segment_ids):
+    """
+    Offsets index of a per-point array of segment ids
+
+    Returns:
+    - int64 array of length segments + 1 starting at 0 and ending at the point count
+    """
+    segment_ids = np.asarray(segment_ids)
+    if not len(segment_ids):
+        return np.zeros(1, dtype=np.int64)
+    starts = np.flatnonzero(segment_ids[1:] != segment_ids[:-1]) + 1
+    return np.concatenate(([0], starts, [len(segment_ids)])).astype(np.int64)
+
+
+def dataframe_offsets(df):
+    """
+    Offsets index of a point DataFrame (a single segment without a 'segment' column)
+    """
+    if 'segment' in df.columns:
+        return segment_offsets(df['segment'].to_numpy())
+    return np.array([0, len(df)], dtype=np.int64)
+
+
+def segment_starts(offsets, n=None):
+    """
+    Boolean mask of the points that start a segment
+    """
+    n = int(offsets[-1]) if n is None else n
+    starts = np.zeros(n, dtype=np.bool_)
+    starts[offsets[:-1][offsets[:-1] < n]] = True
+    return starts
+
+
+def segment_spans(offsets):
+    """
+    (start, stop) point ranges of the non-empty segments
+    """
+    return [(int(start), int(stop)) for start, stop in zip(offsets[:-1], offsets[1:]) if stop > start]
+
+
+def step_distances(lat, lon, offsets, distance_model='haversine'):
+    """
+    Distance in meters from each point to the previous one in its segment
+
+    Returns:
+    - Array with one entry per point, 0 at the first point of every segment
+    """
+    steps = np.zeros(len(lat))
+    if len(lat) > 1:
+        steps[1:] = consecutive_distances(lat, lon, distance_model)
+        steps[segment_starts(offsets, len(lat))] = 0.0
+    return steps